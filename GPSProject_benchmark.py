@@ -0,0 +1,290 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+from haversine import haversine, Unit
+
+import GPSProject_kml
+import GPSProject_program as program
+import GPSProject_synthetic
+
+"""
+Benchmarks for the Fast and Safe Route Planning Project.
+
+Checks the batched haversine kernel of GPSProject_program against the haversine package (the run fails with
+exit status 1 if it is off by more than HAVERSINE_TOLERANCE) and measures the cost per point of both, and
+compares the streaming KML reader with a plain ElementTree parse.
+
+With --stages every stage of the pipeline (parsing, conversion, within_radius, the detectors, the cost function
+and the KML export) is timed on synthetic trips of each of the given sizes. The trips are generated with a fixed
+seed, so the runs are reproducible, and --json writes the results to a file which a later run can be compared
+with (--compare).
+
+Usage: python GPSProject_benchmark.py [--points N] [--kml-points N] [--stages] [--sizes N,N,...] [--json FILE]
+                                      [--compare FILE] [--no-haversine] [--no-kml-reader]
+"""
+
+# version of the layout of the json results
+RESULTS_VERSION = 1
+
+# largest absolute error in meters of haversine_array against the haversine package, a larger one fails the run
+HAVERSINE_TOLERANCE = 1e-6
+
+# stages timed by benchmark_stages(), in the order they are reported. synthesize is the time to generate and
+# write the trip, not a stage of the pipeline.
+STAGES = ('synthesize', 'parse', 'conversion', 'within_radius', 'detect_left_or_right', 'detect_specific_stops',
+          'cost_function', 'kml_export', 'kml_export_simplified')
+
+
+def random_points(count, seed=0):
+    """
+    Random pairs of points, half of them around the start and end of the routes (the short distances used by
+    the detectors) and half of them anywhere on the earth.
+    :param count: number of point pairs
+    :param seed: seed of the random generator
+    :return: two arrays of shape (count, 2)
+    """
+    rng = np.random.default_rng(seed)
+    near = count // 2
+    points1 = np.empty((count, 2))
+    points2 = np.empty((count, 2))
+    points1[:near] = (-77.68016333333334, 43.085848333333324) + rng.normal(0, 0.01, (near, 2))
+    points2[:near] = points1[:near] + rng.normal(0, 0.001, (near, 2))
+    points1[near:, 0] = rng.uniform(-90, 90, count - near)
+    points1[near:, 1] = rng.uniform(-180, 180, count - near)
+    points2[near:, 0] = rng.uniform(-90, 90, count - near)
+    points2[near:, 1] = rng.uniform(-180, 180, count - near)
+    return points1, points2
+
+
+def check_haversine_accuracy(count=100000):
+    """
+    Compares haversine_array with the haversine package on random point pairs.
+    :param count: number of point pairs
+    :return: largest absolute error in meters and largest relative error
+    """
+    points1, points2 = random_points(count)
+    expected = np.array([haversine(tuple(p1), tuple(p2), unit=Unit.METERS) for p1, p2 in zip(points1, points2)])
+    result = program.haversine_array(points1, points2, unit='m')
+    absolute_error = np.abs(result - expected)
+    relative_error = absolute_error / np.maximum(expected, 1e-9)
+    return float(absolute_error.max()), float(relative_error.max())
+
+
+def benchmark_haversine(count=100000, repeat=5):
+    """
+    Measures the cost per point pair of the haversine package and of haversine_array.
+    :param count: number of point pairs
+    :param repeat: number of measurements, the fastest one is used
+    :return: nanoseconds per point pair of the package and of the kernel
+    """
+    points1, points2 = random_points(count)
+    pairs = list(zip(map(tuple, points1), map(tuple, points2)))
+    scalar = min(timeit.repeat(lambda: [haversine(p1, p2, unit=Unit.METERS) for p1, p2 in pairs],
+                               number=1, repeat=repeat))
+    batched = min(timeit.repeat(lambda: program.haversine_array(points1, points2, unit='m'),
+                                number=1, repeat=repeat))
+    return scalar / count * 1e9, batched / count * 1e9
+
+
+def read_coordinates_tree(file):
+    """
+    Reads the coordinates of the LineStrings of a KML file by parsing the whole document with ElementTree, the
+    naive way to read the routes back.
+    :param file: path of the kml file
+    :return: array of shape (n, 3)
+    """
+    tree = ElementTree.parse(file)
+    values = []
+    for element in tree.iter('{http://www.opengis.net/kml/2.2}LineString'):
+        coordinates = element.find('{http://www.opengis.net/kml/2.2}coordinates')
+        values.extend(float(value) for value in coordinates.text.replace(',', ' ').split())
+    return np.array(values).reshape(-1, 3)
+
+
+def measure(function, *args):
+    """
+    :return: result of the function, seconds it took and its peak memory allocation in bytes
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def benchmark_kml_reader(count=500000):
+    """
+    Writes a route of count random coordinates and reads it back with GPSProject_kml.read_coordinates() and with
+    read_coordinates_tree().
+    :param count: number of coordinates of the route
+    :return: size of the file in bytes, and (seconds, peak memory in bytes) of the streaming and the tree reader
+    """
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, "route.kml")
+        with GPSProject_kml.KmlWriter(file) as kml:
+            kml.linestring(-77.6 + rng.random(count) * 0.2, 43.1 + rng.random(count) * 0.1,
+                           np.round(rng.random(count) * 60, 2))
+        streamed, stream_seconds, stream_peak = measure(GPSProject_kml.read_coordinates, file)
+        tree, tree_seconds, tree_peak = measure(read_coordinates_tree, file)
+        if not np.array_equal(np.column_stack(streamed), tree):
+            raise AssertionError("the readers do not agree")
+        return os.path.getsize(file), (stream_seconds, stream_peak), (tree_seconds, tree_peak)
+
+
+def best_time(function, repeat):
+    """
+    :return: seconds of the fastest of repeat calls of the function
+    """
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def benchmark_stages(fixes, repeat=3, seed=0):
+    """
+    Times every stage of the pipeline on a synthetic trip.
+    :param fixes: number of fixes of the trip
+    :param repeat: number of measurements of each stage, the fastest one is used
+    :param seed: seed of the synthetic trip
+    :return: dictionary of stage -> seconds, with the stages of STAGES
+    """
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        track = GPSProject_synthetic.synthetic_track(fixes, seed=seed)
+        file = os.path.join(directory, "synthetic_gps_file.txt")
+        GPSProject_synthetic.write_nmea(file, track, seed=seed)
+        timings['synthesize'] = time.perf_counter() - start
+
+        def parse():
+            with open(file) as handle:
+                return program.read_track(handle)
+
+        timings['parse'] = best_time(parse, repeat)
+        track = parse()
+        raw = GPSProject_synthetic.degrees_minutes(track.latitude)
+        timings['conversion'] = best_time(lambda: program.conversion_array(raw), repeat)
+        start_coordinate = (track.longitude[0], track.latitude[0])
+        end_coordinate = (track.longitude[-1], track.latitude[-1])
+        timings['within_radius'] = best_time(lambda: program.within_radius(start_coordinate, end_coordinate), repeat)
+
+        first = program.first_moving_index(track)
+        timings['detect_left_or_right'] = best_time(lambda: program.detect_left_or_right(track, first, [], 30),
+                                                    repeat)
+        timings['detect_specific_stops'] = best_time(
+            lambda: program.detect_specific_stops(track, [], [], [], first), repeat)
+        left_right_coordinates = program.detect_left_or_right(track, first, [], 30)
+        stop_signs, traffic_signals, errands, time_at_stops = program.detect_specific_stops(track, [], [], [], first)
+        trip_time = program.trip_duration(track)
+
+        def cost():
+            with contextlib.redirect_stdout(io.StringIO()):
+                return program.cost_function(trip_time, track, stop_signs, traffic_signals, errands, time_at_stops,
+                                             left_right_coordinates)
+
+        timings['cost_function'] = best_time(cost, repeat)
+        timings['kml_export'] = best_time(lambda: program.write_trip_kml(track, "route", directory), repeat)
+        timings['kml_export_simplified'] = best_time(lambda: program.write_trip_kml(track, "route", directory, 1.0),
+                                                     repeat)
+    return timings
+
+
+def environment():
+    """
+    :return: description of the machine and the versions, stored with the json results
+    """
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def compare_results(results, previous):
+    """
+    Prints the time of every stage relative to a previous run, e.g. '1.52x' when it got 52% slower.
+    :param results: json results of this run
+    :param previous: json results of the previous run
+    :return:
+    """
+    old = {(row['fixes'], row['stage']): row['seconds'] for row in previous.get('stages', [])}
+    print("fixes      stage                   seconds     previous    ratio")
+    for row in results['stages']:
+        before = old.get((row['fixes'], row['stage']))
+        if before is None:
+            continue
+        print("{0:<10} {1:<23} {2:<11.6f} {3:<11.6f} {4:.2f}x".format(row['fixes'], row['stage'], row['seconds'],
+                                                                     before, row['seconds'] / max(before, 1e-12)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the route planning pipeline.")
+    parser.add_argument("--points", type=int, default=100000, help="number of point pairs for the haversine checks")
+    parser.add_argument("--kml-points", type=int, default=500000, help="number of coordinates of the kml benchmark")
+    parser.add_argument("--stages", action="store_true", help="time the stages of the pipeline on synthetic trips")
+    parser.add_argument("--no-haversine", action="store_true",
+                        help="skip the haversine accuracy check and benchmark, e.g. for a quick --stages run")
+    parser.add_argument("--no-kml-reader", action="store_true", help="skip the kml reader benchmark")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        help="comma separated numbers of fixes of the synthetic trips, e.g. 1000,10000000")
+    parser.add_argument("--repeat", type=int, default=3, help="measurements per stage, the fastest one is used")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic trips")
+    parser.add_argument("--json", metavar="FILE", help="write the results to a json file")
+    parser.add_argument("--compare", metavar="FILE", help="compare the stages with the json results of an older run")
+    args = parser.parse_args(argv)
+    results = {'version': RESULTS_VERSION, 'environment': environment()}
+
+    if not args.no_haversine:
+        absolute_error, relative_error = check_haversine_accuracy(args.points)
+        print("haversine_array max error: ", absolute_error, "m (relative ", relative_error, ")")
+        if not absolute_error <= HAVERSINE_TOLERANCE:
+            sys.exit("haversine_array is off by {0} m, more than the tolerance of {1} m".format(
+                absolute_error, HAVERSINE_TOLERANCE))
+        scalar, batched = benchmark_haversine(args.points)
+        print("haversine package: ", round(scalar, 1), "ns/point")
+        print("haversine_array:   ", round(batched, 1), "ns/point", " ----> speedup: ", round(scalar / batched, 1))
+        results['haversine'] = {'points': args.points, 'max_error_m': absolute_error, 'package_ns': scalar,
+                                'batched_ns': batched}
+
+    if not args.no_kml_reader:
+        size, (stream_seconds, stream_peak), (tree_seconds, tree_peak) = benchmark_kml_reader(args.kml_points)
+        print("kml file: ", round(size / 1024 ** 2, 1), "MB")
+        print("streaming reader: ", round(stream_seconds, 3), "s, peak", round(stream_peak / 1024 ** 2, 1), "MB")
+        print("ElementTree:      ", round(tree_seconds, 3), "s, peak", round(tree_peak / 1024 ** 2, 1), "MB")
+        results['kml_reader'] = {'points': args.kml_points, 'bytes': size, 'streaming_seconds': stream_seconds,
+                                 'streaming_peak_bytes': stream_peak, 'tree_seconds': tree_seconds,
+                                 'tree_peak_bytes': tree_peak}
+
+    if args.stages:
+        results['seed'] = args.seed
+        results['repeat'] = args.repeat
+        results['stages'] = []
+        print("fixes      stage                   seconds     ns/fix")
+        for fixes in (int(size) for size in args.sizes.split(",")):
+            timings = benchmark_stages(fixes, args.repeat, args.seed)
+            for stage, seconds in ((stage, timings[stage]) for stage in STAGES):
+                results['stages'].append({'fixes': fixes, 'stage': stage, 'seconds': seconds,
+                                          'ns_per_fix': seconds / fixes * 1e9})
+                print("{0:<10} {1:<23} {2:<11.6f} {3:.1f}".format(fixes, stage, seconds, seconds / fixes * 1e9))
+                sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(results, handle, indent=2)
+    if args.compare and args.stages:
+        with open(args.compare) as handle:
+            compare_results(results, json.load(handle))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+"""
+On-disk cache of the parsed tracks and detection results of the Fast and Safe Route Planning Project.
+
+Every entry is a .npz file (numpy arrays, no pickles) named after the sha256 of the text file's content and a
+version string. Changing the version (e.g. when the detector thresholds change) makes every old entry miss, and
+the old entries are then removed by the least recently used eviction. Reading an entry updates its modification
+time, which is used as the time of last use.
+"""
+
+
+class ParseCache:
+    """
+    Content addressed cache of arrays, limited to max_bytes on disk.
+    """
+
+    def __init__(self, directory, max_bytes=1024 ** 3, version=""):
+        """
+        :param directory: directory of the cache, created if needed
+        :param max_bytes: size limit of the cache, enforced by evict()
+        :param version: version of the parser and detectors, part of every key
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = str(version)
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, file):
+        """
+        Hashes the content of a file in chunks, so the file is never loaded into memory at once.
+        :param file: path of the file
+        :return: key of the file
+        """
+        digest = hashlib.sha256(self.version.encode() + b"\0")
+        with open(file, "rb") as handle:
+            for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def key_data(self, data):
+        """
+        :param data: content of a file which is already in memory, e.g. read from an archive
+        :return: key of the content, the same as key() of a file with that content
+        """
+        return hashlib.sha256(self.version.encode() + b"\0" + data).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        """
+        :param key: key from key()
+        :return: dictionary of arrays, or None if the key is not cached
+        """
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            # missing, evicted by another process or truncated
+            return None
+        return arrays
+
+    def save(self, key, arrays):
+        """
+        Writes an entry. The entry is written to a temporary file first, so other processes never see a
+        partially written entry.
+        :param key: key from key()
+        :param arrays: dictionary of arrays
+        :return:
+        """
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                np.savez(file, **arrays)
+            os.replace(temporary, self.path(key))
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def entries(self):
+        """
+        :return: list of (time of last use, size, path) of every entry
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is smaller than max_bytes.
+        :return: number of removed entries
+        """
+        entries = sorted(self.entries())
+        size = sum(entry[1] for entry in entries)
+        removed = 0
+        for mtime, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """
+        Removes every entry, e.g. after the detector thresholds were changed without changing the version.
+        :return:
+        """
+        for mtime, size, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,393 @@
+import argparse
+import heapq
+import os
+import time
+
+import numpy as np
+
+import GPSProject_hazards
+import GPSProject_ingest
+import GPSProject_kml
+import GPSProject_program as program
+
+"""
+Road graph of the Fast and Safe Route Planning Project.
+
+The best route of GPSProject_program is the recorded trip with the lowest cost, so a route can never combine the
+fast part of one trip with the fast part of another. The road graph joins the trips where they meet: the turns
+and stops of every trip are clustered on the grid of GPSProject_hazards.HazardIndex into nodes (one node per
+intersection, whatever the hazards seen there), the start and end points of within_radius() are two more nodes,
+and every trip adds a directed edge between the nodes it passes one after the other.
+
+An edge carries the mean of the observed travel times and of the costs of the trips which drove it. The cost of
+a piece of trip is trip_cost() of its travel time, the time spent at the stop at its end and the turn at its end,
+and trip_cost() is linear, so the costs of the edges of a route add up to the cost of the whole route. The times
+are seconds (not the hhmmss difference of trip_duration()), so that they add up over midnight and the hour too.
+
+route() runs A* from one node to another. The heuristic is the cost of driving the straight (haversine) distance
+to the target at the highest speed observed on any edge, which never overestimates, so the route is the
+cheapest one of the graph. A query only touches the nodes around the route, which takes milliseconds even for a
+graph of thousands of trips.
+
+Usage: python GPSProject_graph.py [--jobs N] [--cache DIR] [--radius M] [--graph FILE] [--kml FILE] [--reverse]
+"""
+
+# kinds of the hazards at the nodes, in the order of the columns of RoadGraph.node_hazards
+KINDS = GPSProject_hazards.KINDS
+
+# nodes of the start and end points of within_radius()
+START_NODE = 0
+END_NODE = 1
+
+
+def trip_events(path, filename, cache=None, skip_size=30, data=None):
+    """
+    Finds the turns and stops of one trip, in the order they were passed. This is the unit of work handed to the
+    worker processes.
+    :param path: directory of the text files
+    :param filename: name of the text or track file
+    :param cache: ParseCache or None
+    :param skip_size: window size of the turn detector
+    :param data: content of the text file if it was read already, e.g. from an archive
+    :return: dictionary with the file_name, forward (True if the trip starts at coord1), the start and end
+             (longitude, latitude, seconds) of the trip and the arrays kind (index into KINDS), longitude,
+             latitude, seconds and dwell of the hazards, or None for an invalid trip
+    """
+    track = program.load_track(path, filename, cache, data)
+    if len(track) < 2 or program.rejection_reason(track) is not None:
+        return None
+    index, kind, dwell = program.track_events(track, skip_size)
+    seconds = program.seconds_of_day(track.time)
+    forward, backward = program.endpoint_distances((track.longitude[0], track.latitude[0]),
+                                                   (track.longitude[-1], track.latitude[-1]))
+    return {'file_name': filename,
+            'forward': bool(forward.max() <= backward.max()),
+            'start': (float(track.longitude[0]), float(track.latitude[0]), float(seconds[0])),
+            'end': (float(track.longitude[-1]), float(track.latitude[-1]), float(seconds[-1])),
+            'kind': kind,
+            'longitude': track.longitude[index],
+            'latitude': track.latitude[index],
+            'seconds': seconds[index],
+            'dwell': dwell}
+
+
+def collect_events(path, filenames=None, jobs=1, cache=None, skip_size=30, threads=4):
+    """
+    Generator over the events of every file of an input root, in the order of GPSProject_ingest.iter_inputs().
+    :param path: input root, a directory, tar archive or single log
+    :param filenames: names of the files, every file of the directory if None
+    :param jobs: number of worker processes, 1 reads the trips serially in this process
+    :param cache: ParseCache or None
+    :param skip_size: window size of the turn detector
+    :param threads: number of threads decompressing the compressed files of a directory
+    :return: generator of the dictionaries of trip_events(), None for invalid trips
+    """
+    yield from GPSProject_ingest.map_inputs(trip_events, path, filenames, jobs, threads, cache, skip_size)
+
+
+class RoadGraph:
+    """
+    Directed graph of the places where the trips turned or stopped. Add the trips with add_trip(), then call
+    finish() once before routing.
+    """
+
+    def __init__(self, merge_radius=30.0):
+        """
+        :param merge_radius: turns and stops closer than this (in meters) are the same node
+        """
+        self.merge_radius = merge_radius
+        self.index = GPSProject_hazards.HazardIndex(merge_radius)
+        self.index.add('endpoint', [program.COORD1[0], program.COORD2[0]], [program.COORD1[1], program.COORD2[1]],
+                       [0.0, 0.0])
+        self.trip_count = 0
+        self.trips = []  # (nodes, seconds, kinds, dwell) arrays of every trip, from the first to the last node
+        self.hazard_nodes = []
+        self.hazard_kinds = []
+
+        # set by finish()
+        self.longitude = None
+        self.latitude = None
+        self.node_hazards = None
+        self.offsets = None
+        self.target = None
+        self.seconds = None
+        self.cost = None
+        self.count = None
+        self.max_speed = None
+        self.adjacency = None
+
+    def __len__(self):
+        if self.longitude is not None:
+            return len(self.longitude)
+        return len(self.index)
+
+    def add_trip(self, events):
+        """
+        Adds the hazards of one trip, which become nodes of the graph. The edges are built by finish().
+        :param events: dictionary from trip_events()
+        :return:
+        """
+        nodes = self.index.add('node', events['longitude'], events['latitude'], events['dwell'], self.trip_count)
+        self.trip_count += 1
+        self.hazard_nodes.extend(nodes)
+        self.hazard_kinds.extend(np.asarray(events['kind']).tolist())
+
+        first, last = (START_NODE, END_NODE) if events['forward'] else (END_NODE, START_NODE)
+        self.trips.append((np.array([first] + nodes + [last], dtype=np.int64),
+                           np.concatenate(([events['start'][2]], events['seconds'], [events['end'][2]])),
+                           np.concatenate(([-1], events['kind'], [-1])),
+                           np.concatenate(([0.0], events['dwell'], [0.0]))))
+
+    @staticmethod
+    def trip_pieces(nodes, seconds, kind, dwell):
+        """
+        Hazards of a trip which fall on the same node one after the other (e.g. a stop sign right before a turn)
+        are one visit of the node.
+        :param nodes: node of every hazard, with the first and last node of the trip
+        :param seconds: seconds of the day of every hazard
+        :param kind: index in KINDS of every hazard, -1 for the first and last node
+        :param dwell: time spent at every hazard
+        :return: (source, target, seconds, cost) arrays of the pieces of the trip between two visits
+        """
+        # one visit per run of equal nodes, with the time of its first hazard and the penalties of all its hazards
+        visit = np.concatenate(([0], np.cumsum(nodes[1:] != nodes[:-1])))
+        starts = np.flatnonzero(np.diff(visit, prepend=-1) != 0)
+        visit_nodes = nodes[starts]
+        visit_seconds = seconds[starts]
+        turns = np.bincount(visit, weights=kind == 0, minlength=len(starts))
+        stop_seconds = np.bincount(visit, weights=dwell * (kind > 0), minlength=len(starts))
+
+        travel = (visit_seconds[1:] - visit_seconds[:-1]) % 86400
+        cost = program.trip_cost(travel, stop_seconds[1:], turns[1:])
+        return visit_nodes[:-1], visit_nodes[1:], travel, cost
+
+    def finish(self):
+        """
+        Merges the nodes which drifted together (see HazardIndex.consolidate()) and then the edges of all trips,
+        an edge gets the mean travel time and cost of the trips which drove it.
+        :return:
+        """
+        mapping = self.index.consolidate()
+        self.hazard_nodes = mapping[np.array(self.hazard_nodes, dtype=np.int64)].tolist()
+        self.trips = [(mapping[nodes], seconds, kind, dwell) for nodes, seconds, kind, dwell in self.trips]
+
+        count = len(self.index)
+        self.longitude = np.array(self.index.longitude)
+        self.latitude = np.array(self.index.latitude)
+        self.node_hazards = np.zeros((count, len(KINDS)), dtype=np.int64)
+        np.add.at(self.node_hazards, (np.array(self.hazard_nodes, dtype=np.int64),
+                                      np.array(self.hazard_kinds, dtype=np.int64)), 1)
+
+        if self.trips:
+            pieces = [self.trip_pieces(*trip) for trip in self.trips]
+            source, target, seconds, cost = (np.concatenate(column) for column in zip(*pieces))
+        else:
+            source = target = np.empty(0, dtype=np.int64)
+            seconds = cost = np.empty(0)
+        # the travel times wrap around midnight (% 86400), so they are never negative; a piece of 0 seconds (two
+        # nodes at the same time, e.g. repeated fixes) says nothing about the road
+        keep = seconds > 0
+        pairs, inverse, edge_count = np.unique(np.column_stack((source[keep], target[keep])), axis=0,
+                                               return_inverse=True, return_counts=True)
+        inverse = inverse.reshape(-1)
+        pairs = pairs.reshape(-1, 2)
+        self.set_edges(self.longitude, self.latitude, self.node_hazards, pairs[:, 0], pairs[:, 1],
+                       np.bincount(inverse, weights=seconds[keep], minlength=len(pairs)) / np.maximum(edge_count, 1),
+                       np.bincount(inverse, weights=cost[keep], minlength=len(pairs)) / np.maximum(edge_count, 1),
+                       edge_count)
+
+    def set_edges(self, longitude, latitude, node_hazards, source, target, seconds, cost, count):
+        """
+        Sets the nodes and edges (sorted by source) and builds the adjacency lists used by route().
+        """
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.node_hazards = np.asarray(node_hazards, dtype=np.int64).reshape(len(self.longitude), len(KINDS))
+        order = np.argsort(source, kind='stable')
+        source = np.asarray(source, dtype=np.int64)[order]
+        self.target = np.asarray(target, dtype=np.int64)[order]
+        self.seconds = np.asarray(seconds, dtype=np.float64)[order]
+        self.cost = np.asarray(cost, dtype=np.float64)[order]
+        self.count = np.asarray(count, dtype=np.int64)[order]
+        self.offsets = np.searchsorted(source, np.arange(len(self.longitude) + 1))
+
+        # the highest speed of any edge, in meters per second, bounds the cost of the rest of a route
+        length = program.haversine_array(np.column_stack((self.latitude[source], self.longitude[source])),
+                                         np.column_stack((self.latitude[self.target], self.longitude[self.target])),
+                                         unit='m')
+        self.max_speed = float(np.max(length / self.seconds)) if len(source) else 0.0
+
+        targets = self.target.tolist()
+        costs = self.cost.tolist()
+        offsets = self.offsets.tolist()
+        self.adjacency = [list(zip(targets[offsets[node]:offsets[node + 1]], costs[offsets[node]:offsets[node + 1]]))
+                          for node in range(len(self.longitude))]
+
+    def edge_count(self):
+        """
+        :return: number of edges of the finished graph
+        """
+        return len(self.target)
+
+    def save(self, file):
+        """
+        Writes the finished graph to a .npz file.
+        :param file: path of the file
+        :return:
+        """
+        source = np.repeat(np.arange(len(self.longitude)), np.diff(self.offsets))
+        with open(file, "wb") as handle:
+            np.savez(handle, merge_radius=self.merge_radius, trip_count=self.trip_count, longitude=self.longitude,
+                     latitude=self.latitude, node_hazards=self.node_hazards, source=source, target=self.target,
+                     seconds=self.seconds, cost=self.cost, count=self.count)
+
+    @classmethod
+    def load(cls, file):
+        """
+        :param file: path of a file written by save()
+        :return: RoadGraph ready for routing (trips can not be added to it)
+        """
+        with np.load(file) as arrays:
+            graph = cls(float(arrays['merge_radius']))
+            graph.trip_count = int(arrays['trip_count'])
+            graph.set_edges(arrays['longitude'], arrays['latitude'], arrays['node_hazards'], arrays['source'],
+                            arrays['target'], arrays['seconds'], arrays['cost'], arrays['count'])
+        return graph
+
+    def nearest(self, longitude, latitude):
+        """
+        :return: the node closest to the point and its distance in meters
+        """
+        distances = program.haversine_array((latitude, longitude), np.column_stack((self.latitude, self.longitude)),
+                                            unit='m')
+        node = int(np.argmin(distances))
+        return node, float(distances[node])
+
+    def heuristic(self, target):
+        """
+        :return: list with a lower bound of the cost from every node to the target
+        """
+        if self.max_speed <= 0:
+            return [0.0] * len(self.longitude)
+        distances = program.haversine_array((self.latitude[target], self.longitude[target]),
+                                            np.column_stack((self.latitude, self.longitude)), unit='m')
+        return program.trip_cost(distances / self.max_speed, 0, 0).tolist()
+
+    def route(self, source=START_NODE, target=END_NODE):
+        """
+        A* search of the cheapest route between two nodes.
+        :param source: node of the start
+        :param target: node of the end
+        :return: list of the nodes of the route and its cost, or None and inf if the target can not be reached
+        """
+        remaining = self.heuristic(target)
+        best = {source: 0.0}
+        previous = {source: None}
+        done = set()
+        heap = [(remaining[source], source)]
+        while heap:
+            _, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if node in done:
+                continue
+            done.add(node)
+            cost = best[node]
+            for neighbour, edge_cost in self.adjacency[node]:
+                new_cost = cost + edge_cost
+                if new_cost < best.get(neighbour, float('inf')):
+                    best[neighbour] = new_cost
+                    previous[neighbour] = node
+                    heapq.heappush(heap, (new_cost + remaining[neighbour], neighbour))
+        if target not in best:
+            return None, float('inf')
+
+        nodes = [target]
+        while previous[nodes[-1]] is not None:
+            nodes.append(previous[nodes[-1]])
+        return nodes[::-1], best[target]
+
+    def route_edges(self, nodes):
+        """
+        :param nodes: nodes of a route
+        :return: array of the edge ids between the consecutive nodes
+        """
+        edges = []
+        for source, target in zip(nodes[:-1], nodes[1:]):
+            first, last = self.offsets[source], self.offsets[source + 1]
+            edges.append(first + int(np.flatnonzero(self.target[first:last] == target)[0]))
+        return np.array(edges, dtype=np.int64)
+
+
+def build_graph(events, merge_radius=30.0):
+    """
+    Builds the road graph of all valid trips.
+    :param events: dictionaries from trip_events() or collect_events(), None for invalid trips is skipped
+    :param merge_radius: turns and stops closer than this (in meters) are the same node
+    :return: finished RoadGraph
+    """
+    graph = RoadGraph(merge_radius)
+    for trip in events:
+        if trip is not None:
+            graph.add_trip(trip)
+    graph.finish()
+    return graph
+
+
+def save_kml(graph, nodes, file):
+    """
+    Creates a kml file with the route and the hazards seen at its nodes, with the same markers as
+    all_stops_together().
+    :param graph: RoadGraph
+    :param nodes: nodes of the route
+    :param file: path of the kml file
+    :return:
+    """
+    nodes = np.asarray(nodes, dtype=np.int64)
+    with GPSProject_kml.KmlWriter(file) as kml:
+        kml.line_style("route", GPSProject_kml.YELLOW, 4)
+        kml.hazard_styles()
+        kml.linestring(graph.longitude[nodes], graph.latitude[nodes], np.zeros(len(nodes)),
+                       description="Best route of the road graph", style_id="route")
+        for code, kind in enumerate(KINDS):
+            seen = nodes[graph.node_hazards[nodes, code] > 0]
+            kml.points(zip(graph.longitude[seen].tolist(), graph.latitude[seen].tolist()), kind)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Routes over the road graph of all trips.",
+                                     parents=[program.input_arguments()])
+    parser.add_argument("--radius", type=float, default=30.0, help="merge radius of the nodes in meters")
+    parser.add_argument("--graph", metavar="FILE", help="npz file of the graph, built and saved if it does not exist")
+    parser.add_argument("--kml", default="GPS_Best_graph_route.kml", help="kml file of the route")
+    parser.add_argument("--reverse", action="store_true", help="route from coord2 to coord1")
+    args = parser.parse_args(argv)
+
+    if args.graph and os.path.exists(args.graph):
+        graph = RoadGraph.load(args.graph)
+    else:
+        jobs, cache = program.open_inputs(args)
+        started = time.perf_counter()
+        graph = build_graph(collect_events(args.input, jobs=jobs, cache=cache), args.radius)
+        print("graph built in {0:.2f} s".format(time.perf_counter() - started))
+        if args.graph:
+            graph.save(args.graph)
+    print("trips: ", graph.trip_count, " nodes: ", len(graph.longitude), " edges: ", graph.edge_count())
+
+    source, target = (END_NODE, START_NODE) if args.reverse else (START_NODE, END_NODE)
+    started = time.perf_counter()
+    nodes, cost = graph.route(source, target)
+    elapsed = time.perf_counter() - started
+    if nodes is None:
+        print("no route, query took {0:.2f} ms".format(elapsed * 1000))
+        return
+    edges = graph.route_edges(nodes)
+    hazards = graph.node_hazards[nodes[1:-1]] > 0
+    print("route of", len(nodes), "nodes found in {0:.2f} ms".format(elapsed * 1000))
+    print("travel time: ", graph.seconds[edges].sum() / 60, "mins", " ----> cost: ", cost)
+    print(", ".join("{0}: {1}".format(kind, int(count)) for kind, count in zip(KINDS, hazards.sum(axis=0))))
+    save_kml(graph, nodes, args.kml)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+import argparse
+import math
+
+import numpy as np
+
+import GPSProject_kml
+import GPSProject_program as program
+
+"""
+Cross-trip hazard index of the Fast and Safe Route Planning Project.
+
+The detectors find the turns, stop signs, traffic signals and errands of every trip separately, so the same
+intersection shows up once per trip (and at slightly different coordinates every time). The index merges the
+detections of all trips into one hazard per place and kind, with the number of observations and the mean time
+spent there.
+
+The hazards are kept in a grid of cells about merge_radius meters wide. A new detection is only compared with the
+hazards of its own and the 8 neighbouring cells, so building the index is linear in the number of detections
+instead of comparing every pair of detections. Merging one detection at a time moves the hazards to the mean of
+their detections, which can bring two hazards of the same kind within merge_radius of each other, so
+consolidate() merges those once all trips are added.
+
+Usage: python GPSProject_hazards.py [--jobs N] [--cache DIR] [--radius M] [--kml FILE]
+"""
+
+KINDS = ('left_right', 'stop_sign', 'traffic_signal', 'errand')
+
+# meters per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111320.0
+
+HAZARD = np.dtype([('kind', 'U14'), ('longitude', np.float64), ('latitude', np.float64),
+                   ('observations', np.int64), ('trips', np.int64), ('mean_dwell', np.float64),
+                   ('distance', np.float64)])
+
+
+def trip_hazards(record):
+    """
+    Extracts the hazards of one trip from its result record.
+    :param record: result record from GPSProject_program.process_file() or score_track()
+    :return: list of (kind, longitudes, latitudes, dwell times) with one array entry per hazard
+    """
+    _, stop_kind, dwell = program.stop_events(record['stop_segments'])
+    turns = np.array(record['left_right_coordinates'], dtype=np.float64).reshape(-1, 2)
+    hazards = [('left_right', turns[:, 0], turns[:, 1], np.zeros(len(turns)))]
+    for code, kind in enumerate(KINDS[1:], 1):
+        # the stops of a kind are in the order of the segments, like their coordinates in the record
+        points = np.array(record[kind + 's'], dtype=np.float64).reshape(-1, 5)
+        hazards.append((kind, points[:, 0], points[:, 1], dwell[stop_kind == code]))
+    return hazards
+
+
+class HazardIndex:
+    """
+    Hazards of all trips, merged on a spatial grid.
+    """
+
+    def __init__(self, merge_radius=25.0):
+        """
+        :param merge_radius: detections of the same kind closer than this (in meters) are one hazard
+        """
+        self.merge_radius = merge_radius
+        self.cell_degrees = merge_radius / METERS_PER_DEGREE  # height of a cell in degrees of latitude
+        self.kind = []
+        self.longitude = []
+        self.latitude = []
+        self.observations = []
+        self.trips = []
+        self.total_dwell = []
+        self.last_trip = []
+        self.cells = []  # cell of the current position of every hazard
+        self.grid = {}  # cell -> ids of the hazards whose current position is in it
+        self.trip_count = 0
+
+    def __len__(self):
+        return len(self.kind)
+
+    def cell(self, longitude, latitude):
+        """
+        Cells are cell_degrees high and about as wide in meters, so they get wider in degrees of longitude away
+        from the equator.
+        :return: (row, column) of the cell of the point
+        """
+        row = math.floor(latitude / self.cell_degrees)
+        width = self.cell_degrees / max(math.cos(math.radians((row + 0.5) * self.cell_degrees)), 1e-6)
+        return row, math.floor(longitude / width)
+
+    def neighbours(self, row, column, rings=1):
+        """
+        Generator over the ids of the hazards in the cells around a cell. The neighbouring rows can have a
+        different cell width, so their columns are found from the longitude of the center of the cell.
+        """
+        width = self.cell_degrees / max(math.cos(math.radians((row + 0.5) * self.cell_degrees)), 1e-6)
+        longitude = (column + 0.5) * width
+        for other_row in range(row - rings, row + rings + 1):
+            other_width = self.cell_degrees / max(math.cos(math.radians((other_row + 0.5) * self.cell_degrees)),
+                                                  1e-6)
+            center = math.floor(longitude / other_width)
+            for other_column in range(center - rings - 1, center + rings + 2):
+                yield from self.grid.get((other_row, other_column), ())
+
+    def add(self, kind, longitudes, latitudes, dwell, trip=None):
+        """
+        Adds the detections of one kind. Each detection is merged into the closest hazard of the same kind
+        within merge_radius, whose position becomes the mean of its detections, or else starts a new hazard.
+        :param kind: one of KINDS
+        :param longitudes: array of longitudes
+        :param latitudes: array of latitudes
+        :param dwell: array of the time spent at each detection
+        :param trip: id of the trip, used to count the trips which observed a hazard
+        :return: list with the id of the hazard of every detection
+        """
+        ids = []
+        for longitude, latitude, time in zip(np.asarray(longitudes).tolist(), np.asarray(latitudes).tolist(),
+                                             np.asarray(dwell).tolist()):
+            row, column = self.cell(longitude, latitude)
+            # the merge radius is a few meters, so a flat projection around the detection is accurate enough
+            scale = math.cos(math.radians(latitude))
+            hazard = None
+            closest = self.merge_radius ** 2
+            for i in self.neighbours(row, column):
+                if self.kind[i] != kind:
+                    continue
+                dx = (self.longitude[i] - longitude) * scale * METERS_PER_DEGREE
+                dy = (self.latitude[i] - latitude) * METERS_PER_DEGREE
+                if dx * dx + dy * dy <= closest:
+                    hazard = i
+                    closest = dx * dx + dy * dy
+
+            if hazard is None:
+                ids.append(len(self.kind))
+                self.grid.setdefault((row, column), []).append(len(self.kind))
+                self.cells.append((row, column))
+                self.kind.append(kind)
+                self.longitude.append(longitude)
+                self.latitude.append(latitude)
+                self.observations.append(1)
+                self.trips.append(1)
+                self.total_dwell.append(time)
+                self.last_trip.append(trip)
+                continue
+
+            ids.append(hazard)
+            count = self.observations[hazard] + 1
+            self.longitude[hazard] += (longitude - self.longitude[hazard]) / count
+            self.latitude[hazard] += (latitude - self.latitude[hazard]) / count
+            self.observations[hazard] = count
+            self.total_dwell[hazard] += time
+            if trip is None or self.last_trip[hazard] != trip:
+                self.trips[hazard] += 1
+                self.last_trip[hazard] = trip
+            self.move(hazard)
+        return ids
+
+    def move(self, hazard):
+        """
+        Files a hazard under the cell of its current position, after its position changed.
+        """
+        cell = self.cell(self.longitude[hazard], self.latitude[hazard])
+        if cell != self.cells[hazard]:
+            self.grid[self.cells[hazard]].remove(hazard)
+            self.grid.setdefault(cell, []).append(hazard)
+            self.cells[hazard] = cell
+
+    def consolidate(self):
+        """
+        Merges the hazards of the same kind within merge_radius of each other, which add() leaves behind when the
+        means of two hazards drift together. Close hazards are grouped transitively (union-find) and every group
+        becomes one hazard at the mean of all its detections, repeated until no two hazards of a kind are that
+        close. The merged hazards keep the id order of their smallest id, so hazards which were not merged keep
+        their order.
+        :return: array with the new id of every old hazard id
+        """
+        mapping = np.arange(len(self.kind))
+        while True:
+            parent = list(range(len(self.kind)))
+
+            def find(i):
+                while parent[i] != i:
+                    parent[i] = parent[parent[i]]
+                    i = parent[i]
+                return i
+
+            merged = False
+            for i, (row, column) in enumerate(self.cells):
+                scale = math.cos(math.radians(self.latitude[i]))
+                for j in self.neighbours(row, column):
+                    if j <= i or self.kind[j] != self.kind[i]:
+                        continue
+                    dx = (self.longitude[j] - self.longitude[i]) * scale * METERS_PER_DEGREE
+                    dy = (self.latitude[j] - self.latitude[i]) * METERS_PER_DEGREE
+                    if dx * dx + dy * dy <= self.merge_radius ** 2:
+                        first, second = find(i), find(j)
+                        if first != second:
+                            parent[max(first, second)] = min(first, second)
+                            merged = True
+            if not merged:
+                return mapping
+
+            roots = [find(i) for i in range(len(self.kind))]
+            new_ids = {}
+            for root in roots:
+                new_ids.setdefault(root, len(new_ids))
+            renumber = np.array([new_ids[root] for root in roots], dtype=np.int64)
+            mapping = renumber[mapping]
+            self.merge_groups(renumber, len(new_ids))
+
+    def merge_groups(self, renumber, count):
+        """
+        Replaces the hazards by one hazard per group, at the mean position of the detections of the group.
+        :param renumber: new id of every hazard, hazards with the same new id are one group
+        :param count: number of groups
+        """
+        observations = np.bincount(renumber, weights=self.observations, minlength=count)
+        longitude = np.bincount(renumber, weights=np.multiply(self.longitude, self.observations), minlength=count)
+        latitude = np.bincount(renumber, weights=np.multiply(self.latitude, self.observations), minlength=count)
+        kind = [None] * count
+        trips = [0] * count
+        last_trip = [None] * count
+        for i, new in enumerate(renumber.tolist()):
+            kind[new] = self.kind[i]
+            trips[new] += self.trips[i]
+            # the same trip at two merged hazards is one trip (only noticed when it was the last trip of both)
+            if i != new and self.last_trip[i] is not None and self.last_trip[i] == last_trip[new]:
+                trips[new] -= 1
+            if last_trip[new] is None or (self.last_trip[i] is not None and self.last_trip[i] > last_trip[new]):
+                last_trip[new] = self.last_trip[i]
+        self.kind = kind
+        self.longitude = (longitude / observations).tolist()
+        self.latitude = (latitude / observations).tolist()
+        self.observations = observations.astype(np.int64).tolist()
+        self.trips = trips
+        self.total_dwell = np.bincount(renumber, weights=self.total_dwell, minlength=count).tolist()
+        self.last_trip = last_trip
+        self.cells = [self.cell(longitude, latitude) for longitude, latitude in zip(self.longitude, self.latitude)]
+        self.grid = {}
+        for i, cell in enumerate(self.cells):
+            self.grid.setdefault(cell, []).append(i)
+
+    def add_trip(self, record):
+        """
+        Adds all hazards of one trip.
+        :param record: result record from GPSProject_program.process_file() or score_track()
+        :return:
+        """
+        trip = self.trip_count
+        self.trip_count += 1
+        for kind, longitudes, latitudes, dwell in trip_hazards(record):
+            self.add(kind, longitudes, latitudes, dwell, trip)
+
+    def hazards(self, ids=None):
+        """
+        :param ids: ids of the hazards, all hazards if None
+        :return: structured array of HAZARD
+        """
+        if ids is None:
+            ids = range(len(self.kind))
+        ids = list(ids)
+        table = np.zeros(len(ids), dtype=HAZARD)
+        table['kind'] = [self.kind[i] for i in ids]
+        table['longitude'] = [self.longitude[i] for i in ids]
+        table['latitude'] = [self.latitude[i] for i in ids]
+        table['observations'] = [self.observations[i] for i in ids]
+        table['trips'] = [self.trips[i] for i in ids]
+        table['mean_dwell'] = np.divide([self.total_dwell[i] for i in ids], table['observations'],
+                                        out=np.zeros(len(ids)), where=table['observations'] > 0)
+        return table
+
+    def candidates(self, longitude, latitude, radius):
+        """
+        :return: ids of the hazards which can be within radius meters of the point
+        """
+        # the hazards are filed under the cell of their current position, which is at most radius away
+        rings = max(1, int(math.ceil(radius / self.merge_radius)))
+        row, column = self.cell(longitude, latitude)
+        return sorted(set(self.neighbours(row, column, rings)))
+
+    def within(self, longitude, latitude, radius):
+        """
+        Finds the hazards within radius meters of a point.
+        :param longitude: longitude of the point
+        :param latitude: latitude of the point
+        :param radius: radius in meters
+        :return: structured array of HAZARD, closest first
+        """
+        table = self.hazards(self.candidates(longitude, latitude, radius))
+        table['distance'] = program.haversine_array((latitude, longitude),
+                                                    np.column_stack((table['latitude'], table['longitude'])),
+                                                    unit='m')
+        table = table[table['distance'] <= radius]
+        return table[np.argsort(table['distance'], kind='stable')]
+
+    def near_segment(self, start, end, radius):
+        """
+        Finds the hazards within radius meters of the segment between two points. The distance to the segment is
+        measured in a local flat projection, which is accurate for segments of a few kilometers.
+        :param start: (longitude, latitude) of the start of the segment
+        :param end: (longitude, latitude) of the end of the segment
+        :param radius: radius in meters
+        :return: structured array of HAZARD, closest first
+        """
+        middle = ((start[0] + end[0]) / 2, (start[1] + end[1]) / 2)
+        half_length = float(program.haversine_array((start[1], start[0]), (end[1], end[0]), unit='m')) / 2
+        table = self.hazards(self.candidates(middle[0], middle[1], half_length + radius))
+
+        scale = METERS_PER_DEGREE * math.cos(math.radians(middle[1]))
+        ax, ay = (start[0] - middle[0]) * scale, (start[1] - middle[1]) * METERS_PER_DEGREE
+        bx, by = (end[0] - middle[0]) * scale, (end[1] - middle[1]) * METERS_PER_DEGREE
+        px = (table['longitude'] - middle[0]) * scale
+        py = (table['latitude'] - middle[1]) * METERS_PER_DEGREE
+        length = (bx - ax) ** 2 + (by - ay) ** 2
+        if length > 0:
+            t = np.clip(((px - ax) * (bx - ax) + (py - ay) * (by - ay)) / length, 0, 1)
+        else:
+            t = np.zeros(len(table))
+        table['distance'] = np.hypot(px - (ax + t * (bx - ax)), py - (ay + t * (by - ay)))
+        table = table[table['distance'] <= radius]
+        return table[np.argsort(table['distance'], kind='stable')]
+
+
+def build_index(records, merge_radius=25.0):
+    """
+    Builds the hazard index of all valid trips.
+    :param records: result records from GPSProject_program.process_files()
+    :param merge_radius: detections of the same kind closer than this (in meters) are one hazard
+    :return: HazardIndex
+    """
+    index = HazardIndex(merge_radius)
+    for record in records:
+        if record['valid']:
+            index.add_trip(record)
+    index.consolidate()
+    return index
+
+
+def save_kml(index, file):
+    """
+    Creates a kml file with every hazard of the index, with the same markers as all_stops_together().
+    :param index: HazardIndex
+    :param file: path of the kml file
+    :return:
+    """
+    with GPSProject_kml.KmlWriter(file) as kml:
+        kml.hazard_styles()
+        for hazard in index.hazards():
+            kml.point(hazard['longitude'], hazard['latitude'],
+                      name='{0}: {1} observations'.format(hazard['kind'], hazard['observations']),
+                      description='trips: {0}, mean time at stop: {1:.1f}'.format(hazard['trips'],
+                                                                                  hazard['mean_dwell']),
+                      style_id=str(hazard['kind']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merges the hazards of all trips into one index.",
+                                     parents=[program.input_arguments()])
+    parser.add_argument("--radius", type=float, default=25.0, help="merge radius in meters")
+    parser.add_argument("--kml", default="GPS_Hazards_all_trips.kml", help="kml file of the merged hazards")
+    args = parser.parse_args(argv)
+    jobs, cache = program.open_inputs(args)
+
+    index = build_index(program.process_files(args.input, jobs, cache, save_kml=False), args.radius)
+    hazards = index.hazards()
+    print("trips: ", index.trip_count, " ----> hazards: ", len(hazards))
+    for kind in KINDS:
+        selected = hazards[hazards['kind'] == kind]
+        print(kind, ": ", len(selected), "hazards from", int(selected['observations'].sum()), "detections")
+    save_kml(index, args.kml)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+import argparse
+import math
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+import GPSProject_hazards
+import GPSProject_ingest
+import GPSProject_kml
+import GPSProject_program as program
+
+"""
+Corpus heatmap of the Fast and Safe Route Planning Project.
+
+The kml files of the project show one trip each, and hundreds of them make Google Earth unusable. The heatmap
+bins every fix of every trip into a grid of square cells instead and keeps, for every cell, the number of fixes
+and of trips, a histogram of the speed, the dwell time (the time spent at low speed) and the number of turns,
+stop signs, traffic signals and errands detected in it. The per cell values (mean speed, a percentile of the
+speed, dwell, hazards) are exported as PNG rasters draped over the ground by one small kml file.
+
+Every trip is binned with np.unique and np.bincount in its worker process, which returns only the cells the trip
+passed. The trips are merged into the grid in batches, and the grid only holds the cells which any trip passed,
+so its memory depends on the area covered by the corpus and not on the number of trips or fixes.
+
+The cells are cell_size meters high and, at the reference latitude, as wide. Unlike the cells of
+GPSProject_hazards.HazardIndex every cell has the same size in degrees, so the grid is a raster in longitude and
+latitude, which is what a GroundOverlay expects.
+
+Usage: python GPSProject_heatmap.py [--jobs N] [--cache DIR] [--cell M] [--grid FILE] [--kml FILE] ...
+"""
+
+KINDS = GPSProject_hazards.KINDS
+METRICS = ('mean_speed', 'percentile_speed', 'dwell', 'hazards')
+
+# speed histogram of every cell: SPEED_BINS bins SPEED_BIN mph wide, the last one also holds the higher speeds
+SPEED_BIN = 2.0
+SPEED_BINS = 40
+
+# fixes further apart than this many seconds are a gap in the log, whose time is not dwell time
+MAX_INTERVAL = 30.0
+
+# key of a cell: row * COLUMNS + column + COLUMNS // 2, which sorts the cells row by row
+COLUMNS = 2 ** 32
+
+# opacity of the cells with data in the rasters, the other cells are transparent
+ALPHA = 170
+
+
+def cell_degrees(cell_size, reference_latitude):
+    """
+    :param cell_size: height of a cell in meters
+    :param reference_latitude: latitude at which the cells are square
+    :return: (height, width) of a cell in degrees
+    """
+    height = cell_size / GPSProject_hazards.METERS_PER_DEGREE
+    return height, height / max(math.cos(math.radians(reference_latitude)), 1e-6)
+
+
+def cell_keys(longitude, latitude, cell_size, reference_latitude):
+    """
+    :return: array of the keys of the cells of the points
+    """
+    height, width = cell_degrees(cell_size, reference_latitude)
+    rows = np.floor(np.asarray(latitude, dtype=np.float64) / height).astype(np.int64)
+    columns = np.floor(np.asarray(longitude, dtype=np.float64) / width).astype(np.int64)
+    return rows * COLUMNS + columns + COLUMNS // 2
+
+
+def trip_cells(path, filename, cache=None, cell_size=50.0, reference_latitude=program.COORD1[1], slow=10.0,
+               skip_size=30, data=None):
+    """
+    Bins the fixes and detections of one trip, wherever it starts and ends. This is the unit of work handed to
+    the worker processes.
+
+    The time from a fix to the next one is dwell time of the cell of the fix if the speed is at most slow mph.
+    Like for the detectors, the fixes before the car first moves (leaving the parking lot) are not counted.
+
+    :param path: directory of the text files
+    :param filename: name of the text or track file
+    :param cache: ParseCache or None
+    :param cell_size: height of a cell in meters
+    :param reference_latitude: latitude at which the cells are square
+    :param slow: highest speed in mph which counts as dwell time
+    :param skip_size: window size of the turn detector
+    :param data: content of the text file if it was read already, e.g. from an archive
+    :return: dictionary with the sorted keys of the cells of the trip (cells) and, for every cell, the number of
+             fixes, the sum of their speeds in mph (speed_sum), the speed histogram, the dwell seconds and the
+             number of hazards of every kind of KINDS, or None for a file with less than 2 fixes
+    """
+    track = program.load_track(path, filename, cache, data)
+    if len(track) < 2:
+        return None
+    speed = track.speed * 1.1508  # speed in mph
+    keys = cell_keys(track.longitude, track.latitude, cell_size, reference_latitude)
+    cells, inverse = np.unique(keys, return_inverse=True)
+    count = len(cells)
+
+    bins = np.clip((speed / SPEED_BIN).astype(np.int64), 0, SPEED_BINS - 1)
+    histogram = np.bincount(inverse * SPEED_BINS + bins, minlength=count * SPEED_BINS)
+
+    start = program.first_moving_index(track)
+    interval = np.diff(program.seconds_of_day(track.time)) % 86400  # over midnight
+    interval = np.append(np.where(interval <= MAX_INTERVAL, interval, 0.0), 0.0)
+    interval[:start] = 0.0
+    dwell = np.bincount(inverse, weights=np.where(speed <= slow, interval, 0.0), minlength=count)
+
+    index, kind, _ = program.track_events(track, skip_size)
+    hazards = np.bincount(inverse[index] * len(KINDS) + kind, minlength=count * len(KINDS))
+
+    return {'cells': cells,
+            'fixes': np.bincount(inverse, minlength=count),
+            'speed_sum': np.bincount(inverse, weights=speed, minlength=count),
+            'histogram': histogram.reshape(count, SPEED_BINS),
+            'dwell': dwell,
+            'hazards': hazards.reshape(count, len(KINDS))}
+
+
+def collect_cells(path, filenames=None, jobs=1, cache=None, cell_size=50.0, reference_latitude=program.COORD1[1],
+                  threads=4):
+    """
+    Generator over the binned trips of an input root, in the order of GPSProject_ingest.iter_inputs().
+    :param path: input root, a directory, tar archive or single log
+    :param filenames: names of the files, every file of the directory if None
+    :param jobs: number of worker processes, 1 bins the trips serially in this process
+    :param cache: ParseCache or None
+    :param cell_size: height of a cell in meters
+    :param reference_latitude: latitude at which the cells are square
+    :param threads: number of threads decompressing the compressed files of a directory
+    :return: generator of the dictionaries of trip_cells(), None for files with less than 2 fixes
+    """
+    yield from GPSProject_ingest.map_inputs(trip_cells, path, filenames, jobs, threads, cache, cell_size,
+                                            reference_latitude, 10.0, 30)
+
+
+class Heatmap:
+    """
+    Per cell totals of all trips. Add the trips with add_trip(), then call merge() once before reading the cells.
+    """
+
+    # per cell arrays, saved by save()
+    FIELDS = ('cells', 'trips', 'fixes', 'speed_sum', 'histogram', 'dwell', 'hazards')
+
+    def __init__(self, cell_size=50.0, reference_latitude=program.COORD1[1], batch_cells=1 << 20):
+        """
+        :param cell_size: height of a cell in meters
+        :param reference_latitude: latitude at which the cells are square
+        :param batch_cells: the added trips are merged into the grid once they hold this many cells together
+        """
+        self.cell_size = cell_size
+        self.reference_latitude = reference_latitude
+        self.batch_cells = batch_cells
+        self.cells = np.zeros(0, dtype=np.int64)  # sorted keys of the cells
+        self.trips = np.zeros(0, dtype=np.int64)  # number of trips which passed every cell
+        self.fixes = np.zeros(0, dtype=np.int64)
+        self.speed_sum = np.zeros(0)
+        self.histogram = np.zeros((0, SPEED_BINS), dtype=np.int64)
+        self.dwell = np.zeros(0)
+        self.hazards = np.zeros((0, len(KINDS)), dtype=np.int64)
+        self.trip_count = 0
+        self.fix_count = 0
+        self.pending = []  # trips which are not merged yet
+        self.pending_cells = 0
+
+    def __len__(self):
+        return len(self.cells)
+
+    def add_trip(self, trip):
+        """
+        :param trip: dictionary from trip_cells(), binned with the cell size and reference latitude of the grid
+        :return:
+        """
+        self.pending.append(trip)
+        self.pending_cells += len(trip['cells'])
+        self.trip_count += 1
+        self.fix_count += int(trip['fixes'].sum())
+        if self.pending_cells >= self.batch_cells:
+            self.merge()
+
+    def merge(self):
+        """
+        Adds the pending trips to the cells of the grid.
+        :return:
+        """
+        if not self.pending:
+            return
+        parts = [{name: getattr(self, name) for name in self.FIELDS}]
+        for trip in self.pending:
+            parts.append(dict(trip, trips=np.ones(len(trip['cells']), dtype=np.int64)))
+        cells, inverse = np.unique(np.concatenate([part['cells'] for part in parts]), return_inverse=True)
+
+        def total(name):
+            values = np.concatenate([part[name] for part in parts])
+            if values.ndim == 1:
+                return np.bincount(inverse, weights=values, minlength=len(cells))
+            width = values.shape[1]
+            return np.bincount((inverse[:, None] * width + np.arange(width)).ravel(), weights=values.ravel(),
+                               minlength=len(cells) * width).reshape(len(cells), width)
+
+        self.cells = cells
+        self.trips = np.rint(total('trips')).astype(np.int64)
+        self.fixes = np.rint(total('fixes')).astype(np.int64)
+        self.speed_sum = total('speed_sum')
+        self.histogram = np.rint(total('histogram')).astype(np.int64)
+        self.dwell = total('dwell')
+        self.hazards = np.rint(total('hazards')).astype(np.int64)
+        self.pending = []
+        self.pending_cells = 0
+
+    def rows_columns(self):
+        """
+        :return: arrays of the row and column of every cell
+        """
+        return self.cells // COLUMNS, self.cells % COLUMNS - COLUMNS // 2
+
+    def mean_speed(self):
+        """
+        :return: array of the mean speed in mph of the fixes of every cell
+        """
+        return self.speed_sum / np.maximum(self.fixes, 1)
+
+    def percentile_speed(self, percentile=85.0):
+        """
+        Percentile of the speed of the fixes of every cell, interpolated linearly inside the SPEED_BIN mph wide
+        bin of the histogram which holds it.
+        :param percentile: percentile between 0 and 100
+        :return: array of speeds in mph
+        """
+        cumulative = np.cumsum(self.histogram, axis=1)
+        target = self.fixes * (percentile / 100.0)
+        bins = np.minimum((cumulative < target[:, None]).sum(axis=1), SPEED_BINS - 1)
+        rows = np.arange(len(self.cells))
+        before = np.where(bins > 0, cumulative[rows, bins - 1], 0)
+        inside = self.histogram[rows, bins]
+        fraction = np.clip((target - before) / np.maximum(inside, 1), 0.0, 1.0)
+        return (bins + fraction) * SPEED_BIN
+
+    def values(self, metric, percentile=85.0):
+        """
+        :param metric: one of METRICS
+        :param percentile: percentile of percentile_speed
+        :return: array with the value of the metric for every cell
+        """
+        if metric == 'mean_speed':
+            return self.mean_speed()
+        if metric == 'percentile_speed':
+            return self.percentile_speed(percentile)
+        if metric == 'dwell':
+            return self.dwell
+        if metric == 'hazards':
+            return self.hazards.sum(axis=1).astype(np.float64)
+        raise ValueError("unknown metric: {0}".format(metric))
+
+    def bounds(self):
+        """
+        :return: (north, south, east, west) of the cells of the grid in degrees
+        """
+        rows, columns = self.rows_columns()
+        height, width = cell_degrees(self.cell_size, self.reference_latitude)
+        return ((rows.max() + 1) * height, rows.min() * height, (columns.max() + 1) * width,
+                columns.min() * width)
+
+    def raster(self, values, mask, worse_when_low=False, max_pixels=25000000):
+        """
+        Paints the cells of the grid from green over yellow to red. The scale ends at the 95th percentile of the
+        painted values, so a few extreme cells do not wash out the rest of the map.
+        :param values: array with a value for every cell
+        :param mask: boolean array of the cells which are painted, the others are transparent
+        :param worse_when_low: True to paint low values red, e.g. for speeds
+        :param max_pixels: largest size of the raster, use larger cells for a corpus which covers a larger area
+        :return: (height x width x 4 array of RGBA bytes, the north row first, value painted green, value painted
+                 red)
+        """
+        rows, columns = self.rows_columns()
+        height = int(rows.max() - rows.min()) + 1
+        width = int(columns.max() - columns.min()) + 1
+        if height * width > max_pixels:
+            raise ValueError("the raster of {0} x {1} pixels is too large, use larger cells".format(width, height))
+        scale = max(float(np.percentile(values[mask], 95)), 1e-9) if mask.any() else 1.0
+        badness = np.clip(values / scale, 0.0, 1.0)
+        if worse_when_low:
+            badness = 1.0 - badness
+
+        image = np.zeros((height, width, 4), dtype=np.uint8)
+        painted = (rows.max() - rows[mask], columns[mask] - columns.min())
+        image[painted + (0,)] = np.rint(np.minimum(2 * badness[mask], 1.0) * 255)
+        image[painted + (1,)] = np.rint(np.minimum(2 * (1.0 - badness[mask]), 1.0) * 255)
+        image[painted + (3,)] = ALPHA
+        return image, (scale, 0.0) if worse_when_low else (0.0, scale)
+
+    def save(self, file):
+        """
+        Writes the grid to a .npz file.
+        :param file: path of the file
+        :return:
+        """
+        self.merge()
+        with open(file, "wb") as handle:
+            np.savez_compressed(handle, cell_size=self.cell_size, reference_latitude=self.reference_latitude,
+                                trip_count=self.trip_count, **{name: getattr(self, name) for name in self.FIELDS})
+
+    @classmethod
+    def load(cls, file):
+        """
+        :param file: path of a file written by save()
+        :return: Heatmap
+        """
+        with np.load(file) as arrays:
+            heatmap = cls(float(arrays['cell_size']), float(arrays['reference_latitude']))
+            for name in cls.FIELDS:
+                setattr(heatmap, name, arrays[name])
+            heatmap.trip_count = int(arrays['trip_count'])
+        heatmap.fix_count = int(heatmap.fixes.sum())
+        return heatmap
+
+
+def build_heatmap(trips, cell_size=50.0, reference_latitude=program.COORD1[1]):
+    """
+    :param trips: dictionaries from trip_cells() or collect_cells(), None is skipped
+    :param cell_size: height of a cell in meters, the trips have to be binned with it
+    :param reference_latitude: latitude at which the cells are square, the trips have to be binned with it
+    :return: merged Heatmap
+    """
+    heatmap = Heatmap(cell_size, reference_latitude)
+    for trip in trips:
+        if trip is not None:
+            heatmap.add_trip(trip)
+    heatmap.merge()
+    return heatmap
+
+
+def write_png(file, image):
+    """
+    Writes an RGBA image as a PNG file, with zlib instead of an imaging library.
+    :param file: path of the file
+    :param image: height x width x 4 array of bytes
+    :return:
+    """
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    height, width = image.shape[:2]
+    # every row starts with filter type 0 (none)
+    rows = np.concatenate((np.zeros((height, 1), dtype=np.uint8), image.reshape(height, width * 4)), axis=1)
+    with open(file, "wb") as handle:
+        handle.write(b"\x89PNG\r\n\x1a\n")
+        handle.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        handle.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 9)))
+        handle.write(chunk(b"IEND", b""))
+
+
+def save_kml(heatmap, file, metrics=METRICS, percentile=85.0, min_fixes=1):
+    """
+    Creates a kml file with one ground overlay per metric. The PNG rasters are written next to the kml file, as
+    <name of the kml file>_<metric>.png, and only the first overlay is shown when the file is opened.
+    :param heatmap: merged Heatmap
+    :param file: path of the kml file
+    :param metrics: metrics of METRICS to export
+    :param percentile: percentile of percentile_speed
+    :param min_fixes: cells with less fixes are transparent
+    :return: list of the paths of the PNG files
+    """
+    labels = {'mean_speed': ("mean speed", " mph"),
+              'percentile_speed': ("{0:g}th percentile speed".format(percentile), " mph"),
+              'dwell': ("dwell time at <= 10 mph", " s"),
+              'hazards': ("turns, stop signs, traffic signals and errands", "")}
+    north, south, east, west = heatmap.bounds()
+    mask = heatmap.fixes >= min_fixes
+    base = os.path.splitext(file)[0]
+    images = []
+    with GPSProject_kml.KmlWriter(file) as kml:
+        for number, metric in enumerate(metrics):
+            image, (green, red) = heatmap.raster(heatmap.values(metric, percentile), mask,
+                                                 worse_when_low=metric.endswith('speed'))
+            image_file = "{0}_{1}.png".format(base, metric)
+            write_png(image_file, image)
+            images.append(image_file)
+            label, unit = labels[metric]
+            description = "{0} of {1} trips in {2:g} m cells: green {3:.1f}{5}, red {4:.1f}{5}".format(
+                label, heatmap.trip_count, heatmap.cell_size, green, red, unit)
+            kml.ground_overlay(os.path.basename(image_file), north, south, east, west, name=label,
+                               description=description, visible=number == 0)
+    return images
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregates the fixes of all trips into a speed and dwell heatmap.",
+                                     parents=[program.input_arguments()])
+    parser.add_argument("--cell", type=float, default=50.0, help="size of the cells in meters")
+    parser.add_argument("--grid", metavar="FILE", help="npz file of the grid, built and saved if it does not exist")
+    parser.add_argument("--kml", default="GPS_heatmap.kml", help="kml file, the PNG rasters are written next to it")
+    parser.add_argument("--metrics", default=",".join(METRICS), help="comma separated metrics of " + ", ".join(METRICS))
+    parser.add_argument("--percentile", type=float, default=85.0, help="percentile of percentile_speed")
+    parser.add_argument("--min-fixes", type=int, default=1, help="cells with less fixes are transparent")
+    args = parser.parse_args(argv)
+    metrics = [metric.strip() for metric in args.metrics.split(",") if metric.strip()]
+    for metric in metrics:
+        if metric not in METRICS:
+            parser.error("unknown metric: {0}".format(metric))
+
+    if args.grid and os.path.exists(args.grid):
+        heatmap = Heatmap.load(args.grid)
+    else:
+        jobs, cache = program.open_inputs(args)
+        started = time.perf_counter()
+        heatmap = build_heatmap(collect_cells(args.input, jobs=jobs, cache=cache, cell_size=args.cell), args.cell)
+        print("grid built in {0:.2f} s".format(time.perf_counter() - started))
+        if args.grid:
+            heatmap.save(args.grid)
+    print("trips: ", heatmap.trip_count, " fixes: ", heatmap.fix_count, " cells: ", len(heatmap))
+    if not len(heatmap):
+        print("no fixes")
+        return
+
+    try:
+        images = save_kml(heatmap, args.kml, metrics, args.percentile, args.min_fixes)
+    except ValueError as error:
+        # the raster of the trips is too large for the cell size
+        parser.error("{0} (--cell)".format(error))
+    print(args.kml, "with", ", ".join("{0} ({1} bytes)".format(image, os.path.getsize(image)) for image in images))
+
+
+if __name__ == '__main__':
+    main()
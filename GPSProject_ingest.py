@@ -0,0 +1,268 @@
+import collections
+import concurrent.futures
+import gzip
+import itertools
+import lzma
+import multiprocessing
+import os
+import posixpath
+import queue
+import tarfile
+import threading
+
+"""
+Input of the Fast and Safe Route Planning Project: directories of gps logs, compressed logs and tar archives.
+
+iter_inputs() walks an input root and yields every log without extracting anything to disk:
+- a directory: its files in file name order, where x.txt.gz or x.txt.xz is the log x.txt, and a tar archive in
+  the directory stands for its members, in archive order, named archive/member
+- a tar archive (.tar, .tar.gz, .tgz, .tar.xz, .txz), read as a stream, member by member; a member is named by
+  its path in the archive, so members with the same file name in different directories stay apart
+- a single log, compressed or not
+
+Loose files are not read here, the parser opens them itself. Compressed files are decompressed by a pool of
+threads (zlib and lzma release the GIL), and the tar stream is read by a background thread, so reading and
+decompressing the next logs overlaps with parsing the current one. Only a bounded number of logs is ever held
+in memory.
+"""
+
+DECOMPRESS = {'.gz': gzip.decompress, '.xz': lzma.decompress}
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.xz', '.txz')
+
+# files which need a path on disk (memory mapped tracks and kml files), they are skipped in archives
+PATH_ONLY_SUFFIXES = ('.trk', '.kml')
+
+
+def is_tar(name):
+    """
+    :return: True if the name is the name of a tar archive, compressed or not
+    """
+    return name.lower().endswith(TAR_SUFFIXES)
+
+
+def compression(name):
+    """
+    :param name: name of a file
+    :return: the suffix of the compression of the file ('.gz' or '.xz'), or None
+    """
+    suffix = os.path.splitext(name)[1].lower()
+    return suffix if suffix in DECOMPRESS and not is_tar(name) else None
+
+
+def decompress_file(path, name):
+    """
+    :param path: directory of the file
+    :param name: name of the compressed file
+    :return: (path, name without the compression suffix, decompressed content)
+    """
+    with open(os.path.join(path, name), "rb") as handle:
+        data = DECOMPRESS[compression(name)](handle.read())
+    return path, os.path.splitext(name)[0], data
+
+
+def iter_tar(file, prefix=""):
+    """
+    Generator over the logs of a tar archive, read as a stream so the archive is never seeked or extracted.
+    Compressed members are decompressed, directories, files which need a path and members whose path leaves the
+    archive (e.g. ../x.txt) are skipped.
+    :param file: path of the archive
+    :param prefix: prefix of the names of the members
+    :return: generator of (path of the archive, prefix + path of the member in the archive, content)
+    """
+    with tarfile.open(file, "r|*") as archive:
+        for member in archive:
+            name = posixpath.normpath(member.name.lstrip("/"))
+            if not member.isfile() or name.lower().endswith(PATH_ONLY_SUFFIXES) or name.split("/")[0] == "..":
+                continue
+            name = prefix + name
+            data = archive.extractfile(member).read()
+            suffix = compression(name)
+            if suffix is not None:
+                data = DECOMPRESS[suffix](data)
+                name = os.path.splitext(name)[0]
+            yield file, name, data
+
+
+def iter_directory(path, executor, window):
+    """
+    Generator over the logs of a directory in file name order. Compressed files are decompressed by the
+    executor, up to window files ahead.
+    :return: generator of (path, name, content or None for a loose file)
+    """
+    pending = collections.deque()  # futures of compressed files and items of loose files, in order
+    for name in sorted(os.listdir(path)):
+        file = os.path.join(path, name)
+        if os.path.isdir(file):
+            continue
+        if is_tar(name):
+            while pending:
+                yield result(pending.popleft())
+            yield from iter_tar(file, name + "/")
+        elif compression(name) is not None:
+            pending.append(executor.submit(decompress_file, path, name))
+        else:
+            pending.append((path, name, None))
+        if len(pending) >= window:
+            yield result(pending.popleft())
+    while pending:
+        yield result(pending.popleft())
+
+
+def result(item):
+    return item.result() if isinstance(item, concurrent.futures.Future) else item
+
+
+def read_inputs(path, threads=4, window=16):
+    """
+    Generator over the logs of an input root, in this thread. See iter_inputs().
+    """
+    if os.path.isdir(path):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            yield from iter_directory(path, executor, window)
+    elif is_tar(path):
+        yield from iter_tar(path)
+    elif compression(path) is not None:
+        yield decompress_file(*os.path.split(path))
+    else:
+        yield os.path.dirname(path), os.path.basename(path), None
+
+
+def iter_inputs(path, threads=4, prefetch=16):
+    """
+    Generator over the logs of an input root (a directory, a tar archive or a single log). The input is read
+    by a background thread up to prefetch logs ahead of the consumer.
+    :param path: input root
+    :param threads: number of threads decompressing the compressed files of a directory
+    :param prefetch: number of logs read ahead
+    :return: generator of (path, name, content), content is None for a loose file, which is read from
+             os.path.join(path, name)
+    """
+    return background(read_inputs(path, threads, prefetch), prefetch)
+
+
+def background(items, size):
+    """
+    Runs a generator in a background thread, with at most size items waiting for the consumer. Exceptions of the
+    generator are raised in the consumer, and the thread stops when the consumer stops early.
+    :param items: generator
+    :param size: size of the queue between the threads
+    :return: generator of the items
+    """
+    items_queue = queue.Queue(size)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    break
+        except BaseException as error:
+            put((end, error))
+        else:
+            put((end, None))
+        finally:
+            items.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items_queue.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def read_input(path, name):
+    """
+    Reads one log of an input root, e.g. to load the track of the best trip again after a run.
+    :param path: input root
+    :param name: name of the log as yielded by iter_inputs()
+    :return: content of the log
+    """
+    if os.path.isdir(path) and os.path.isfile(os.path.join(path, name)):
+        with open(os.path.join(path, name), "rb") as handle:
+            return handle.read()
+    inputs = iter_inputs(path, threads=1)
+    try:
+        for directory, input_name, data in inputs:
+            if input_name == name:
+                if data is None:
+                    with open(os.path.join(directory, name), "rb") as handle:
+                        data = handle.read()
+                return data
+    finally:
+        inputs.close()
+    raise FileNotFoundError("{0} is not in {1}".format(name, path))
+
+
+def ordered_map(executor, function, arguments, window):
+    """
+    Like executor.map(function, *zip(*arguments)), but only window calls are submitted ahead of the results
+    which were yielded, so a long or endless iterable of arguments is never read into memory at once.
+    :param executor: thread or process pool
+    :param function: function to call
+    :param arguments: iterable of argument tuples
+    :param window: largest number of calls in flight
+    :return: generator of the results, in the order of the arguments
+    """
+    pending = collections.deque()
+    for item in arguments:
+        pending.append(executor.submit(function, *item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def map_inputs(function, path, filenames=None, jobs=1, threads=4, *extra):
+    """
+    Calls a function for every log of an input root, see parallel_map().
+    :param function: module level function of (path, name, *extra, content), content is None for a loose file
+    :param path: input root (see iter_inputs())
+    :param filenames: names of the logs, every log of the input root if None
+    :param jobs: number of worker processes, 1 calls the function in this process
+    :param threads: number of threads decompressing the compressed files of a directory
+    :param extra: arguments passed to every call after the path and name of the log
+    :return: generator of the results, in the order of the logs
+    """
+    if filenames is None:
+        inputs = iter_inputs(path, threads)
+    else:
+        inputs = ((path, filename, None) for filename in filenames)
+    arguments = ((directory, filename) + extra + (data,) for directory, filename, data in inputs)
+    return parallel_map(function, arguments, jobs)
+
+
+def parallel_map(function, arguments, jobs=1):
+    """
+    Calls a function for every argument tuple, in a pool of jobs worker processes if jobs > 1.
+    :param function: module level function
+    :param arguments: iterable of argument tuples
+    :param jobs: number of worker processes, 1 calls the function in this process
+    :return: generator of the results, in the order of the arguments
+    """
+    if jobs > 1:
+        # iter_inputs() reads and decompresses in threads, and forking a process while other threads hold locks
+        # can deadlock the child, so the workers are started by a fork server (spawned where there is none)
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                    mp_context=multiprocessing.get_context(method)) as pool:
+            yield from ordered_map(pool, function, arguments, jobs * 4)
+    else:
+        yield from itertools.starmap(function, arguments)
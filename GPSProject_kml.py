@@ -0,0 +1,334 @@
+import array
+import itertools
+import xml.parsers.expat
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+"""
+Streaming KML writer and reader of the Fast and Safe Route Planning Project.
+
+simplekml builds the whole document as a tree of objects and only writes it when it is saved, which is slow
+and memory hungry for routes with thousands of coordinates. KmlWriter writes the document straight to a buffered
+file instead: the coordinates of a line are formatted in chunks and every style is defined once in the document
+and referenced by its id. The layout of the file is the same as the one written by simplekml, so the files open
+in Google Earth just like before.
+
+iter_coordinates() reads the lines of a KML file back without building a tree. ElementTree (even iterparse)
+keeps the complete text of an element in memory, which for a route is one multi-MB <coordinates> element, so the
+file is fed to expat in blocks and the coordinate text is converted to numbers as it arrives.
+
+Referred the following link for the KML elements:
+1) https://developers.google.com/kml/documentation/kmlreference
+"""
+
+ICON_URL = 'http://maps.google.com/mapfiles/kml/paddle/{0}.png'
+
+# icons of the hazard markers
+HAZARD_ICONS = {'left_right': 'purple-circle', 'stop_sign': 'red-circle', 'traffic_signal': 'grn-circle',
+                'errand': 'orange-circle'}
+
+YELLOW = 'ff00ffff'
+
+
+class KmlWriter:
+    """
+    Writes a KML document element by element. Use it as a context manager so the document is closed:
+
+        with KmlWriter("route.kml") as kml:
+            kml.line_style("route", YELLOW, 4)
+            kml.linestring(longitude, latitude, speed, style_id="route")
+    """
+
+    def __init__(self, file, buffer_size=1024 * 1024):
+        """
+        :param file: path of the kml file, or an open text stream (e.g. io.StringIO) which is left open by close()
+        :param buffer_size: size of the write buffer in bytes
+        """
+        self.owns_file = not hasattr(file, "write")
+        self.file = open(file, "w", encoding="UTF-8", buffering=buffer_size) if self.owns_file else file
+        self.closed = False
+        self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        '<kml xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2">\n'
+                        '    <Document>\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.file.write('    </Document>\n</kml>\n')
+            if self.owns_file:
+                self.file.close()
+
+    def line_style(self, style_id, color, width):
+        """
+        Defines a line style which linestrings can reference with style_id.
+        :param style_id: id of the style
+        :param color: color in aabbggrr hex notation
+        :param width: width of the line
+        :return:
+        """
+        self.file.write('        <Style id="{0}">\n'
+                        '            <LineStyle>\n'
+                        '                <color>{1}</color>\n'
+                        '                <colorMode>normal</colorMode>\n'
+                        '                <width>{2}</width>\n'
+                        '            </LineStyle>\n'
+                        '        </Style>\n'.format(escape(style_id), color, width))
+
+    def icon_style(self, style_id, icon):
+        """
+        Defines an icon style which points can reference with style_id.
+        :param style_id: id of the style
+        :param icon: name of the paddle icon, e.g. 'red-circle'
+        :return:
+        """
+        self.file.write('        <Style id="{0}">\n'
+                        '            <IconStyle>\n'
+                        '                <colorMode>normal</colorMode>\n'
+                        '                <scale>1</scale>\n'
+                        '                <heading>0</heading>\n'
+                        '                <Icon>\n'
+                        '                    <href>{1}</href>\n'
+                        '                </Icon>\n'
+                        '            </IconStyle>\n'
+                        '        </Style>\n'.format(escape(style_id), ICON_URL.format(icon)))
+
+    def hazard_styles(self):
+        """
+        Defines the icon styles of the hazard markers, with the keys of HAZARD_ICONS as ids.
+        :return:
+        """
+        for style_id, icon in HAZARD_ICONS.items():
+            self.icon_style(style_id, icon)
+
+    def linestring(self, longitude, latitude, altitude, description=None, style_id=None, chunk_size=10000,
+                   lod=None):
+        """
+        Writes a line, e.g. a route with the speed in the altitude slot. The coordinates are formatted chunk by
+        chunk, so the text of the whole line is never in memory at once.
+        :param longitude: array of longitudes
+        :param latitude: array of latitudes
+        :param altitude: array of altitudes
+        :param description: description of the placemark
+        :param style_id: id of a style defined with line_style()
+        :param chunk_size: number of coordinates formatted at once
+        :param lod: (minLodPixels, maxLodPixels) to only draw the line while its bounding box is that large on the
+                    screen (-1 for no upper limit), or None to always draw it
+        :return:
+        """
+        self.file.write('        <Placemark>\n')
+        if description is not None:
+            self.file.write('            <description>{0}</description>\n'.format(escape(description)))
+        if style_id is not None:
+            self.file.write('            <styleUrl>#{0}</styleUrl>\n'.format(escape(style_id)))
+        if lod is not None and len(longitude):
+            self.region(float(np.max(latitude)), float(np.min(latitude)), float(np.max(longitude)),
+                        float(np.min(longitude)), lod[0], lod[1])
+        self.file.write('            <LineString>\n                <coordinates>')
+        for start in range(0, len(longitude), chunk_size):
+            end = start + chunk_size
+            values = zip(np.asarray(longitude[start:end]).tolist(), np.asarray(latitude[start:end]).tolist(),
+                         np.asarray(altitude[start:end]).tolist())
+            if start:
+                self.file.write(' ')
+            self.file.write(' '.join(itertools.starmap('{0!r},{1!r},{2!r}'.format, values)))
+        self.file.write('</coordinates>\n'
+                        '                <extrude>1</extrude>\n'
+                        '                <tessellate>1</tessellate>\n'
+                        '                <altitudeMode>relativeToGround</altitudeMode>\n'
+                        '            </LineString>\n'
+                        '        </Placemark>\n')
+
+    def region(self, north, south, east, west, min_lod_pixels, max_lod_pixels):
+        """
+        Writes the Region of the current placemark, which is only drawn while the region is between
+        min_lod_pixels and max_lod_pixels large on the screen.
+        :return:
+        """
+        self.file.write('            <Region>\n'
+                        '                <LatLonAltBox>\n'
+                        '                    <north>{0!r}</north>\n'
+                        '                    <south>{1!r}</south>\n'
+                        '                    <east>{2!r}</east>\n'
+                        '                    <west>{3!r}</west>\n'
+                        '                </LatLonAltBox>\n'
+                        '                <Lod>\n'
+                        '                    <minLodPixels>{4}</minLodPixels>\n'
+                        '                    <maxLodPixels>{5}</maxLodPixels>\n'
+                        '                </Lod>\n'
+                        '            </Region>\n'.format(north, south, east, west, min_lod_pixels, max_lod_pixels))
+
+    def ground_overlay(self, href, north, south, east, west, name=None, description=None, visible=True):
+        """
+        Writes an image draped over the ground, e.g. a PNG raster next to the kml file.
+        :param href: path of the image, relative to the kml file
+        :param north: latitude of the top edge of the image
+        :param south: latitude of the bottom edge of the image
+        :param east: longitude of the right edge of the image
+        :param west: longitude of the left edge of the image
+        :param name: name of the overlay
+        :param description: description of the overlay
+        :param visible: False to only show the overlay once it is ticked in Google Earth
+        :return:
+        """
+        self.file.write('        <GroundOverlay>\n')
+        if name is not None:
+            self.file.write('            <name>{0}</name>\n'.format(escape(name)))
+        if description is not None:
+            self.file.write('            <description>{0}</description>\n'.format(escape(description)))
+        self.file.write('            <visibility>{0}</visibility>\n'
+                        '            <Icon>\n'
+                        '                <href>{1}</href>\n'
+                        '            </Icon>\n'
+                        '            <LatLonBox>\n'
+                        '                <north>{2!r}</north>\n'
+                        '                <south>{3!r}</south>\n'
+                        '                <east>{4!r}</east>\n'
+                        '                <west>{5!r}</west>\n'
+                        '            </LatLonBox>\n'
+                        '        </GroundOverlay>\n'.format(int(visible), escape(href), float(north), float(south),
+                                                           float(east), float(west)))
+
+    def point(self, longitude, latitude, name=None, description=None, style_id=None):
+        """
+        Writes a point placemark.
+        :param longitude: longitude of the point
+        :param latitude: latitude of the point
+        :param name: name of the placemark
+        :param description: description of the placemark
+        :param style_id: id of a style defined with icon_style()
+        :return:
+        """
+        self.file.write('        <Placemark>\n')
+        if name is not None:
+            self.file.write('            <name>{0}</name>\n'.format(escape(name)))
+        if description is not None:
+            self.file.write('            <description>{0}</description>\n'.format(escape(description)))
+        if style_id is not None:
+            self.file.write('            <styleUrl>#{0}</styleUrl>\n'.format(escape(style_id)))
+        self.file.write('            <Point>\n'
+                        '                <coordinates>{0!r},{1!r},0.0</coordinates>\n'
+                        '            </Point>\n'
+                        '        </Placemark>\n'.format(float(longitude), float(latitude)))
+
+    def points(self, coordinates, style_id):
+        """
+        Writes a point placemark named 'Point: longitude, latitude' for every coordinate, like the hazard
+        markers of the project.
+        :param coordinates: list of tuples starting with longitude and latitude
+        :param style_id: id of a style defined with icon_style()
+        :return:
+        """
+        for coordinate in coordinates:
+            longitude, latitude = float(coordinate[0]), float(coordinate[1])
+            self.point(longitude, latitude, name='Point: {0}, {1}'.format(longitude, latitude), style_id=style_id)
+
+
+def iter_coordinates(file, block_size=1024 * 1024, chunk_size=65536):
+    """
+    Generator over the coordinates of the LineStrings of a KML file (in document order), in chunks. Point
+    placemarks are ignored, and so are the coarser levels of detail of a simplified route (the lines whose Region
+    has a maxLodPixels other than -1), so only its finest line is read. Memory use is bounded by block_size and
+    chunk_size, not by the size of the file.
+    :param file: path of the kml file
+    :param block_size: number of bytes read from the file at once
+    :param chunk_size: number of characters of coordinate text converted at once
+    :return: generator of arrays of shape (n, 3) with the longitude, latitude and altitude of each coordinate
+    """
+    state = {'linestring': 0, 'coordinates': False, 'coarse': False, 'max_lod': None}
+    pending = []  # pieces of coordinate text which are not converted yet
+    pending_size = [0]
+    chunks = []
+
+    def start_element(name, attributes):
+        name = name.rsplit(':', 1)[-1]
+        if name == 'Placemark':
+            state['coarse'] = False
+        elif name == 'maxLodPixels':
+            state['max_lod'] = []
+        elif name == 'LineString':
+            state['linestring'] += 1
+        elif name == 'coordinates' and state['linestring'] and not state['coarse']:
+            state['coordinates'] = True
+
+    def end_element(name):
+        name = name.rsplit(':', 1)[-1]
+        if name == 'maxLodPixels':
+            state['coarse'] = ''.join(state['max_lod']).strip() != '-1'
+            state['max_lod'] = None
+        elif name == 'LineString':
+            state['linestring'] -= 1
+        elif name == 'coordinates' and state['coordinates']:
+            state['coordinates'] = False
+            convert(final=True)
+
+    def character_data(data):
+        if state['max_lod'] is not None:
+            state['max_lod'].append(data)
+        elif state['coordinates']:
+            pending.append(data)
+            pending_size[0] += len(data)
+            if pending_size[0] >= chunk_size:
+                convert(final=False)
+
+    def convert(final):
+        text = ''.join(pending)
+        pending.clear()
+        if not final:
+            # the last tuple can be cut in the middle, keep it for the next piece of text
+            cut = max(text.rfind(' '), text.rfind('\n'), text.rfind('\t'))
+            pending.append(text[cut + 1:])
+            text = text[:cut + 1]
+        pending_size[0] = sum(len(piece) for piece in pending)
+        if text.strip():
+            chunks.append(parse_coordinates(text))
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = False
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    with open(file, "rb") as handle:
+        while True:
+            block = handle.read(block_size)
+            parser.Parse(block, not block)
+            yield from chunks
+            chunks.clear()
+            if not block:
+                break
+
+
+def parse_coordinates(text):
+    """
+    Converts KML coordinate text ('lon,lat[,alt] lon,lat[,alt] ...') to numbers. A missing altitude is 0.
+    :param text: coordinate text, made of complete tuples
+    :return: array of shape (n, 3)
+    """
+    tuples = text.split()
+    if text.count(',') == 2 * len(tuples):
+        # every tuple has an altitude, convert the whole text at once
+        values = np.fromstring(text.replace(',', ' '), dtype=np.float64, sep=' ')
+        if len(values) == 3 * len(tuples):
+            return values.reshape(-1, 3)
+    values = array.array('d')
+    for item in tuples:
+        parts = item.split(',')
+        values.extend((float(parts[0]), float(parts[1]), float(parts[2]) if len(parts) > 2 else 0.0))
+    return np.frombuffer(values, dtype=np.float64).reshape(-1, 3)
+
+
+def read_coordinates(file):
+    """
+    Reads the coordinates of the LineStrings of a KML file, of a simplified route only the finest level of detail.
+    :param file: path of the kml file
+    :return: arrays (views into one block of memory) of the longitudes, latitudes and altitudes
+    """
+    chunks = list(iter_coordinates(file))
+    coordinates = np.concatenate(chunks) if chunks else np.empty((0, 3))
+    return coordinates[:, 0], coordinates[:, 1], coordinates[:, 2]
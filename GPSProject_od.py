@@ -0,0 +1,250 @@
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import time
+
+import numpy as np
+
+import GPSProject_hazards
+import GPSProject_ingest
+import GPSProject_program as program
+
+"""
+Origin-destination index of the Fast and Safe Route Planning Project.
+
+GPSProject_program only ranks the trips between coord1 and coord2. The OD index ranks the trips between any two
+places: the start and end points of all trips are clustered into places on the grid of
+GPSProject_hazards.HazardIndex (one pass and a final merge of the places which drifted together), trips with
+the same origin and destination place form a group, and every group is ranked by the cost of score_track().
+
+A query for the best route from A to B only looks at the places in the grid cells around A and B, then at the
+trips of the groups between them, so it does not depend on the number of trips in the index. A trip is a match
+if its start is within the radius of A and its end within the radius of B.
+
+The distances are measured on the ground. within_radius() passes the coordinates to the haversine formula in the
+(longitude, latitude) order, which stretches its 175 meters north to south, so the trips between coord1 and
+coord2 found here are not exactly the valid files of GPSProject_program.
+
+Usage: python GPSProject_od.py [--jobs N] [--cache DIR] [--index FILE] [--from=LON,LAT] [--to=LON,LAT] ...
+(the = keeps a negative longitude from being read as an option)
+"""
+
+TRIP = np.dtype([('file_name', 'U255'), ('start_longitude', np.float64), ('start_latitude', np.float64),
+                 ('end_longitude', np.float64), ('end_latitude', np.float64), ('cost', np.float64),
+                 ('trip_time', np.float64), ('left_right_coordinates', np.int64), ('stop_signs', np.int64),
+                 ('traffic_signals', np.int64), ('errands', np.int64)])
+
+
+def trip_summary(path, filename, cache=None, data=None):
+    """
+    Scores one trip, wherever it starts and ends. This is the unit of work handed to the worker processes.
+    :param path: directory of the text files
+    :param filename: name of the text or track file
+    :param cache: ParseCache or None
+    :param data: content of the text file if it was read already, e.g. from an archive
+    :return: tuple with the fields of TRIP, or None for a file with less than 2 fixes
+    """
+    track = program.load_track(path, filename, cache, data)
+    if len(track) < 2:
+        return None
+    with contextlib.redirect_stdout(io.StringIO()):
+        record = program.score_track(track)
+    return (filename, float(track.longitude[0]), float(track.latitude[0]), float(track.longitude[-1]),
+            float(track.latitude[-1]), record['cost'], record['trip_time'], len(record['left_right_coordinates']),
+            len(record['stop_signs']), len(record['traffic_signals']), len(record['errands']))
+
+
+def collect_trips(path, filenames=None, jobs=1, cache=None, threads=4):
+    """
+    Scores every file of an input root.
+    :param path: input root, a directory, tar archive or single log (see GPSProject_ingest)
+    :param filenames: names of the files, every file of the directory if None
+    :param jobs: number of worker processes, 1 scores the trips serially in this process
+    :param cache: ParseCache or None
+    :param threads: number of threads decompressing the compressed files of a directory
+    :return: structured array of TRIP, in the order of GPSProject_ingest.iter_inputs()
+    """
+    trips = list(GPSProject_ingest.map_inputs(trip_summary, path, filenames, jobs, threads, cache))
+    return np.array([trip for trip in trips if trip is not None], dtype=TRIP)
+
+
+class ODIndex:
+    """
+    Trips grouped by the places where they start and end, every group ranked by cost.
+    """
+
+    def __init__(self, trips, radius=program.ENDPOINT_RADIUS):
+        """
+        :param trips: structured array of TRIP
+        :param radius: start and end points closer than this (in meters) are the same place
+        """
+        self.radius = radius
+        self.trips = np.asarray(trips, dtype=TRIP)
+        self.places = GPSProject_hazards.HazardIndex(radius)
+        self.origin = np.empty(len(self.trips), dtype=np.int64)
+        self.destination = np.empty(len(self.trips), dtype=np.int64)
+        for trip, row in enumerate(self.trips):
+            self.origin[trip], self.destination[trip] = self.places.add(
+                'place', [row['start_longitude'], row['end_longitude']], [row['start_latitude'], row['end_latitude']],
+                [0.0, 0.0], trip)
+        mapping = self.places.consolidate()
+        self.origin = mapping[self.origin]
+        self.destination = mapping[self.destination]
+
+        # merged places and the moving mean put some endpoints farther than radius from the center of their place
+        self.spread = float(self.radius)
+        if len(self.trips):
+            centers = np.column_stack((self.places.latitude, self.places.longitude))
+            for place, longitude, latitude in ((self.origin, 'start_longitude', 'start_latitude'),
+                                               (self.destination, 'end_longitude', 'end_latitude')):
+                self.spread = max(self.spread, float(np.max(program.haversine_array(
+                    centers[place], np.column_stack((self.trips[latitude], self.trips[longitude])), unit='m'))))
+
+        # the trips of every group, cheapest first, and for the same cost in file name order
+        order = np.lexsort((np.arange(len(self.trips)), self.trips['cost'], self.destination, self.origin))
+        pairs = np.column_stack((self.origin[order], self.destination[order]))
+        starts = np.flatnonzero(np.any(np.diff(pairs, axis=0, prepend=-1) != 0, axis=1))
+        ends = np.append(starts[1:], len(order))
+        self.groups = {(int(pairs[start, 0]), int(pairs[start, 1])): order[start:end]
+                       for start, end in zip(starts.tolist(), ends.tolist())}
+
+    def __len__(self):
+        return len(self.trips)
+
+    def save(self, file):
+        """
+        Writes the scored trips to a .npz file, the index is rebuilt from them by load().
+        :param file: path of the file
+        :return:
+        """
+        with open(file, "wb") as handle:
+            np.savez(handle, trips=self.trips, radius=self.radius)
+
+    @classmethod
+    def load(cls, file, radius=None):
+        """
+        :param file: path of a file written by save()
+        :param radius: radius of the places, the one of the saved index if None
+        :return: ODIndex
+        """
+        with np.load(file) as arrays:
+            return cls(arrays['trips'], float(arrays['radius']) if radius is None else radius)
+
+    def places_near(self, longitude, latitude, radius):
+        """
+        :return: ids of the places which can have an endpoint within radius meters of the point
+        """
+        return self.places.candidates(longitude, latitude, radius + self.spread)
+
+    def groups_between(self, start, end, radius):
+        """
+        :return: list of the arrays of trip ids of the groups from places near start to places near end
+        """
+        origins = self.places_near(start[0], start[1], radius)
+        destinations = self.places_near(end[0], end[1], radius)
+        return [self.groups[pair] for pair in itertools.product(origins, destinations) if pair in self.groups]
+
+    def query(self, start, end, radius=None, top=1, both_ways=False):
+        """
+        Finds the cheapest trips from one point to another.
+        :param start: (longitude, latitude) of the start
+        :param end: (longitude, latitude) of the end
+        :param radius: largest distance in meters of the start and end of a trip to the points, the place radius
+                       if None
+        :param top: number of trips
+        :param both_ways: True to also find the trips from end to start, like within_radius()
+        :return: structured array of TRIP, the cheapest trip first
+        """
+        radius = self.radius if radius is None else radius
+        matches = []
+        for first, second in ((start, end), (end, start)) if both_ways else ((start, end),):
+            for ids in self.groups_between(first, second, radius):
+                rows = self.trips[ids]
+                near = (distances(first, rows['start_longitude'], rows['start_latitude']) <= radius) & \
+                    (distances(second, rows['end_longitude'], rows['end_latitude']) <= radius)
+                matches.append(ids[near][:top])  # the groups are sorted by cost
+        if not matches:
+            return self.trips[:0]
+        ids = np.unique(np.concatenate(matches))
+        ids = ids[np.lexsort((ids, self.trips['cost'][ids]))][:top]
+        return self.trips[ids]
+
+    def group_report(self, count=10, top=3):
+        """
+        Prints the largest groups with their cheapest trips.
+        :param count: number of groups
+        :param top: number of trips of every group
+        :return:
+        """
+        groups = sorted(self.groups.items(), key=lambda item: (-len(item[1]), item[0]))[:count]
+        print("origin                  destination             trips  best trips")
+        for (origin, destination), ids in groups:
+            print("{0:<23} {1:<23} {2:<6} {3}".format(
+                "{0:.5f}, {1:.5f}".format(self.places.longitude[origin], self.places.latitude[origin]),
+                "{0:.5f}, {1:.5f}".format(self.places.longitude[destination], self.places.latitude[destination]),
+                len(ids), ", ".join("{0} ({1:.3f})".format(self.trips['file_name'][trip], self.trips['cost'][trip])
+                                    for trip in ids[:top])))
+        print(len(self.groups), "groups of", len(self), "trips between", len(self.places), "places")
+
+
+def distances(point, longitude, latitude):
+    """
+    :return: array of the distances in meters of the coordinates to the (longitude, latitude) point
+    """
+    return program.haversine_array((point[1], point[0]), np.column_stack((latitude, longitude)), unit='m')
+
+
+def parse_point(text):
+    """
+    :param text: 'longitude,latitude'
+    :return: (longitude, latitude)
+    """
+    longitude, latitude = (float(value) for value in text.split(','))
+    return longitude, latitude
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ranks the trips between any two places.",
+                                     parents=[program.input_arguments()])
+    parser.add_argument("--index", metavar="FILE", help="npz file of the scored trips, built and saved if it does "
+                                                        "not exist")
+    parser.add_argument("--radius", type=float, default=program.ENDPOINT_RADIUS,
+                        help="radius in meters of the places and of the query points")
+    parser.add_argument("--from", dest="start", type=parse_point, default=program.COORD1, metavar="LON,LAT",
+                        help="start of the route (default coord1)")
+    parser.add_argument("--to", dest="end", type=parse_point, default=program.COORD2, metavar="LON,LAT",
+                        help="end of the route (default coord2)")
+    parser.add_argument("--both-ways", action="store_true", help="also rank the trips from the end to the start")
+    parser.add_argument("--top", type=int, default=5, help="number of best trips")
+    parser.add_argument("--groups", type=int, default=10, help="number of the largest OD groups reported")
+    args = parser.parse_args(argv)
+
+    if args.index and os.path.exists(args.index):
+        index = ODIndex.load(args.index, args.radius)
+    else:
+        jobs, cache = program.open_inputs(args)
+        started = time.perf_counter()
+        index = ODIndex(collect_trips(args.input, jobs=jobs, cache=cache), args.radius)
+        print(len(index), "trips scored and indexed in {0:.2f} s".format(time.perf_counter() - started))
+        if args.index:
+            index.save(args.index)
+    index.group_report(args.groups)
+
+    started = time.perf_counter()
+    best = index.query(args.start, args.end, top=args.top, both_ways=args.both_ways)
+    elapsed = time.perf_counter() - started
+    print()
+    print("best trips from", args.start, "to", args.end, "found in {0:.2f} ms".format(elapsed * 1000))
+    print("rank  cost            trip time (mins)  turns  stop signs  signals  errands  file")
+    for rank, trip in enumerate(best, 1):
+        print("{0:<5} {1:<15.6f} {2:<17.2f} {3:<6} {4:<11} {5:<8} {6:<8} {7}".format(
+            rank, trip['cost'], trip['trip_time'] / 60, trip['left_right_coordinates'], trip['stop_signs'],
+            trip['traffic_signals'], trip['errands'], trip['file_name']))
+    if len(best) == 0:
+        print("no trips")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import collections
+import sys
+
+import numpy as np
+
+import GPSProject_program as program
+
+"""
+Online scoring of a trip which is still being recorded, for the Fast and Safe Route Planning Project.
+
+The detectors of GPSProject_program need the complete track: a turn compares a fix with the fix skip_size
+positions ahead, and a stop only ends at the first fast fix after it. OnlineScorer runs the same rules as state
+machines which are fed one fix at a time, e.g. from the $GPRMC sentences of a vehicle feed. A turn is reported as
+soon as the fix skip_size positions later arrives, and a stop as soon as the fix at which it ends arrives, each
+with the running cost of the trip. Every fix costs O(1) work: the turn detector keeps the last skip_size + 1 fixes
+in a ring buffer, and the stop detector only remembers the stop which is in progress.
+
+After finish() the results are the same as those of GPSProject_program.score_track() for the whole track.
+
+Usage: python GPSProject_online.py [FILE]  (reads the sentences from standard input, e.g. a pipe, without FILE)
+"""
+
+
+class OnlineScorer:
+    """
+    Incremental version of score_track(). Feed the fixes in order with update(), then call finish() when the trip
+    has ended.
+
+    update() and finish() return the hazards which became decidable, as event dictionaries with the keys:
+    kind - 'left_right', 'stop_sign', 'traffic_signal', 'errand' or 'stop' (a stop which is not a hazard)
+    index - index of the fix of the hazard
+    coordinate - (longitude, latitude) of the hazard
+    direction - 'left' or 'right', only for turns
+    dwell - time spent at the stop, only for stops
+    cost - running cost of the trip after the hazard
+    """
+
+    def __init__(self, skip_size=30):
+        """
+        :param skip_size: window size of the turn detector, the same as in score_track()
+        """
+        self.skip_size = skip_size
+        self.count = 0
+        self.first_fix = None
+        self.last_fix = None
+        self.start = None  # index of the first fix with a speed above 10, the detectors ignore the fixes before it
+        self.finished = False
+
+        # turn detector
+        self.window = collections.deque(maxlen=skip_size + 1)  # (longitude, latitude, angle) of the last fixes
+        self.next_turn = 0  # the first index at which a turn can be found, a turn skips the next skip_size fixes
+        self.left_right_coordinates = []
+        self.turn_directions = []
+
+        # stop detector
+        self.next_stop = 0  # the first index at which a stop can start
+        self.stop_start = None  # (index, fix) of the stop in progress
+        self.stop_break = None  # index of the first fast fix of the stop in progress, it ends at the next fix
+        self.segments = []
+        self.stop_signs = []
+        self.traffic_signals = []
+        self.errands = []
+        self.time_at_stops = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def trip_time(self):
+        """
+        :return: trip time so far, the difference between the first time and the last time
+        """
+        if self.first_fix is None:
+            return 0.0
+        return abs(self.first_fix[3] - self.last_fix[3])
+
+    @property
+    def cost(self):
+        """
+        :return: cost of the trip so far, see GPSProject_program.cost_function()
+        """
+        return program.trip_cost(self.trip_time, self.time_at_stops, len(self.left_right_coordinates))
+
+    def update(self, fix):
+        """
+        Adds the next fix of the trip.
+        :param fix: (longitude, latitude, speed, time, tracking angle)
+        :return: list of events
+        """
+        if self.finished:
+            raise ValueError("the trip is finished")
+        fix = tuple(float(value) for value in fix)
+        longitude, latitude, speed, time, angle = fix
+        index = self.count
+        self.count += 1
+        if self.first_fix is None:
+            self.first_fix = fix
+        self.last_fix = fix
+        self.window.append((longitude, latitude, angle))
+
+        events = []
+        if self.start is None:
+            if not speed > 10:
+                return events
+            self.start = self.next_turn = self.next_stop = index
+        self.update_turns(index, angle, events)
+        self.update_stops(index, fix, events)
+        return events
+
+    def update_turns(self, index, angle, events):
+        """
+        Compares the fix skip_size positions back with the new fix, like find_turns().
+        """
+        candidate = index - self.skip_size
+        if candidate < self.next_turn:
+            return
+        longitude, latitude, candidate_angle = self.window[0]
+        difference = candidate_angle - angle
+        right = -120 < difference < -60
+        left = (60 < difference + 360 < 120) or (60 < difference < 120)
+        if not (right or left):
+            return
+        direction = 'right' if right else 'left'
+        self.left_right_coordinates.append((longitude, latitude))
+        self.turn_directions.append(direction)
+        self.next_turn = candidate + self.skip_size
+        events.append({'kind': 'left_right', 'index': candidate, 'coordinate': (longitude, latitude),
+                       'direction': direction, 'cost': self.cost})
+
+    def update_stops(self, index, fix, events):
+        """
+        Follows the low speed segments like segment_stops(): a segment starts at a fix with a speed of at most
+        10 mph and ends one fix after the first fix which is not in 0-10 mph (or right at that fix if it directly
+        follows the start).
+        """
+        speed = fix[2] * 1.1508  # speed in mph
+        slow = speed <= 10
+        broken = not (0.0 <= speed and slow)
+
+        if self.stop_break is not None:
+            self.end_stop(index, fix, events)
+        elif self.stop_start is not None:
+            if broken and index == self.stop_start[0] + 1:
+                self.end_stop(index, fix, events)
+            elif broken:
+                self.stop_break = index
+        elif index >= self.next_stop and slow:
+            self.stop_start = (index, fix)
+
+    def end_stop(self, index, fix, events):
+        """
+        Classifies the stop in progress, which ends at the fix, like classify_stops().
+        """
+        start, start_fix = self.stop_start
+        self.stop_start = None
+        self.stop_break = None
+        self.next_stop = index + 1
+
+        dwell = abs(start_fix[3] - fix[3])
+        displacement = float(program.haversine_array(start_fix[:2], fix[:2], unit='mi'))
+        self.segments.append((start, index, dwell, displacement, start_fix[:2], fix[:2]))
+        kind = 'stop'
+        if displacement < 0.09:
+            if dwell <= 7:
+                kind = 'stop_sign'
+                self.stop_signs.append(start_fix)
+            elif dwell <= 50:
+                kind = 'traffic_signal'
+                self.traffic_signals.append(start_fix)
+            else:
+                kind = 'errand'
+                self.errands.append(start_fix)
+            self.time_at_stops += dwell
+        events.append({'kind': kind, 'index': start, 'coordinate': start_fix[:2], 'dwell': dwell, 'cost': self.cost})
+
+    def finish(self):
+        """
+        Ends the trip. A stop which is still in progress ends at the last fix, unless it started there.
+        :return: list of events
+        """
+        events = []
+        if not self.finished and self.stop_start is not None and self.stop_start[0] < self.count - 1:
+            self.end_stop(self.count - 1, self.last_fix, events)
+        self.finished = True
+        return events
+
+    def stop_segments(self):
+        """
+        :return: table of the segments like segment_stops()
+        """
+        segments = np.zeros(len(self.segments), dtype=program.SEGMENT_DTYPE)
+        if len(segments) == 0:
+            return segments
+        start, end, dwell, displacement, start_points, end_points = zip(*self.segments)
+        segments['start'] = start
+        segments['end'] = end
+        segments['dwell'] = dwell
+        # numpy's vectorized sin and cos can differ from the scalar ones in the last bit, so the table is computed
+        # like in segment_stops() to be identical to it
+        segments['displacement'] = program.haversine_array(np.array(start_points), np.array(end_points), unit='mi')
+        return segments
+
+    def result(self):
+        """
+        :return: dictionary with the same keys as score_track() (except gps_data), and valid - True if the trip
+                 starts and ends at the two places checked by within_radius()
+        """
+        valid = self.count >= 2 and program.within_radius(self.first_fix[:2], self.last_fix[:2])
+        return {'valid': bool(valid),
+                'left_right_coordinates': list(self.left_right_coordinates),
+                'turn_directions': list(self.turn_directions),
+                'stop_signs': list(self.stop_signs),
+                'traffic_signals': list(self.traffic_signals),
+                'errands': list(self.errands),
+                'stop_segments': self.stop_segments(),
+                'trip_time': self.trip_time,
+                'cost': self.cost}
+
+
+def score_stream(lines, skip_size=30, skip_lines=5):
+    """
+    Generator which scores a gps log while it is being read, e.g. from a pipe.
+    :param lines: iterable of lines with the gps data
+    :param skip_size: window size of the turn detector
+    :param skip_lines: number of header lines at the start of the log which are ignored
+    :return: generator of events, the OnlineScorer is returned when the log ends (StopIteration.value)
+    """
+    scorer = OnlineScorer(skip_size)
+    for fix in program.parse_gprmc(lines, skip_lines):
+        yield from scorer.update(fix)
+    yield from scorer.finish()
+    return scorer
+
+
+def print_events(events):
+    """
+    Prints the events of score_stream() as they happen.
+    :return: the OnlineScorer
+    """
+    while True:
+        try:
+            event = next(events)
+        except StopIteration as stop:
+            return stop.value
+        description = event.get('direction', "") or "{0:.0f} s".format(event['dwell'])
+        print("fix {0:<7} {1:<15} {2:<8} ({3[0]:.6f}, {3[1]:.6f}) ----> cost: {4:.3f}".format(
+            event['index'], event['kind'], description, event['coordinate'], event['cost']), flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scores a trip while its gps data is being recorded.")
+    parser.add_argument("file", nargs="?", help="gps log or named pipe, standard input if not given")
+    args = parser.parse_args(argv)
+
+    lines = open(args.file) if args.file else sys.stdin
+    try:
+        scorer = print_events(score_stream(lines))
+    finally:
+        if args.file:
+            lines.close()
+    result = scorer.result()
+    print("fixes: ", len(scorer), " turns: ", len(result['left_right_coordinates']), " stop signs: ",
+          len(result['stop_signs']), " signals: ", len(result['traffic_signals']), " errands: ",
+          len(result['errands']))
+    print("trip time: ", (result['trip_time']/60), "mins", " ----> cost: ", result['cost'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+import bisect
+import collections
+import contextlib
+import io
+import os
+
+import GPSProject_kml
+import GPSProject_program as program
+import GPSProject_trackstore
+
+"""
+Library API of the Fast and Safe Route Planning Project.
+
+GPSProject_program is a script: its results end up in module level lists and kml files in fixed directories.
+RoutePlanner keeps everything in the instance instead, so several planners can live in one process and nothing
+is written unless asked for. The corpus of trips stays in memory as a sorted ranking of small summaries, so
+scoring a new trip only costs parsing and scoring that trip, and finding its rank is a binary search.
+
+    planner = RoutePlanner("logs.tar.gz", jobs=4)
+    planner.load()
+    result = planner.score(open("new_trip.txt", "rb").read(), "new_trip.txt")
+    print(result['rank'], "of", result['trips'])
+    kml = planner.kml()  # kml document of the best route
+
+The tracks of the corpus are read from the input again when their KML document is built. The tracks of the
+trips added by score() have no file there, so the most recently used ones are kept in memory (a trip added under
+the name of a corpus file replaces it, also for its KML document). The others are written to binary track files
+in the spill directory and mapped back when they are needed, or without a spill directory they are dropped and
+their KML document is gone (TrackEvicted). The KML documents are built on request and kept in a least recently
+used cache.
+
+A planner is not thread safe, GPSProject_service serves one request at a time.
+"""
+
+
+class TrackEvicted(KeyError):
+    """
+    The trip is in the ranking, but its track was added by score() and dropped from memory without a spill
+    directory.
+    """
+
+
+class RoutePlanner:
+    """
+    Ranking of a corpus of trips which new trips can be scored against and added to.
+    """
+
+    def __init__(self, input_path=None, cache=None, jobs=1, threads=4, top=5, tolerance=program.SIMPLIFY_TOLERANCE,
+                 kml_cache_size=32, track_cache_size=64, spill_directory=None):
+        """
+        :param input_path: input root of the corpus (see GPSProject_ingest), or None to start with no trips
+        :param cache: ParseCache or None
+        :param jobs: number of worker processes used by load()
+        :param threads: number of threads decompressing the compressed files of a directory
+        :param top: number of best trips the service reports by default
+        :param tolerance: tolerance in meters of the simplified route of the kml documents, 0 writes every fix
+        :param kml_cache_size: number of kml documents kept in memory
+        :param track_cache_size: number of tracks of the trips added by score() kept in memory
+        :param spill_directory: directory of the track files of the other trips added by score(), or None to drop
+                                their tracks
+        """
+        self.input_path = input_path
+        self.cache = cache
+        self.jobs = jobs
+        self.threads = threads
+        self.top = top
+        self.tolerance = tolerance
+        self.kml_cache_size = kml_cache_size
+        self.track_cache_size = track_cache_size
+        self.spill_directory = spill_directory
+
+        self.entries = []  # (cost, position, summary) of every trip, sorted
+        self.keys = {}  # file name -> (cost, position) of the entry of the trip
+        self.position = 0  # for the same cost the trip which was added first is better
+        self.tracks = collections.OrderedDict()  # tracks of the trips added by score(), least recently used first
+        self.spilled = {}  # file name -> track file of the trips added by score() which are not in memory
+        self.evicted = set()  # names of the trips added by score() whose tracks were dropped
+        self.kml_cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self, path=None):
+        """
+        Adds every valid trip of an input root.
+        :param path: input root, input_path if None
+        :return: number of valid trips which were added
+        """
+        path = self.input_path if path is None else path
+        count = 0
+        for record in program.process_files(path, self.jobs, self.cache, save_kml=False, threads=self.threads):
+            if record['valid']:
+                self.insert(program.record_summary(record))
+                count += 1
+        return count
+
+    def insert(self, summary, track=None):
+        """
+        Adds a trip to the ranking, a trip with the same name is replaced.
+        :param summary: dictionary from GPSProject_program.record_summary()
+        :param track: Track of the trip if it can not be read from the input
+        :return: rank of the trip, 1 for the best trip
+        """
+        name = summary['file_name']
+        self.remove(name)
+        key = (summary['cost'], self.position)
+        self.position += 1
+        self.keys[name] = key
+        index = bisect.bisect_left(self.entries, key)
+        self.entries.insert(index, key + (summary,))
+        if track is not None:
+            self.tracks[name] = track
+            while len(self.tracks) > self.track_cache_size:
+                self.evict(*self.tracks.popitem(last=False))
+        return index + 1
+
+    def evict(self, name, track):
+        """
+        Writes the track of a trip added by score() to the spill directory, or drops it without one.
+        :param name: file name of the trip
+        :param track: Track of the trip
+        :return:
+        """
+        if self.spill_directory is None:
+            self.evicted.add(name)
+            return
+        os.makedirs(self.spill_directory, exist_ok=True)
+        # the file names of the trips can be anything, the position of their entry is unique
+        file = os.path.join(self.spill_directory, str(self.keys[name][1]) + GPSProject_trackstore.SUFFIX)
+        GPSProject_trackstore.write_track(file, track.longitude, track.latitude, track.speed, track.time,
+                                          track.angle)
+        self.spilled[name] = file
+
+    def remove(self, name):
+        """
+        Removes a trip from the ranking, if it is there.
+        :param name: file name of the trip
+        :return:
+        """
+        key = self.keys.pop(name, None)
+        if key is not None:
+            del self.entries[bisect.bisect_left(self.entries, key)]
+        self.tracks.pop(name, None)
+        self.evicted.discard(name)
+        file = self.spilled.pop(name, None)
+        if file is not None:
+            os.remove(file)
+        for cached in [cached for cached in self.kml_cache if cached[0] == name]:
+            del self.kml_cache[cached]
+
+    def rank(self, cost):
+        """
+        :param cost: cost of a trip
+        :return: rank the trip would get if it was added now
+        """
+        return bisect.bisect_left(self.entries, (cost, self.position)) + 1
+
+    def ranking(self, top=None):
+        """
+        :param top: number of trips, all if None
+        :return: summaries of the best trips, the best trip first
+        """
+        return [entry[2] for entry in self.entries[:top]]
+
+    def best(self):
+        """
+        :return: summary of the best trip, or None if there are no trips
+        """
+        return self.entries[0][2] if self.entries else None
+
+    def score(self, data, name="trip.txt", add=True):
+        """
+        Scores a gps log and ranks it against the trips of the planner.
+        :param data: content of the log (bytes)
+        :param name: file name of the trip
+        :param add: True to add the trip to the ranking, False to only rank it
+        :return: the summary of the trip with valid, rank and trips (the number of trips it was ranked against),
+                 or for an invalid trip a dictionary with the file_name, valid and rejection (see
+                 GPSProject_program.rejection_reason())
+        """
+        track = program.read_track(io.TextIOWrapper(io.BytesIO(data)))
+        rejection = program.rejection_reason(track)
+        if rejection is None and len(track) < 2:
+            rejection = {'reason': 'no fixes'}
+        if rejection is not None:
+            return {'file_name': name, 'valid': False, 'rejection': rejection}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            record = program.score_track(track)
+        record['file_name'] = name
+        summary = program.record_summary(record)
+        rank = self.insert(summary, track) if add else self.rank(summary['cost'])
+        return dict(summary, valid=True, rank=rank, trips=len(self))
+
+    def track(self, name):
+        """
+        :param name: file name of a trip
+        :return: Track of the trip, TrackEvicted if it was dropped from memory, KeyError if the planner has no such
+                 trip or its file is gone from the input
+        """
+        if name in self.tracks:
+            self.tracks.move_to_end(name)
+            return self.tracks[name]
+        if name in self.spilled:
+            return program.map_track_file(self.spilled[name])
+        if name in self.evicted:
+            raise TrackEvicted(name)
+        if name not in self.keys or self.input_path is None:
+            raise KeyError(name)
+        try:
+            return program.load_track(self.input_path, name, self.cache)
+        except FileNotFoundError:
+            raise KeyError(name)
+
+    def kml(self, name=None, tolerance=None):
+        """
+        KML document of a trip with its route and hazards, from the cache if it was built before.
+        :param name: file name of the trip, the best trip if None
+        :param tolerance: tolerance in meters of the simplified route, the tolerance of the planner if None
+        :return: the document as a string
+        """
+        if name is None:
+            if not self.entries:
+                raise KeyError("no trips")
+            name = self.best()['file_name']
+        tolerance = self.tolerance if tolerance is None else tolerance
+        key = (name, tolerance)
+        if key in self.kml_cache:
+            self.kml_cache.move_to_end(key)
+            return self.kml_cache[key]
+
+        document = kml_document(self.track(name), tolerance)
+        self.kml_cache[key] = document
+        while len(self.kml_cache) > self.kml_cache_size:
+            self.kml_cache.popitem(last=False)
+        return document
+
+
+def kml_document(track, tolerance=0):
+    """
+    Builds the KML document of a trip: the route (like write_trip_kml()) and the hazard markers (like
+    all_stops_together()) in one document.
+    :param track: Track of the trip
+    :param tolerance: tolerance in meters of the simplified route, 0 writes every fix
+    :return: the document as a string
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        record = program.score_track(track)
+    buffer = io.StringIO()
+    with GPSProject_kml.KmlWriter(buffer) as kml:
+        if tolerance > 0:
+            program.write_lod_route(kml, track, tolerance)
+        else:
+            program.write_route(kml, track)
+        kml.hazard_styles()
+        kml.points(record['left_right_coordinates'], 'left_right')
+        kml.points(record['stop_signs'], 'stop_sign')
+        kml.points(record['traffic_signals'], 'traffic_signal')
+        kml.points(record['errands'], 'errand')
+    return buffer.getvalue()
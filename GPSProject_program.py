@@ -1,7 +1,21 @@
-import simplekml
-from haversine import haversine, Unit
+import numpy as np
+import argparse
+import array
+import bisect
+import cProfile
+import contextlib
+import heapq
+import io
+import itertools
 import os
 
+import GPSProject_cache
+import GPSProject_ingest
+import GPSProject_kml
+import GPSProject_simplify
+import GPSProject_stats
+import GPSProject_trackstore
+
 """
 GROUP 10 - Fast and Safe Route Planning Project
 @authors: Mihir Naresh Shah (ms8830@rit.edu), Abhinandan Desai (ad2724@rit.edu)
@@ -19,62 +33,309 @@ cost_function_list = []
 file_name_list = []
 stops_list_of_dict = []
 
-def readCoord(file, name):
+# version of the parser and the detectors, part of every parse cache key. Change it whenever the parsing, the
+# detectors or their thresholds change, so that the cached results are not used anymore.
+CACHE_VERSION = 2
+
+RIGHT_TURN = 1
+LEFT_TURN = -1
+
+# mean earth radius in meters, miles and kilometers, the same values as the haversine package uses
+EARTH_RADIUS = {'m': 6371008.8, 'mi': 6371.0088 * 0.621371192, 'km': 6371.0088}
+
+# tolerances in meters of the levels of detail of a simplified route kml, relative to the finest level, and the
+# size on the screen in pixels (see GPSProject_kml.KmlWriter.region()) from which each level is drawn
+LOD_SCALES = (25, 5, 1)
+LOD_PIXELS = (0, 1024, 5120, -1)
+
+# default tolerance in meters of the finest level of detail of the best route kml (and of the KML documents of
+# GPSProject_service), well below what Google Earth shows
+SIMPLIFY_TOLERANCE = 1.0
+
+# coord1 and coord2 of within_radius(), taken from the same files where data was valid, and the largest distance
+# in meters of the start and end of a valid trip to them
+COORD1 = (-77.68016333333334, 43.085848333333324)
+COORD2 = (-77.43771166666667, 43.138343333333324)
+ENDPOINT_RADIUS = 175
+
+# one row of the table of low speed segments built by segment_stops()
+SEGMENT_DTYPE = np.dtype([('start', np.int64), ('end', np.int64), ('dwell', np.float64),
+                          ('displacement', np.float64)])
+
+# directory with the 173 text files
+input_path = 'C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\FILES_TO_WORK'
+# directory of the kml file of every valid trip
+kml_path = 'C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\kmlFiles'
+# directory of the kml files of the best trip
+final_kml_path = 'C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\final_kml'
+
+class Track:
+    """
+    Columnar representation of a gps track. Instead of one tuple per fix, every attribute is stored in its own
+    float64 array (contiguous, or a view into a memory mapped track file):
+    longitude - longitudes in fractional degrees
+    latitude - latitudes in fractional degrees
+    speed - speed in knots
+    time - time recorded for the fix (hhmmss.ss)
+    angle - tracking angle in degrees
+
+    Indexing a track still returns the old 5 value tuple, so code written against the list of tuples keeps working.
+    """
+
+    columns = ('longitude', 'latitude', 'speed', 'time', 'angle')
+
+    def __init__(self, longitude, latitude, speed, time, angle):
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.speed = np.asarray(speed, dtype=np.float64)
+        self.time = np.asarray(time, dtype=np.float64)
+        self.angle = np.asarray(angle, dtype=np.float64)
+
+    @classmethod
+    def from_fixes(cls, fixes):
+        """
+        Builds a track from a list (or any iterable) of 5 value tuples.
+        :param fixes: fixes in the form (longitude, latitude, speed, time, tracking angle)
+        :return: Track
+        """
+        rows = np.array(list(fixes), dtype=np.float64).reshape(-1, 5)
+        return cls(rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4])
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Builds a track from a structured array with one field per column, e.g. the memory mapped records of a
+        track file. The columns are views into the records, nothing is copied.
+        :param records: structured array with the fields longitude, latitude, speed, time and angle
+        :return: Track
+        """
+        return cls(*(records[column] for column in cls.columns))
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, index):
+        return (float(self.longitude[index]), float(self.latitude[index]), float(self.speed[index]),
+                float(self.time[index]), float(self.angle[index]))
+
+    def __iter__(self):
+        # code written against the list of fixes iterates over the rows, so they are handed out as plain tuples
+        return zip(self.longitude.tolist(), self.latitude.tolist(), self.speed.tolist(), self.time.tolist(),
+                   self.angle.tolist())
+
+
+def as_track(gps_data):
+    """
+    Returns gps_data as a Track, converting a list (or iterable) of 5 value tuples if needed.
+    :param gps_data: Track or list of fixes
+    :return: Track
+    """
+    if isinstance(gps_data, Track):
+        return gps_data
+    return Track.from_fixes(gps_data)
+
+
+def gprmc_fields(file, skip_lines=5, counts=None):
+    """
+    Generator over the valid $GPRMC sentences of a gps log, split into their 13 fields. Lines are read lazily
+    from the open file handle (or any iterable of lines), so memory use does not depend on the size of the log.
+    :param file: open file handle or iterable of lines with the gps data
+    :param skip_lines: number of header lines at the start of the file which are ignored
+    :param counts: dictionary in which the lines, $GPRMC sentences and the invalid and malformed sentences are
+                   counted (see GPSProject_stats.COUNTS), or None
+    :return: generator of field lists
+    """
+    if counts is not None:
+        yield from counted_gprmc_fields(file, skip_lines, counts)
+        return
+    for line in itertools.islice(file, skip_lines, None):
+        # cheap prefix check so that $GPGGA and the other sentences are never split
+        if not line.startswith("$GPRMC,"):
+            continue
+        fields = line.rstrip("\r\n").split(",")
+        if len(fields) == 13 and fields[2] == 'A':  # we check if the data is valid or not
+            yield fields
+
+
+def counted_gprmc_fields(file, skip_lines, counts):
+    """
+    gprmc_fields() which also counts what it reads and drops. Separate so that the normal loop stays as fast as
+    possible.
+    """
+    lines = gprmc = invalid = malformed = 0
+    try:
+        for line in file:
+            lines += 1
+            if lines <= skip_lines or not line.startswith("$GPRMC,"):
+                continue
+            gprmc += 1
+            fields = line.rstrip("\r\n").split(",")
+            if len(fields) != 13:
+                malformed += 1
+            elif fields[2] != 'A':
+                invalid += 1
+            else:
+                yield fields
+    finally:
+        counts['lines'] += lines
+        counts['gprmc'] += gprmc
+        counts['invalid'] += invalid
+        counts['malformed'] += malformed
+
+
+def parse_gprmc(file, skip_lines=5):
+    """
+    Generator that parses the $GPRMC sentences of a gps log one fix at a time.
+
+    Each fix is yielded as a 5 value tuple:
+    0 - longitude
+    1 - latitude
+    2 - speed (knots)
+    3 - time
+    4 - tracking angle
+
+    :param file: open file handle or iterable of lines with the gps data
+    :param skip_lines: number of header lines at the start of the file which are ignored
+    :return: generator of fixes
+    """
+    for fields in gprmc_fields(file, skip_lines):
+        try:
+            longitude = conversion(float(fields[5]))
+            latitude = conversion(float(fields[3]))
+            fix = (longitude if fields[6] == "E" else (-1) * longitude,  # negative value for West
+                   latitude if fields[4] == "N" else (-1) * latitude,  # negative value for South
+                   float(fields[7]),  # speed for that co-ordinate
+                   float(fields[1]),  # time recorded for that co-ordinate
+                   float(fields[8]))  # tracking angle for that co-ordinate
+        except ValueError:
+            # sentence marked valid but with an empty or corrupted field
+            continue
+        yield fix
+
+
+def read_track(file, skip_lines=5, counts=None):
+    """
+    Parses the $GPRMC sentences of a gps log straight into a Track. The raw ddmm.mmmm values are collected in
+    compact float buffers and converted to fractional degrees in bulk with conversion_array().
+    :param file: open file handle or iterable of lines with the gps data
+    :param skip_lines: number of header lines at the start of the file which are ignored
+    :param counts: dictionary in which the lines, sentences and fixes are counted (see GPSProject_stats.COUNTS),
+                   or None
+    :return: Track
+    """
+    columns = [array.array('d') for _ in range(5)]
+    longitude, latitude, speed, time, angle = columns
+    for fields in gprmc_fields(file, skip_lines, counts):
+        try:
+            row = (float(fields[5]) if fields[6] == "E" else -float(fields[5]),  # negative value for West
+                   float(fields[3]) if fields[4] == "N" else -float(fields[3]),  # negative value for South
+                   float(fields[7]), float(fields[1]), float(fields[8]))
+        except ValueError:
+            # sentence marked valid but with an empty or corrupted field
+            if counts is not None:
+                counts['corrupt'] += 1
+            continue
+        for column, value in zip(columns, row):
+            column.append(value)
+    if counts is not None:
+        counts['fixes'] += len(time)
+
+    longitude = np.frombuffer(longitude, dtype=np.float64)
+    latitude = np.frombuffer(latitude, dtype=np.float64)
+    return Track(np.copysign(conversion_array(np.abs(longitude)), longitude),
+                 np.copysign(conversion_array(np.abs(latitude)), latitude),
+                 np.frombuffer(speed, dtype=np.float64), np.frombuffer(time, dtype=np.float64),
+                 np.frombuffer(angle, dtype=np.float64))
+
+
+def bearings(longitude, latitude):
+    """
+    Tracking angle of every point of a route, from the direction to the next point at a different position.
+    Points where the car is not moving keep the angle of the last movement (the first movement at the start).
+    :param longitude: array of longitudes
+    :param latitude: array of latitudes
+    :return: array of tracking angles in degrees, 0 to 360 clockwise from north
+    """
+    longitude = np.radians(longitude)
+    latitude = np.radians(latitude)
+    angle = np.zeros(len(longitude))
+    if len(longitude) < 2:
+        return angle
+    d_longitude = longitude[1:] - longitude[:-1]
+    y = np.sin(d_longitude) * np.cos(latitude[1:])
+    x = (np.cos(latitude[:-1]) * np.sin(latitude[1:])
+         - np.sin(latitude[:-1]) * np.cos(latitude[1:]) * np.cos(d_longitude))
+    moving = (d_longitude != 0) | (latitude[1:] != latitude[:-1])
+    if not moving.any():
+        return angle
+    step = np.degrees(np.arctan2(y, x)) % 360
+
+    # forward fill the angle over the points where the car is not moving
+    last_movement = np.maximum.accumulate(np.where(moving, np.arange(len(moving)), -1))
+    last_movement[last_movement < 0] = np.flatnonzero(moving)[0]
+    angle[:-1] = step[last_movement]
+    angle[-1] = angle[-2]
+    return angle
+
+
+def clock_times(count, start_time=0.0, interval=1.0):
+    """
+    Times of evenly spaced fixes in the hhmmss.ss format of the $GPRMC sentences.
+    :param count: number of fixes
+    :param start_time: seconds since midnight of the first fix
+    :param interval: seconds between two fixes
+    :return: array of times
+    """
+    seconds = (start_time + np.arange(count) * interval) % 86400
+    hours, seconds = np.divmod(seconds, 3600)
+    minutes, seconds = np.divmod(seconds, 60)
+    return hours * 10000 + minutes * 100 + seconds
+
+
+def read_kml_track(file, start_time=0.0, interval=1.0):
+    """
+    Reads a route saved as a KML file (like the files written by readCoord) back into a Track, so archived routes
+    can be scored without their text files. The speed is stored in the altitude slot of these files. They have
+    no times and tracking angles, so the fixes are taken to be interval seconds apart and the tracking angle is
+    computed from the positions. Of a route simplified at several levels of detail only the finest line is read,
+    and as that has fewer fixes than the trip, its score differs from the one of the text file.
+    :param file: path of the kml file
+    :param start_time: seconds since midnight of the first fix
+    :param interval: seconds between two fixes
+    :return: Track
+    """
+    longitude, latitude, speed = GPSProject_kml.read_coordinates(file)
+    return Track(longitude, latitude, speed, clock_times(len(speed), start_time, interval),
+                 bearings(longitude, latitude))
+
+
+def readCoord(file, name, save_kml=True):
     """
     The function takes in the text file and processes it to calculate
     the latitudes, longitudes, and speed of the car at each point. This data
     is then used to create the KML file.
-    :param file: file with the gps data
+    :param file: open file handle (or list of lines) with the gps data
     :param name: name of the file
-    :return:
+    :param save_kml: False to only create the KML file later, e.g. for the best trips
+    :return: Track with the longitude, latitude, speed, time and tracking angle of every fix
     """
-    list1 = []  # This list will store each and every line of $GPRMC data in the form of list of its attributes
-
-    # Each line in the file is separated and saved as a list in list1
-    for i in range(len(file)):
-        list1.append(file[i].split(","))
-
-    kml_coordinates = []
-
-    for i in range(5, len(list1)):
-        if list1[i][0] == "$GPRMC":  # data required is in these lines
-            if list1[i][2] == 'A':  # we check if the data is valid or not
-                if len(list1[i]) == 13:
-                    # print(list1[i], i)
-                    co_ordinate_list = []
-
-                    # Checking for longitude values
-                    if list1[i][6] == "E":
-                        val = conversion(float(list1[i][5]))
-                        co_ordinate_list.append(val)
-                    else:
-                        val = conversion(float(list1[i][5]))
-                        co_ordinate_list.append((-1) * val)  # negative value for West
-
-                    # Checking for latitude values
-                    if list1[i][4] == "N":
-                        val = conversion(float(list1[i][3]))
-                        co_ordinate_list.append(val)
-                    else:
-                        val = conversion(float(list1[i][3]))
-                        co_ordinate_list.append((-1) * val)  # negative value for South
-
-                    co_ordinate_list.append(float(list1[i][7]))  # speed for that co-ordinate is saved
-                    co_ordinate_list.append(list1[i][1])  # time recorded for that co-ordinate
-                    co_ordinate_list.append(list1[i][8])  # tracking angle for that co-ordinate
-                    kml_coordinates.append(co_ordinate_list)  # Each 5 value tuple is saved
-    kml = simplekml.Kml()
-
-    list2 = []  # This list is specifically created for inserting co-ordinates for creating kml file
-
-    # Converting each list to tuple as kml accepts tuples
-    for row in kml_coordinates:
-        #  att contains the lat, long, time, speed and tracking angle.
-        att = (row[0], row[1], row[2], float(row[3]), float(row[4]))
-        list2.append(att)
-
-    start_coordinate = (list2[0][0], list2[0][1])
-    end_coordinate = (list2[len(list2) - 1][0], list2[len(list2) - 1][1])
+    return export_valid_track(read_track(file), name, save_kml)
+
+
+def export_valid_track(track, name, save_kml=True):
+    """
+    Checks the start and end point of a parsed track and creates the KML file of the valid tracks.
+    :param track: Track of the file
+    :param name: name of the file
+    :param save_kml: False to only check the track
+    :return: the track if it is valid, otherwise an empty list
+    """
+    if len(track) == 0:
+        print("Invalid file...")
+        return []
+
+    start_coordinate = (track.longitude[0], track.latitude[0])
+    end_coordinate = (track.longitude[-1], track.latitude[-1])
 
     # check if coordinates
     if not within_radius(start_coordinate, end_coordinate):
@@ -82,24 +343,143 @@ def readCoord(file, name):
         return []
     print("Valid file...")
 
-    ls = kml.newlinestring(extrude=1)
-    ls.description = "Speed in knots, instead of altitude"
+    if save_kml:
+        write_trip_kml(track, name)
+    return track
 
-    # 'relativetoground' shows the variations in the speed of the car at different
-    # points in the route.
-    ls.altitudemode = simplekml.AltitudeMode.relativetoground
 
-    ls.tessellate = 1
+def write_route(kml, track):
+    """
+    Writes the route of a track as a yellow line, with the speed in the altitude slot.
+    :param kml: GPSProject_kml.KmlWriter
+    :param track: Track of the file
+    :return:
+    """
+    kml.line_style("route", GPSProject_kml.YELLOW, 4)
+    # 'relativeToGround' shows the variations in the speed of the car at different points in the route.
+    kml.linestring(track.longitude, track.latitude, track.speed, description="Speed in knots, instead of altitude",
+                   style_id="route")
 
-    # Saving the tuples for kml file
-    ls.coords = list2
-    ls.style.linestyle.width = 4
-    ls.style.linestyle.color = simplekml.Color.yellow
 
-    # Creating the kml file
-    kmlFile = name + ".kml"
-    kml.save("C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\kmlFiles\\" + kmlFile)
-    return list2
+def detection_vertices(gps_data, skip_size=30, heading_change=45.0):
+    """
+    Marks the fixes which a simplified route has to keep so that it still shows what the detectors saw: the
+    first and last fix of every low speed (<= 10 mph) run, the start and end of every stop segment, both fixes
+    compared for every turn, and the moving fixes where the tracking angle changes by more than heading_change
+    degrees from the previous fix.
+    :param gps_data: Track or list of fixes
+    :param skip_size: window size of the turn detector
+    :param heading_change: smallest change of the tracking angle in degrees which is kept
+    :return: boolean mask of the fixes
+    """
+    track = as_track(gps_data)
+    keep = np.zeros(len(track), dtype=bool)
+    if len(track) < 2:
+        return keep
+    speed = track.speed * 1.1508  # speed in mph
+    slow = speed <= 10
+    boundaries = np.flatnonzero(slow[1:] != slow[:-1])
+    keep[boundaries] = True
+    keep[boundaries + 1] = True
+
+    change = np.abs(np.diff(track.angle))
+    change = np.minimum(change, 360 - change)
+    keep[1:] |= (change > heading_change) & ~slow[1:]
+
+    start = first_moving_index(track)
+    turns = find_turns(track, start, skip_size)[0]
+    keep[turns] = True
+    keep[turns + skip_size] = True
+    segments = segment_stops(track, start)
+    keep[segments['start']] = True
+    keep[segments['end']] = True
+    return keep
+
+
+def write_lod_route(kml, track, tolerance):
+    """
+    Writes the route of a track as a yellow line simplified at len(LOD_SCALES) levels of detail, the finest one
+    with the given tolerance. Google Earth only draws the level which fits the zoom, so every level is simplified
+    by less than a pixel while it is shown.
+    :param kml: GPSProject_kml.KmlWriter
+    :param track: Track of the file
+    :param tolerance: tolerance of the finest level in meters
+    :return: number of points of every level, the coarsest level first
+    """
+    kml.line_style("route", GPSProject_kml.YELLOW, 4)
+    tolerances = [tolerance * scale for scale in LOD_SCALES]
+    simplified = GPSProject_simplify.levels(track.longitude, track.latitude, tolerances, detection_vertices(track))
+    sizes = []
+    for level, level_tolerance in enumerate(tolerances):
+        indices = simplified[level_tolerance]
+        kml.linestring(track.longitude[indices], track.latitude[indices], track.speed[indices],
+                       description="Speed in knots, instead of altitude ({0:g} m level of detail)".format(
+                           level_tolerance),
+                       style_id="route", lod=LOD_PIXELS[level:level + 2])
+        sizes.append(len(indices))
+    return sizes
+
+
+def write_trip_kml(track, name, directory=None, tolerance=0):
+    """
+    Creates the KML file of a trip.
+
+    With a tolerance the route is simplified at several levels of detail, which makes the file a lot smaller and
+    faster to draw. Such files hold one line per level, and even the finest level has fewer fixes than the track,
+    so only files written without a tolerance can be scored again with read_kml_track().
+
+    :param track: Track of the file
+    :param name: name of the file
+    :param directory: directory of the KML file, kml_path if None
+    :param tolerance: tolerance of the finest level of detail in meters, 0 writes every fix
+    :return: number of points of every line of the file
+    """
+    file = os.path.join(directory or kml_path, name + ".kml")
+    if os.path.dirname(name):
+        # the name of a member of an archive is its path in the archive
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+    with GPSProject_kml.KmlWriter(file) as kml:
+        if tolerance > 0:
+            return write_lod_route(kml, track, tolerance)
+        write_route(kml, track)
+        return [len(track)]
+
+
+def haversine_array(points1, points2, unit='mi'):
+    """
+    Batched great-circle distance. Every distance in this file is computed here instead of with one call of
+    the haversine package per pair of points.
+
+    The points are arrays with 2 values in the last axis, in the same order as the haversine package expects
+    them. The two arrays are broadcast against each other, so this handles arrays of point pairs as well as
+    one point against many (use haversine_matrix() for many against many).
+
+    :param points1: array of points of shape (..., 2)
+    :param points2: array of points of shape (..., 2)
+    :param unit: 'm', 'mi' or 'km'
+    :return: array of distances in the given unit
+    """
+    points1 = np.radians(np.asarray(points1, dtype=np.float64))
+    points2 = np.radians(np.asarray(points2, dtype=np.float64))
+    lat1 = points1[..., 0]
+    lng1 = points1[..., 1]
+    lat2 = points2[..., 0]
+    lng2 = points2[..., 1]
+    d = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) * 0.5) ** 2
+    return EARTH_RADIUS[unit] * (2 * np.arcsin(np.sqrt(d)))
+
+
+def haversine_matrix(points1, points2, unit='mi'):
+    """
+    Great-circle distance between every point of points1 and every point of points2.
+    :param points1: array of n points of shape (n, 2)
+    :param points2: array of m points of shape (m, 2)
+    :param unit: 'm', 'mi' or 'km'
+    :return: array of distances of shape (n, m)
+    """
+    points1 = np.asarray(points1, dtype=np.float64)
+    points2 = np.asarray(points2, dtype=np.float64)
+    return haversine_array(points1[:, np.newaxis, :], points2[np.newaxis, :, :], unit)
 
 
 def within_radius(start_coordinate, end_coordinate):
@@ -108,23 +488,56 @@ def within_radius(start_coordinate, end_coordinate):
     files which doesn't have the starting point and ending point within 175 meters of coord1 and coord2 respectively
     or vice versa.
 
+    The coordinates can also be arrays of shape (n, 2) to check n files at once.
+
     :param start_coordinate:
     :param end_coordinate:
-    :return:
+    :return: True if the file is valid (array of booleans for arrays of coordinates)
     """
 
-    # coord1 and coord2 taken from the same files where data was valid
-    coord1 = (-77.68016333333334,43.085848333333324)
-    coord2 = (-77.43771166666667,43.138343333333324)
+    forward, backward = endpoint_distances(start_coordinate, end_coordinate)
+    valid = (forward <= ENDPOINT_RADIUS).all(axis=-1) | (backward <= ENDPOINT_RADIUS).all(axis=-1)
+    return bool(valid) if valid.ndim == 0 else valid
 
-    if haversine(start_coordinate, coord1, unit=Unit.METERS) <= 175 and haversine(end_coordinate, coord2,
-                                                                                  unit=Unit.METERS) <= 175:
-        return True
-    elif haversine(start_coordinate, coord2, unit=Unit.METERS) <= 175 and haversine(end_coordinate, coord1,
-                                                                                  unit=Unit.METERS) <= 175:
-        return True
+
+def endpoint_distances(start_coordinate, end_coordinate):
+    """
+    Distances of the start and end of trips to coord1 and coord2 (forward) and to coord2 and coord1 (backward).
+    :param start_coordinate: coordinate, or array of shape (n, 2)
+    :param end_coordinate: coordinate, or array of shape (n, 2)
+    :return: arrays of shape (2,) or (n, 2) of the forward and the backward distances in meters
+    """
+    # one kernel call for the distances of both endpoints to both coordinates
+    endpoints = np.stack(np.broadcast_arrays(np.asarray(start_coordinate, dtype=np.float64),
+                                             np.asarray(end_coordinate, dtype=np.float64)), axis=-2)
+    forward = haversine_array(endpoints, np.array([COORD1, COORD2]), unit='m')
+    backward = haversine_array(endpoints, np.array([COORD2, COORD1]), unit='m')
+    return forward, backward
+
+
+def rejection_reason(track):
+    """
+    Explains why export_valid_track() rejects a track, for the run statistics.
+    :param track: Track of the file
+    :return: None for a valid track, else a dictionary with the reason ('no fixes', 'start', 'end' or
+             'start and end') and the distances in meters of the start and end to the closest endpoints
+    """
+    if len(track) == 0:
+        return {'reason': 'no fixes'}
+    start_coordinate = (track.longitude[0], track.latitude[0])
+    end_coordinate = (track.longitude[-1], track.latitude[-1])
+    forward, backward = endpoint_distances(start_coordinate, end_coordinate)
+    distances = forward if forward.max() <= backward.max() else backward
+    far = distances > ENDPOINT_RADIUS
+    if far.all():
+        reason = 'start and end'
+    elif far[0]:
+        reason = 'start'
+    elif far[1]:
+        reason = 'end'
     else:
-        return False
+        return None
+    return {'reason': reason, 'start_distance': float(distances[0]), 'end_distance': float(distances[1])}
 
 
 def conversion(input_val):
@@ -148,32 +561,332 @@ def conversion(input_val):
     return result
 
 
-def openFile():
+def conversion_array(input_vals):
     """
-    This function takes in each text file and parses it.
-    :param:
-    :return:
+    Vectorized version of conversion() which converts a whole array of coordinates to fractional degrees at once.
+    :param input_vals: array of coordinates in the form of (degrees*100 + minutes)
+    :return: array of converted coordinates in the form of fractional degrees
     """
-    path = 'C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\FILES_TO_WORK'
-    fileList = []
-    fileName_list = []
-    for filename in os.listdir(path):
-        file = path + "\\" + filename
-        name = filename[:len(filename) - 4]
-        txtFile = filename
-        file = open(file).read().splitlines()
-        print(txtFile+":")
-        gps_data = readCoord(file, name)
-        if (len(gps_data) < 2):
-            print()
-            continue
-        global file_name_list
-        file_name_list.append(txtFile)
-        detect_stops(gps_data)
+    input_vals = np.asarray(input_vals, dtype=np.float64)
+    degrees = np.trunc(input_vals / 100)  # same as splitting the value on the decimal point
+    return degrees + (input_vals - degrees * 100) / 60
+
+
+def record_to_arrays(record, track):
+    """
+    Converts a result record and its track to the arrays which are stored in the parse cache.
+    :param record: result record from process_file()
+    :param track: Track of the file, ignored for invalid files
+    :return: dictionary of arrays
+    """
+    arrays = {'valid': np.array(record['valid']), 'log': np.array(record['log'])}
+    if record['valid']:
+        for column in Track.columns:
+            arrays[column] = getattr(track, column)
+        arrays['left_right_coordinates'] = np.array(record['left_right_coordinates'], dtype=np.float64).reshape(-1, 2)
+        arrays['turn_directions'] = np.array(record['turn_directions'], dtype='U5')
+        for hazard in ('stop_signs', 'traffic_signals', 'errands'):
+            arrays[hazard] = np.array(record[hazard], dtype=np.float64).reshape(-1, 5)
+        arrays['stop_segments'] = record['stop_segments']
+        arrays['trip_time'] = np.array(record['trip_time'])
+        arrays['cost'] = np.array(record['cost'])
+    return arrays
+
+
+def record_from_arrays(filename, arrays):
+    """
+    Rebuilds the result record of a file from the arrays stored in the parse cache.
+    :param filename: name of the text file
+    :param arrays: dictionary of arrays from record_to_arrays()
+    :return: result record
+    """
+    record = {'file_name': filename, 'valid': bool(arrays['valid']), 'log': str(arrays['log'])}
+    if record['valid']:
+        record['left_right_coordinates'] = [tuple(row) for row in arrays['left_right_coordinates'].tolist()]
+        record['turn_directions'] = arrays['turn_directions'].tolist()
+        for hazard in ('stop_signs', 'traffic_signals', 'errands'):
+            record[hazard] = [tuple(row) for row in arrays[hazard].tolist()]
+        record['stop_segments'] = arrays['stop_segments']
+        record['trip_time'] = float(arrays['trip_time'])
+        record['cost'] = float(arrays['cost'])
+    return record
+
+
+def map_track_file(file):
+    """
+    Maps a binary track file written by GPSProject_trackstore into memory. The detectors and cost_function work
+    directly on the mapped columns.
+    :param file: path of the .trk file
+    :return: Track
+    """
+    return Track.from_records(GPSProject_trackstore.map_track(file))
+
+
+def load_track(path, filename, cache=None, data=None):
+    """
+    Reads the track of a text file (from the parse cache if it is there) or maps a binary track file.
+    :param path: input root of the text files, a directory or an archive (see GPSProject_ingest)
+    :param filename: name of the text or track file
+    :param cache: ParseCache or None
+    :param data: content of the text file if it was read already, e.g. from an archive
+    :return: Track
+    """
+    file = os.path.join(path, filename)
+    if data is None and not os.path.isfile(file):
+        # a compressed file or a member of an archive
+        data = GPSProject_ingest.read_input(path, filename)
+    if data is not None:
+        if cache is not None:
+            arrays = cache.load(cache.key_data(data))
+            if arrays is not None and bool(arrays['valid']):
+                return Track(*(arrays[column] for column in Track.columns))
+        return read_track(io.TextIOWrapper(io.BytesIO(data)))
+    if filename.endswith(GPSProject_trackstore.SUFFIX):
+        return map_track_file(file)
+    if filename.endswith(".kml"):
+        return read_kml_track(file)
+    if cache is not None:
+        arrays = cache.load(cache.key(file))
+        if arrays is not None and bool(arrays['valid']):
+            return Track(*(arrays[column] for column in Track.columns))
+    with open(file) as handle:
+        return read_track(handle)
+
+
+def process_file(path, filename, cache=None, save_kml=True, stats=False, data=None):
+    """
+    Parses (or maps, for binary track files), validates and scores a single text, track or KML file. This is
+    the unit of work handed to the worker processes, so it only touches its own data and returns a small result
+    record instead of the whole track.
+
+    The record has the following keys:
+    file_name - name of the text file
+    valid - False if the file was rejected by readCoord
+    log - everything printed while processing the file
+    cost, left_right_coordinates, stop_signs, traffic_signals, errands - only for valid files
+    stats - only with stats, the dictionary of GPSProject_stats.FileStats.as_dict()
+
+    Files which did not change since they were cached are not parsed again, the record is rebuilt from the
+    cache instead.
+
+    :param path: directory of the text files
+    :param filename: name of the text file
+    :param cache: ParseCache or None
+    :param save_kml: False to skip the KML file of the trip
+    :param stats: True to measure the stages and count the sentences of the file
+    :param data: content of the text file if it was read already, e.g. from an archive, else the file is read
+                 from the path
+    :return: result record
+    """
+    file_stats = GPSProject_stats.FileStats(filename) if stats else None
+    file = os.path.join(path, filename)
+    binary = data is None and filename.endswith(GPSProject_trackstore.SUFFIX)
+    if cache is not None and not binary:
+        with GPSProject_stats.stage(file_stats, 'cache'):
+            key = cache.key(file) if data is None else cache.key_data(data)
+            arrays = cache.load(key)
+        if arrays is not None:
+            record = record_from_arrays(filename, arrays)
+            if save_kml and record['valid']:
+                # the cache holds the valid track, so the kml file of the trip is written like on a cold run
+                with GPSProject_stats.stage(file_stats, 'kml_export'):
+                    write_trip_kml(Track(*(arrays[column] for column in Track.columns)), filename[:len(filename) - 4])
+            if stats:
+                file_stats.cached = True
+                record['stats'] = file_stats.as_dict()
+            return record
+
+    log = io.StringIO()
+    record = {'file_name': filename, 'valid': False}
+    name = filename[:len(filename) - 4]
+    with contextlib.redirect_stdout(log):
+        print(filename + ":")
+        with GPSProject_stats.stage(file_stats, 'read'):
+            if data is not None:
+                track = read_track(io.TextIOWrapper(io.BytesIO(data)), counts=file_stats.counts if stats else None)
+            elif binary:
+                track = map_track_file(file)
+            elif filename.endswith(".kml"):
+                track = read_kml_track(file)
+            else:
+                with open(file) as handle:
+                    track = read_track(handle, counts=file_stats.counts if stats else None)
+        with GPSProject_stats.stage(file_stats, 'within_radius'):
+            gps_data = export_valid_track(track, name, save_kml=False)
+        if stats and len(gps_data) == 0:
+            file_stats.rejection = rejection_reason(track)
+        if len(gps_data) and save_kml:
+            with GPSProject_stats.stage(file_stats, 'kml_export'):
+                write_trip_kml(gps_data, name)
+        if len(gps_data) >= 2:
+            record.update(score_track(gps_data, file_stats))
+            del record['gps_data']
+            record['valid'] = True
         print()
+    record['log'] = log.getvalue()
+    if cache is not None and not binary:
+        with GPSProject_stats.stage(file_stats, 'cache'):
+            cache.save(key, record_to_arrays(record, gps_data))
+    if stats:
+        record['stats'] = file_stats.as_dict()
+    return record
+
+
+def process_files(path, jobs=1, cache=None, save_kml=True, stats=False, threads=4):
+    """
+    Generator over the result records of every file of an input root, in file name order (archive order for
+    the members of a tar archive). With more than one job the files are processed by a pool of worker
+    processes, and the records are still yielded in that order, so nothing depends on the order in which the
+    workers finish. Compressed files and archives are decompressed by background threads while the files
+    before them are processed.
+    :param path: input root, a directory of text (or track) files, a tar archive or a single (compressed) file
+    :param jobs: number of worker processes, 1 processes the files serially in this process
+    :param cache: ParseCache used to skip the files which did not change, or None
+    :param save_kml: False to skip the KML files of the trips
+    :param stats: True to add the statistics of every file to its record
+    :param threads: number of threads decompressing the compressed files of a directory
+    :return: generator of result records from process_file()
+    """
+    yield from GPSProject_ingest.map_inputs(process_file, path, None, jobs, threads, cache, save_kml, stats)
+
+    if cache is not None:
+        cache.evict()
+
+
+def record_summary(record):
+    """
+    :param record: result record of a valid trip
+    :return: dictionary with the name, cost and trip time of the trip and the number of hazards of every kind
+    """
+    return {'file_name': record['file_name'], 'cost': record['cost'], 'trip_time': record['trip_time'],
+            'left_right_coordinates': len(record['left_right_coordinates']),
+            'stop_signs': len(record['stop_signs']), 'traffic_signals': len(record['traffic_signals']),
+            'errands': len(record['errands'])}
+
 
+class TripRanker:
+    """
+    Streaming ranking of the trips. Only the k trips with the lowest cost keep their full result record (in a
+    heap), every other trip only keeps a summary with its name, cost, trip time and number of hazards. Memory
+    use is therefore bounded by k, not by the number of trips.
+    """
 
-def detect_left_or_right(gps_data, start, left_right_coordinates, skip_size):
+    def __init__(self, k=5):
+        """
+        :param k: number of trips whose full result record is kept
+        """
+        self.k = k
+        self.heap = []  # (-cost, -position, record) of the k best trips, the worst trip first
+        self.summaries = []
+
+    def __len__(self):
+        return len(self.summaries)
+
+    def add(self, record):
+        """
+        Adds the result record of a valid trip.
+        :param record: result record from process_file()
+        :return:
+        """
+        self.summaries.append(record_summary(record))
+        # for the same cost the earlier file is better, like min() over the list of costs
+        item = (-record['cost'], -len(self.summaries), record)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item[:2] > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, item)
+
+    def ranking(self):
+        """
+        :return: result records of the k best trips, the best trip first
+        """
+        return [item[2] for item in sorted(self.heap, key=lambda item: item[:2], reverse=True)]
+
+    def report(self):
+        """
+        Prints the ranking of the k best trips.
+        :return:
+        """
+        print("rank  cost            trip time (mins)  turns  stop signs  signals  errands  file")
+        for rank, record in enumerate(self.ranking(), 1):
+            print("{0:<5} {1:<15.6f} {2:<17.2f} {3:<6} {4:<11} {5:<8} {6:<8} {7}".format(
+                rank, record['cost'], record['trip_time'] / 60, len(record['left_right_coordinates']),
+                len(record['stop_signs']), len(record['traffic_signals']), len(record['errands']),
+                record['file_name']))
+        print(len(self), "valid files")
+
+
+def openFile(jobs=1, cache=None, top=5, save_kml=True, run_stats=None, path=None, threads=4):
+    """
+    This function takes in each text file and parses it, and ranks the valid files. The names and costs of all
+    valid files are saved in file_name_list and cost_function_list.
+    :param jobs: number of worker processes, 1 processes the files serially in this process
+    :param cache: ParseCache used to skip the files which did not change, or None
+    :param top: number of best trips whose full results are kept
+    :param save_kml: False to skip the KML files of the trips
+    :param run_stats: GPSProject_stats.RunStats in which the statistics of every file are collected, or None
+    :param path: input root (see process_files()), input_path if None
+    :param threads: number of threads decompressing the compressed files of a directory
+    :return: TripRanker
+    """
+    global file_name_list
+    global cost_function_list
+    ranker = TripRanker(top)
+    path = input_path if path is None else path
+    for record in process_files(path, jobs, cache, save_kml, run_stats is not None, threads):
+        print(record.pop('log'), end="")
+        if run_stats is not None:
+            run_stats.add(record.pop('stats'))
+        if not record.pop('valid'):
+            continue
+        file_name_list.append(record['file_name'])
+        cost_function_list.append(record['cost'])
+        ranker.add(record)
+    return ranker
+
+
+def find_turns(gps_data, start, skip_size):
+    """
+    Vectorized turn detection. The tracking angle of every coordinate is compared with the angle skip_size
+    coordinates ahead in one pass over the whole track, and a change between 60 and 120 degrees is a turn
+    candidate. After a turn the next skip_size coordinates are skipped, exactly like the original while-loop.
+
+    As in the original detector, a right turn is an increase of the angle and a left turn is a decrease,
+    also when it crosses 0 degrees (e.g. 0.16 degrees to 358.2 degrees).
+
+    :param gps_data: Track or list of fixes
+    :param start: starting coordinate
+    :param skip_size: This is the window size to which the current coordinate will be compared to
+    :return: array of the indices of the turns and array of their directions (RIGHT_TURN or LEFT_TURN)
+    """
+    angle = as_track(gps_data).angle
+    start = max(start, 0)
+    if start >= len(angle) - skip_size:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8)
+
+    current_coord = angle[start:len(angle) - skip_size]
+    next_coord = angle[start + skip_size:]
+    difference = current_coord - next_coord
+    right = (-120 < difference) & (difference < -60)
+    left = ((60 < difference + 360) & (difference + 360 < 120)) | ((60 < difference) & (difference < 120))
+    candidates = np.flatnonzero(right | left)
+
+    # after a turn the search jumps ahead by skip_size, so only the first candidate at or after
+    # the jump is kept; this loop runs once per turn, not once per coordinate, over plain ints since a
+    # numpy call per turn costs more than the old scan on tracks with many candidates (noisy headings)
+    candidates = candidates.tolist()
+    selected = []
+    position = 0
+    while position < len(candidates):
+        candidate = candidates[position]
+        selected.append(candidate)
+        position = bisect.bisect_left(candidates, candidate + skip_size, position + 1)
+    selected = np.array(selected, dtype=np.int64)
+    directions = np.where(right[selected], RIGHT_TURN, LEFT_TURN).astype(np.int8)
+    return selected + start, directions
+
+
+def detect_left_or_right(gps_data, start, left_right_coordinates, skip_size, turn_directions=None):
     """
     This function is specifically created to identify the left and the right turns on the entire data set.
     The left and the right turns are identified irrespective of any traffic signal or stop signs present at
@@ -190,32 +903,140 @@ def detect_left_or_right(gps_data, start, left_right_coordinates, skip_size):
     :param start: starting coordinate
     :param left_right_coordinates: list in which the coordinates are to be stored
     :param skip_size: This is the window size to which the current coordinate will be compared to
+    :param turn_directions: optional list in which the direction ('left' or 'right') of every turn is stored
     :return:
     """
+    track = as_track(gps_data)
+    indices, directions = find_turns(track, start, skip_size)
+    left_right_coordinates.extend(zip(track.longitude[indices].tolist(), track.latitude[indices].tolist()))
+    if turn_directions is not None:
+        turn_directions.extend('right' if direction == RIGHT_TURN else 'left' for direction in directions)
+    return left_right_coordinates
+
+
+def next_index(mask):
+    """
+    For every position of a boolean array (and the position just past its end), finds the index of the first
+    True value at or after it, or len(mask) if there is none.
+    :param mask: boolean array
+    :return: integer array with len(mask) + 1 values
+    """
+    indices = np.where(mask, np.arange(len(mask)), len(mask))
+    return np.append(np.minimum.accumulate(indices[::-1])[::-1], len(mask))
 
-    while(start < len(gps_data) - skip_size):
-        current_coord = gps_data[start][4]
-        next_coord = gps_data[start + skip_size][4]
-
-        if current_coord < next_coord and -120 < current_coord - next_coord < -60:
-            # right turn
-            left_right_coordinates.append((gps_data[start][0], gps_data[start][1]))  # store the coordinates
-            start = start + skip_size
-        elif current_coord <= next_coord and 60 < current_coord - next_coord + 360 < 120:
-            # handles values in which current_coord is 0.16 degrees and next_coord is 358.2 degrees
-            left_right_coordinates.append((gps_data[start][0], gps_data[start][1]))  # store the coordinates
-            start = start + skip_size
-        elif current_coord > next_coord and 60 < current_coord - next_coord < 120:
-            # left turn
-            left_right_coordinates.append((gps_data[start][0], gps_data[start][1]))  # store the coordinates
-            start = start + skip_size
+
+def segment_stops(gps_data, start, threshold=10):
+    """
+    Finds every low speed (<= threshold mph) segment of the track in one pass and returns them as a compact table.
+
+    The runs of low speed are found with run-length encoding over the whole speed array. Each segment then
+    only needs one searchsorted to find where the next one can begin, using the same rules as the original
+    scan: the segment ends one coordinate after the first coordinate which is not in 0-threshold mph (or at the last
+    coordinate), and the search resumes right after that end. A low speed run starting at the very last
+    coordinate has no end point and is ignored.
+
+    The table is a structured array with the fields:
+    start - index of the first coordinate of the segment
+    end - index of the coordinate at which the segment ends
+    dwell - difference between the times recorded at start and end
+    displacement - distance in miles between start and end
+
+    :param gps_data: Track or list of fixes
+    :param start: starting coordinate
+    :param threshold: highest speed in mph of a low speed segment
+    :return: table of segments
+    """
+    track = as_track(gps_data)
+    speed = track.speed * 1.1508  # speed in mph
+    last = len(speed) - 1
+
+    # run-length encoding of the speed: for every coordinate, where the next low speed run starts and where
+    # the next run is broken
+    slow = speed <= threshold
+    next_slow = next_index(slow).tolist()
+    next_break = next_index(~((0.0 <= speed) & slow)).tolist()
+
+    starts = []
+    ends = []
+    position = min(max(start, 0), len(speed))
+    while next_slow[position] < last:
+        segment_start = next_slow[position]
+        segment_break = next_break[segment_start + 1]
+        if segment_break == segment_start + 1:
+            segment_end = segment_start + 1
         else:
-            # if no turn detected
-            start += 1
-    return left_right_coordinates
+            segment_end = min(segment_break + 1, last)
+        starts.append(segment_start)
+        ends.append(segment_end)
+        position = segment_end + 1
+
+    segments = np.zeros(len(starts), dtype=SEGMENT_DTYPE)
+    segments['start'] = starts
+    segments['end'] = ends
+    segments['dwell'] = np.abs(track.time[segments['start']] - track.time[segments['end']])
+    start_points = np.column_stack((track.longitude[segments['start']], track.latitude[segments['start']]))
+    end_points = np.column_stack((track.longitude[segments['end']], track.latitude[segments['end']]))
+    segments['displacement'] = haversine_array(start_points, end_points, unit='mi')
+    return segments
+
+
+def classify_stops(segments):
+    """
+    Splits the segments which stayed within 0.09 miles into stop signs (<= 7 seconds), traffic signals
+    (<= 50 seconds) and errands.
+    :param segments: table of segments from segment_stops()
+    :return: boolean masks of the stop signs, traffic signals and errands
+    """
+    stationary = segments['displacement'] < 0.09
+    dwell = segments['dwell']
+    stop_sign = stationary & (dwell <= 7)
+    traffic_signal = stationary & (7 < dwell) & (dwell <= 50)
+    errand = stationary & (dwell > 50)
+    return stop_sign, traffic_signal, errand
+
+
+def stop_events(segments):
+    """
+    :param segments: table of segments from segment_stops()
+    :return: arrays of the index of the first fix, the kind (1 stop sign, 2 traffic signal, 3 errand) and the
+             dwell time of every stop, the stop signs first, then the traffic signals and the errands
+    """
+    masks = classify_stops(segments)
+    index = np.concatenate([segments['start'][mask] for mask in masks]).astype(np.int64)
+    kind = np.concatenate([np.full(int(mask.sum()), code, dtype=np.int64) for code, mask in enumerate(masks, 1)])
+    dwell = np.concatenate([segments['dwell'][mask] for mask in masks])
+    return index, kind, dwell
+
+
+def track_events(track, skip_size=30):
+    """
+    Finds the turns and stops of a track like score_track(), in the order they were passed.
+    :param track: Track
+    :param skip_size: window size of the turn detector
+    :return: arrays of the index of the fix, the kind (0 left or right turn, 1 stop sign, 2 traffic signal,
+             3 errand) and the dwell time (0 for the turns) of every event, sorted by the index and for the same
+             fix by the kind
+    """
+    start = first_moving_index(track)
+    turns, _ = find_turns(track, start, skip_size)
+    stops, kind, dwell = stop_events(segment_stops(track, start))
+    index = np.concatenate((turns, stops)).astype(np.int64)
+    kind = np.concatenate((np.zeros(len(turns), dtype=np.int64), kind))
+    dwell = np.concatenate((np.zeros(len(turns)), dwell))
+    order = np.lexsort((kind, index))
+    return index[order], kind[order], dwell[order]
 
 
-def detect_specific_stops(gps_data, stop_signs, traffic_signals, errands, start):
+def seconds_of_day(times):
+    """
+    :param times: array of times in the hhmmss.ss format of the $GPRMC sentences
+    :return: array of seconds since midnight
+    """
+    times = np.asarray(times, dtype=np.float64)
+    return (times // 10000) * 3600 + (times // 100 % 100) * 60 + times % 100
+
+
+def detect_specific_stops(gps_data, stop_signs, traffic_signals, errands, start, segments=None):
     """
     This function is created to detect three things:
         - Stop signs (Which includes left and right turns but will be counted as a different coordinate)
@@ -233,93 +1054,103 @@ def detect_specific_stops(gps_data, stop_signs, traffic_signals, errands, start)
     :param traffic_signals: list in which traffic_signals coordinates are to be stored
     :param errands: list in which errands coordinates are to be stored
     :param start: starting coordinate
+    :param segments: table of segments from segment_stops(), computed if not given
     :return:
     """
-    time_at_stops = 0
-    while(start < len(gps_data)):
-        current_coordinates = (gps_data[start][0], gps_data[start][1])
-        current_speed = gps_data[start][2] * 1.1508
-        current_time = gps_data[start][3]
-
-
-        if(current_speed <= 10):
-
-            next_point = 0
-            # print(i, (gps_data[i][2] * 1.1508), (gps_data[i][0], gps_data[i][1]))
-            if(start < len(gps_data) - 1):
-                next_point = start + 1
-            new_speed = (gps_data[next_point][2]*1.1508)
-            # print(new_speed)
-            while((0.0 <= new_speed <= 10) and next_point < len(gps_data)-1):
-                new_speed = (gps_data[next_point][2] * 1.1508)
-                next_point += 1
-
-
-            # list_of_coordinates.append(gps_data[i])
-
-            new_coordinates = (gps_data[next_point][0], gps_data[next_point][1])
-            new_time = gps_data[next_point][3]
-            # print(current_time, new_time)
-            time_difference = abs(float(current_time) - float(new_time))
-            haversine_distance = haversine(current_coordinates, new_coordinates, unit=Unit.MILES)
-            if haversine_distance < 0.09:
-                if (time_difference <= 7):
-                    stop_signs.append(gps_data[start])  # stop_sign
-                    time_at_stops += time_difference
-                elif (7 < time_difference and time_difference <= 50):
-                    traffic_signals.append(gps_data[start])  # traffic
-                    time_at_stops += time_difference
-                else:
-                    if (time_difference > 50):
-                        errands.append(gps_data[start])  # errands
-                        time_at_stops += time_difference
-            start = next_point
-        start += 1
+    track = as_track(gps_data)
+    if segments is None:
+        segments = segment_stops(track, start)
+    stop_sign, traffic_signal, errand = classify_stops(segments)
+
+    stop_signs.extend(track[i] for i in segments['start'][stop_sign])  # stop_sign
+    traffic_signals.extend(track[i] for i in segments['start'][traffic_signal])  # traffic
+    errands.extend(track[i] for i in segments['start'][errand])  # errands
+    # added one by one in the order of the segments so that the total is the same as before
+    time_at_stops = sum(segments['dwell'][stop_sign | traffic_signal | errand].tolist())
 
     return stop_signs, traffic_signals, errands, time_at_stops
 
 
-def detect_stops(gps_data):
+def score_track(gps_data, stats=None):
     """
-    Detecting left_right turns and stop_signs, traffic_signals and errands
+    Detecting left_right turns and stop_signs, traffic_signals and errands and calculating the cost of the trip.
     gps_data has the following attributes:
     0 - latitudes
     1 - longitudes
     2 - speed
     3 - time
     4 - tracking angle
-    :param gps_data: contains the attributes as mentioned above
-    :return:
+    :param gps_data: contains the attributes as mentioned above, either as a Track, a list or an iterable of
+                     fixes such as parse_gprmc()
+    :param stats: GPSProject_stats.FileStats in which the time of the detectors is measured, or None
+    :return: dictionary with the gps_data, the detected coordinates and the cost
     """
+    gps_data = as_track(gps_data)
     left_right_coordinates = []  # list in which the left right coordinates are to be stored
     stop_signs = []  # list in which the stop_signs coordinates are to be stored
     traffic_signals = []  # list in which the traffic_signals coordinates are to be stored
     errands = []  # list in which the errands coordinates are to be stored
     skip_size = 30
-    i = 0  # start coordinate
-
     dict1 = {}
 
     # Here we are skipping the initial coordinates where speed is less than 10 mph otherwise they might be considered
     # as stop signs or turns
-    while (i < len(gps_data) and gps_data[i][2] <= 10):
-        i += 1
-    start = i
+    start = first_moving_index(gps_data)
 
-    left_right_coordinates = detect_left_or_right(gps_data, start, left_right_coordinates, skip_size)
+    turn_directions = []  # list in which the direction of every turn is stored
+    with GPSProject_stats.stage(stats, 'detect_left_or_right'):
+        left_right_coordinates = detect_left_or_right(gps_data, start, left_right_coordinates, skip_size,
+                                                      turn_directions)
 
-    stop_signs, traffic_signals, errands, time_at_stops = detect_specific_stops(gps_data, stop_signs, traffic_signals,
-                                                                                errands, start)
+    with GPSProject_stats.stage(stats, 'detect_specific_stops'):
+        stop_segments = segment_stops(gps_data, start)
+        stop_signs, traffic_signals, errands, time_at_stops = detect_specific_stops(
+            gps_data, stop_signs, traffic_signals, errands, start, stop_segments)
     dict1['gps_data'] = gps_data
     dict1['left_right_coordinates'] = left_right_coordinates
+    dict1['turn_directions'] = turn_directions
     dict1['stop_signs'] = stop_signs
     dict1['traffic_signals'] = traffic_signals
     dict1['errands'] = errands
+    dict1['stop_segments'] = stop_segments
+    dict1['trip_time'] = trip_duration(gps_data)
+    with GPSProject_stats.stage(stats, 'cost_function'):
+        dict1['cost'] = calculate_tripTime(gps_data, stop_signs, traffic_signals, errands, time_at_stops,
+                                           left_right_coordinates)
+    return dict1
+
+
+def first_moving_index(gps_data):
+    """
+    :param gps_data: Track or list of fixes
+    :return: index of the first coordinate with a speed above 10, or the length of the track if there is none
+    """
+    speed = as_track(gps_data).speed
+    moving = np.flatnonzero(speed > 10)
+    return int(moving[0]) if len(moving) else len(speed)
 
+
+def detect_stops(gps_data):
+    """
+    Detecting left_right turns and stop_signs, traffic_signals and errands of a track and saving the results
+    along with its cost in stops_list_of_dict and cost_function_list.
+    :param gps_data: Track, list or iterable of fixes
+    :return:
+    """
     global stops_list_of_dict
+    global cost_function_list
+    dict1 = score_track(gps_data)
+    cost_function_list.append(dict1.pop('cost'))
     stops_list_of_dict.append(dict1)
 
-    calculate_tripTime(gps_data, stop_signs, traffic_signals, errands, time_at_stops, left_right_coordinates)
+def trip_duration(gps_data):
+    """
+    :param gps_data: Track or list of fixes
+    :return: trip time, the difference between the first time and the last time.
+    """
+    gps_data = as_track(gps_data)
+    return abs(float(gps_data.time[0]) - float(gps_data.time[-1]))
+
 
 def calculate_tripTime(gps_data, stop_signs, traffic_signals, errands, time_at_stops, left_right_coordinates):
     """
@@ -331,12 +1162,11 @@ def calculate_tripTime(gps_data, stop_signs, traffic_signals, errands, time_at_s
     :param errands: list of coordinates where vehicles were stopped for errands
     :param time_at_stops: total time spent at all the stop signs, traffic signals and errands.
     :param left_right_coordinates: list of coordinates with left and right turns
-    :return:
+    :return: cost of the trip
     """
 
-    # trip time here is the difference between the first time and the last time.
-    trip_time = abs(gps_data[0][3] - gps_data[len(gps_data)-1][3])
-    cost_function(trip_time, gps_data, stop_signs, traffic_signals, errands, time_at_stops, left_right_coordinates)
+    trip_time = trip_duration(gps_data)
+    return cost_function(trip_time, gps_data, stop_signs, traffic_signals, errands, time_at_stops, left_right_coordinates)
 
 def cost_function(trip_time, gps_data, stop_signs, traffic_signals, errands, time_at_stops, left_right_coordinates):
     """
@@ -350,27 +1180,33 @@ def cost_function(trip_time, gps_data, stop_signs, traffic_signals, errands, tim
     :param errands: list of coordinates where vehicles were stopped for errands
     :param time_at_stops: total time spent at all the stop signs, traffic signals and errands.
     :param left_right_coordinates: list of coordinates with left and right turns
-    :return:
+    :return: cost of the trip
     """
-    velocity = []  # list of all velocities
-    global file_name_list
-    global cost_function_list
-    for i in range(len(gps_data)):
-        velocity.append(gps_data[i][2]*1.1508)
-
-    max_velocity = max(velocity)
-    time_at_stops_minutes = time_at_stops/60
+    max_velocity = float(as_track(gps_data).speed.max()) * 1.1508
 
     total_stops = len(stop_signs) + len(traffic_signals) + len(left_right_coordinates) + len(errands)
-    final_cost_function = (0.5*(trip_time/30)) + (0.15*(time_at_stops_minutes/15)) + (0.15*(len(left_right_coordinates)/40))
+    final_cost_function = trip_cost(trip_time, time_at_stops, len(left_right_coordinates))
     (0.1*(total_stops/20)) + (0.1*(max_velocity/60))
 
 
-    cost_function_list.append(final_cost_function)
     print("trip time: ", (trip_time/60), "mins", " ----> cost: ", final_cost_function)
+    return final_cost_function
 
 
-def create_best_kml(filename, gps_data, left_right_coordinates, stop_signs, traffic_signals, errands):
+def trip_cost(trip_time, time_at_stops, turn_count):
+    """
+    The objective of cost_function(), from the totals of a trip. This is also used to keep the running cost of a
+    trip which is still being recorded (see GPSProject_online).
+    :param trip_time: trip time in seconds
+    :param time_at_stops: total time spent at all the stop signs, traffic signals and errands.
+    :param turn_count: number of left and right turns
+    :return: cost of the trip
+    """
+    time_at_stops_minutes = time_at_stops/60
+    return (0.5*(trip_time/30)) + (0.15*(time_at_stops_minutes/15)) + (0.15*(turn_count/40))
+
+
+def create_best_kml(filename, gps_data, left_right_coordinates, stop_signs, traffic_signals, errands, tolerance=0):
     """
     Creates 5 kml files i.e.
         - kml file of the actual txt file
@@ -385,88 +1221,27 @@ def create_best_kml(filename, gps_data, left_right_coordinates, stop_signs, traf
     :param traffic_signals: list of coordinates with traffic signals
     :param errands: list of coordinates where vehicles were stopped for errands
     :param left_right_coordinates: list of coordinates with left and right turns
+    :param tolerance: tolerance in meters of the simplified route, 0 writes every fix
     :return:
     """
 
     #  kml file of the gps data
     name = filename[:len(filename) - 4]
-    kml = simplekml.Kml()
-    ls = kml.newlinestring(extrude=1)
-    ls.description = "Speed in knots, instead of altitude"
-    ls.altitudemode = simplekml.AltitudeMode.relativetoground
-    ls.tessellate = 1
-    # Saving the tuples for kml file
-    ls.coords = gps_data
-    ls.style.linestyle.width = 4
-    ls.style.linestyle.color = simplekml.Color.yellow
+    track = as_track(gps_data)
+    sizes = write_trip_kml(track, name, final_kml_path, tolerance)
+    if tolerance > 0:
+        print("best route simplified from", len(track), "fixes to", " / ".join(map(str, sizes)),
+              "points ----> ratio: ", round(GPSProject_simplify.compression_ratio(len(track), sizes[-1]), 1))
+
+    #  kml files of the left and right coordinates, stop signs, traffic signals and errands
+    for kmlFile_n, style_id, coordinates in (("left_right.kml", 'left_right', left_right_coordinates),
+                                             ("stop_signs.kml", 'stop_sign', stop_signs),
+                                             ("traffic_signal.kml", 'traffic_signal', traffic_signals),
+                                             ("errands.kml", 'errand', errands)):
+        with GPSProject_kml.KmlWriter(os.path.join(final_kml_path, kmlFile_n)) as kml:
+            kml.icon_style(style_id, GPSProject_kml.HAZARD_ICONS[style_id])
+            kml.points(coordinates, style_id)
 
-    # Creating the kml file
-    kmlFile = name + ".kml"
-    kml.save("C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\final_kml\\" + kmlFile)
-
-    #  kml file of the left and right coordinates
-    kml = simplekml.Kml()
-    ls = kml.newpoint()
-    ls.description = "Speed in knots, instead of altitude"
-    ls.altitudemode = simplekml.AltitudeMode.relativetoground
-    ls.tessellate = 1
-    style = simplekml.Style()
-    # Saving the tuples for kml file
-    for i in range(len(left_right_coordinates)):
-        pnt = kml.newpoint(name='Point: {0}, {1}'.format(left_right_coordinates[i][0], left_right_coordinates[i][1]))
-        pnt.coords = [(left_right_coordinates[i][0], left_right_coordinates[i][1])]
-        pnt.style = style
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/paddle/purple-circle.png'
-    kmlFile_n = "left_right.kml"
-    kml.save("C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\final_kml\\" + kmlFile_n)
-
-    #  kml file of the stop signals coordinates
-    kml = simplekml.Kml()
-    ls1 = kml.newpoint()
-    ls1.description = "Speed in knots, instead of altitude"
-    ls1.altitudemode = simplekml.AltitudeMode.relativetoground
-    ls1.tessellate = 1
-    style = simplekml.Style()
-    # Saving the tuples for kml file
-    for i in range(len(stop_signs)):  # Generate longitude values
-        pnt = kml.newpoint(name='Point: {0}, {1}'.format(stop_signs[i][0], stop_signs[i][1]))
-        pnt.coords = [(stop_signs[i][0], stop_signs[i][1])]
-        pnt.style = style
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/paddle/red-circle.png'
-    kmlFile_n = "stop_signs.kml"
-    kml.save("C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\final_kml\\" + kmlFile_n)
-
-    #  kml file of the traffic signals coordinates
-    kml = simplekml.Kml()
-    ls2 = kml.newpoint()
-    ls2.description = "Speed in knots, instead of altitude"
-    ls2.altitudemode = simplekml.AltitudeMode.relativetoground
-    ls2.tessellate = 1
-    style = simplekml.Style()
-    # Saving the tuples for kml file
-    for i in range(len(traffic_signals)):  # Generate longitude values
-        pnt = kml.newpoint(name='Point: {0}, {1}'.format(traffic_signals[i][0], traffic_signals[i][1]))
-        pnt.coords = [(traffic_signals[i][0], traffic_signals[i][1])]
-        pnt.style = style
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/paddle/grn-circle.png'
-    kmlFile_n = "traffic_signal.kml"
-    kml.save("C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\final_kml\\" + kmlFile_n)
-
-    #  kml file of the errands coordinates
-    kml = simplekml.Kml()
-    ls3 = kml.newpoint()
-    ls3.description = "Speed in knots, instead of altitude"
-    ls3.altitudemode = simplekml.AltitudeMode.relativetoground
-    ls3.tessellate = 1
-    style = simplekml.Style()
-    # Saving the tuples for kml file
-    for i in range(len(errands)):  # Generate longitude values
-        pnt = kml.newpoint(name='Point: {0}, {1}'.format(errands[i][0], errands[i][1]))
-        pnt.coords = [(errands[i][0], errands[i][1])]
-        pnt.style = style
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/paddle/orange-circle.png'
-    kmlFile_n = "errands.kml"
-    kml.save("C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\final_kml\\" + kmlFile_n)
 
 def all_stops_together(filename, gps_data, left_right_coordinates, stop_signs, traffic_signals, errands):
     """
@@ -480,82 +1255,121 @@ def all_stops_together(filename, gps_data, left_right_coordinates, stop_signs, t
     :param left_right_coordinates: list of coordinates with left and right turns
     :return:
     """
-    name = filename[:len(filename) - 4]
-
     # Creating the kml file
-    kml = simplekml.Kml()
-    ls = kml.newpoint()
-    ls.description = "Speed in knots, instead of altitude"
-    ls.altitudemode = simplekml.AltitudeMode.relativetoground
-    ls.tessellate = 1
-    style = simplekml.Style()
-    # Saving the tuples for kml file
-    for i in range(len(left_right_coordinates)):
-        pnt = kml.newpoint(name='Point: {0}, {1}'.format(left_right_coordinates[i][0], left_right_coordinates[i][1]))
-        pnt.coords = [(left_right_coordinates[i][0], left_right_coordinates[i][1])]
-        pnt.style = style
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/paddle/purple-circle.png'
-
-    ls1 = kml.newpoint()
-    ls1.description = "Speed in knots, instead of altitude"
-    ls1.altitudemode = simplekml.AltitudeMode.relativetoground
-    ls1.tessellate = 1
-    style = simplekml.Style()
-    # Saving the tuples for kml file
-    for i in range(len(stop_signs)):  # Generate longitude values
-        pnt = kml.newpoint(name='Point: {0}, {1}'.format(stop_signs[i][0], stop_signs[i][1]))
-        pnt.coords = [(stop_signs[i][0], stop_signs[i][1])]
-        pnt.style = style
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/paddle/red-circle.png'
-
-    ls2 = kml.newpoint()
-    ls2.description = "Speed in knots, instead of altitude"
-    ls2.altitudemode = simplekml.AltitudeMode.relativetoground
-    ls2.tessellate = 1
-    style = simplekml.Style()
-    # Saving the tuples for kml file
-    for i in range(len(traffic_signals)):  # Generate longitude values
-        pnt = kml.newpoint(name='Point: {0}, {1}'.format(traffic_signals[i][0], traffic_signals[i][1]))
-        pnt.coords = [(traffic_signals[i][0], traffic_signals[i][1])]
-        pnt.style = style
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/paddle/grn-circle.png'
-
-
-    ls3 = kml.newpoint()
-    ls3.description = "Speed in knots, instead of altitude"
-    ls3.altitudemode = simplekml.AltitudeMode.relativetoground
-    ls3.tessellate = 1
-    style = simplekml.Style()
-    # Saving the tuples for kml file
-    for i in range(len(errands)):  # Generate longitude values
-        pnt = kml.newpoint(name='Point: {0}, {1}'.format(errands[i][0], errands[i][1]))
-        pnt.coords = [(errands[i][0], errands[i][1])]
-        pnt.style = style
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/paddle/orange-circle.png'
     kmlFile = "GPS_Hazards.kml"
-    kml.save("C:\\Users\\Naresh Shah\\PycharmProjects\\BDAproject\\final_kml\\" + kmlFile)
+    with GPSProject_kml.KmlWriter(os.path.join(final_kml_path, kmlFile)) as kml:
+        kml.hazard_styles()
+        kml.points(left_right_coordinates, 'left_right')
+        kml.points(stop_signs, 'stop_sign')
+        kml.points(traffic_signals, 'traffic_signal')
+        kml.points(errands, 'errand')
 
 
+def input_arguments():
+    """
+    Parent parser of the options every script reading the gps logs has: --input, --jobs and --cache.
+    :return: argparse.ArgumentParser for the parents of a parser
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--input", default=input_path, metavar="PATH",
+                        help="directory, tar archive (.tar, .tar.gz, .tar.xz) or .gz/.xz file with the gps logs")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes used to process the files (0 uses every core)")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="directory of the parse cache, files which did not change are not parsed again")
+    return parser
 
-def main():
-    global file_name_list
-    global cost_function_list
-    global stops_list_of_dict
+
+def open_inputs(args):
+    """
+    :param args: arguments parsed by a parser with input_arguments() as parent, and optionally --cache-size
+    :return: number of worker processes and ParseCache, None without --cache
+    """
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    cache = None
+    if args.cache:
+        cache = GPSProject_cache.ParseCache(args.cache, getattr(args, 'cache_size', 1024) * 1024 ** 2, CACHE_VERSION)
+    return jobs, cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Finds the fast and safe route from the gps text files.",
+                                     parents=[input_arguments()])
+    parser.add_argument("--threads", type=int, default=4,
+                        help="number of threads decompressing the compressed logs of a directory")
+    parser.add_argument("--cache-size", type=int, default=1024, metavar="MB",
+                        help="size limit of the parse cache, least recently used entries are removed first")
+    parser.add_argument("--clear-cache", action="store_true", help="empty the parse cache before the run")
+    parser.add_argument("--top", type=int, default=5, help="number of best trips in the ranking")
+    parser.add_argument("--trip-kml", choices=("all", "top", "none"), default="all",
+                        help="create the kml file of every valid trip, only of the top trips, or of none")
+    parser.add_argument("--simplify", type=float, default=SIMPLIFY_TOLERANCE, metavar="M",
+                        help="tolerance in meters of the finest level of detail of the best route kml "
+                             "(default %(default)s)")
+    parser.add_argument("--full-resolution", action="store_true",
+                        help="write every fix of the best route instead, so the kml file can be scored again "
+                             "with read_kml_track()")
+    parser.add_argument("--stats", metavar="FILE",
+                        help="write the time of every stage and the sentence counts of every file to a json file")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write a cProfile dump of the run (of this process only, use it with --jobs 1)")
+    args = parser.parse_args(argv)
+    jobs, cache = open_inputs(args)
+    if cache is not None and args.clear_cache:
+        cache.clear()
+
+    run_stats = GPSProject_stats.RunStats() if args.stats else None
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        find_best_route(args, jobs, cache, run_stats)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if run_stats is not None:
+            run_stats.save(args.stats)
+
+
+def find_best_route(args, jobs, cache, run_stats):
+    """
+    Ranks the files and creates the kml files of the best route, the body of main().
+    :param args: parsed command line of main()
+    :param jobs: number of worker processes
+    :param cache: ParseCache or None
+    :param run_stats: GPSProject_stats.RunStats or None
+    :return:
+    """
     print('Reading 173 kml files...')
-    openFile()
-    min_cost_index = cost_function_list.index(min(cost_function_list))
-    file_name_min_cost = file_name_list[min_cost_index]
-    dictonary = stops_list_of_dict[min_cost_index]
+    ranker = openFile(jobs, cache, max(args.top, 1), args.trip_kml == "all", run_stats, args.input, args.threads)
+    if len(ranker) == 0:
+        print("No valid files")
+        return
+    dictonary = ranker.ranking()[0]
+    file_name_min_cost = dictonary['file_name']
     print()
     print("-------------------------------------------------------------------------------")
     print("file with minimum cost: ", file_name_min_cost,)
-    print("Calculated cost: ", min(cost_function_list))
+    print("Calculated cost: ", dictonary['cost'])
     print("-------------------------------------------------------------------------------")
+    ranker.report()
+    if args.trip_kml == "top":
+        for record in ranker.ranking():
+            filename = record['file_name']
+            write_trip_kml(load_track(args.input, filename, cache), filename[:len(filename) - 4])
+
+    # only the small result records are kept for every file, so the track of the best file is read again
+    dictonary['gps_data'] = load_track(args.input, file_name_min_cost, cache)
+
+    with GPSProject_stats.stage(run_stats.run if run_stats is not None else None, 'best_kml'):
+        create_best_kml(file_name_min_cost, dictonary['gps_data'], dictonary['left_right_coordinates'],
+                        dictonary['stop_signs'], dictonary['traffic_signals'], dictonary['errands'],
+                        0.0 if args.full_resolution else args.simplify)
 
-    create_best_kml(file_name_min_cost, dictonary['gps_data'], dictonary['left_right_coordinates'], dictonary['stop_signs'],
-                                                                    dictonary['traffic_signals'], dictonary['errands'])
+        all_stops_together(file_name_min_cost, dictonary['gps_data'], dictonary['left_right_coordinates'],
+                           dictonary['stop_signs'], dictonary['traffic_signals'], dictonary['errands'])
 
-    all_stops_together(file_name_min_cost, dictonary['gps_data'], dictonary['left_right_coordinates'], dictonary['stop_signs'],
-                                                                    dictonary['traffic_signals'], dictonary['errands'])
-main()
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import gzip
+import http.server
+import json
+import os
+import socketserver
+import stat
+import time
+import urllib.parse
+import zlib
+
+import GPSProject_planner
+import GPSProject_program as program
+
+"""
+Scoring service of the Fast and Safe Route Planning Project.
+
+A long running process which loads the corpus once into a RoutePlanner and then answers over HTTP, on a local
+TCP port or on a Unix socket:
+
+GET  /status                          number of trips and the best trip
+GET  /ranking?top=N                   summaries of the N best trips
+POST /score?name=NAME&add=1           scores the gps log in the body (gzip with Content-Encoding: gzip), returns
+                                      its cost and rank, and adds it to the corpus unless add=0
+GET  /kml?name=NAME&tolerance=M       KML document of a trip, the best trip without name (410 if the track of a
+                                      scored trip was dropped from memory, see --track-cache and --spill)
+
+For example:
+    python GPSProject_service.py --input logs.tar.gz --socket /tmp/route.sock
+    curl --unix-socket /tmp/route.sock --data-binary @new_trip.txt "http://localhost/score?name=new_trip.txt"
+
+Requests are answered one at a time, the planner is not shared between threads.
+"""
+
+KML_TYPE = "application/vnd.google-earth.kml+xml"
+
+
+class ScoringHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers the requests with the RoutePlanner of the server (server.planner).
+    """
+
+    def do_GET(self):
+        path, query = self.parse()
+        planner = self.server.planner
+        try:
+            if path == "/status":
+                self.send_json({'trips': len(planner), 'best': planner.best()})
+            elif path == "/ranking":
+                self.send_json(planner.ranking(number(query, 'top', int, planner.top)))
+            elif path == "/kml":
+                document = planner.kml(query.get('name'), number(query, 'tolerance', float, None))
+                self.send_body(document.encode("UTF-8"), KML_TYPE)
+            else:
+                self.send_json({'error': "unknown path"}, 404)
+        except ValueError as error:
+            self.send_json({'error': str(error)}, 400)
+        except GPSProject_planner.TrackEvicted:
+            self.send_json({'error': "track of the trip is no longer kept"}, 410)
+        except KeyError:
+            self.send_json({'error': "unknown trip"}, 404)
+
+    def do_POST(self):
+        path, query = self.parse()
+        if path != "/score":
+            self.send_json({'error': "unknown path"}, 404)
+            return
+        try:
+            length = number(self.headers, 'Content-Length', int, 0)
+        except ValueError as error:
+            self.send_json({'error': str(error)}, 400)
+            return
+        data = self.rfile.read(length)
+        if self.headers.get('Content-Encoding') == "gzip":
+            try:
+                data = gzip.decompress(data)
+            except (OSError, EOFError, zlib.error):
+                self.send_json({'error': "body is not gzip compressed"}, 400)
+                return
+        started = time.perf_counter()
+        try:
+            result = self.server.planner.score(data, query.get('name', "trip.txt"), query.get('add', "1") != "0")
+        except UnicodeDecodeError:
+            self.send_json({'error': "body is not a text gps log"}, 400)
+            return
+        result['milliseconds'] = (time.perf_counter() - started) * 1000
+        self.send_json(result)
+
+    def parse(self):
+        """
+        :return: path of the request and dictionary of the query parameters
+        """
+        url = urllib.parse.urlsplit(self.path)
+        return url.path, dict(urllib.parse.parse_qsl(url.query))
+
+    def send_json(self, value, status=200):
+        self.send_body(json.dumps(value).encode("UTF-8"), "application/json", status)
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # a Unix socket has no client address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+
+def number(query, name, kind, default):
+    """
+    :param query: dictionary of the query parameters (or the headers of the request)
+    :param name: name of the parameter
+    :param kind: int or float
+    :param default: value if the parameter is not given
+    :return: the value of the parameter, ValueError if it is not a number of that kind >= 0
+    """
+    if name not in query:
+        return default
+    message = "{0} is not a number >= 0: {1}".format(name, query[name])
+    try:
+        value = kind(query[name])
+    except ValueError:
+        raise ValueError(message)
+    if not 0 <= value < float('inf'):
+        raise ValueError(message)
+    return value
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    """
+    HTTP server on a Unix socket, which only local users with access to the socket file can reach.
+    """
+
+    def server_bind(self):
+        try:
+            mode = os.lstat(self.server_address).st_mode
+        except FileNotFoundError:
+            mode = None
+        if mode is not None:
+            # only a socket left over from a server which did not shut down is removed, never another file
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError("{0} exists and is not a socket".format(self.server_address))
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            if stat.S_ISSOCK(os.lstat(self.server_address).st_mode):
+                os.remove(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def make_server(planner, port=8765, socket_path=None, host="127.0.0.1"):
+    """
+    :param planner: RoutePlanner which answers the requests
+    :param port: TCP port, used without socket_path
+    :param socket_path: path of a Unix socket, or None to listen on the TCP port
+    :param host: address the TCP port is bound to, only this computer by default
+    :return: server, call serve_forever() to answer the requests
+    """
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, ScoringHandler)
+    else:
+        server = http.server.HTTPServer((host, port), ScoringHandler)
+    server.planner = planner
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scores new trips against the corpus over HTTP.",
+                                     parents=[program.input_arguments()])
+    parser.add_argument("--port", type=int, default=8765, help="TCP port on 127.0.0.1")
+    parser.add_argument("--socket", metavar="PATH", help="listen on a Unix socket instead of the TCP port")
+    parser.add_argument("--top", type=int, default=5, help="number of best trips in the ranking")
+    parser.add_argument("--simplify", type=float, default=program.SIMPLIFY_TOLERANCE, metavar="M",
+                        help="tolerance in meters of the finest level of detail of the kml documents "
+                             "(default %(default)s)")
+    parser.add_argument("--full-resolution", action="store_true",
+                        help="write every fix in the kml documents, unless a request asks for a tolerance")
+    parser.add_argument("--kml-cache", type=int, default=32, metavar="N", help="number of kml documents kept")
+    parser.add_argument("--track-cache", type=int, default=64, metavar="N",
+                        help="number of tracks of scored trips kept in memory")
+    parser.add_argument("--spill", metavar="DIR",
+                        help="directory of the track files of the other scored trips, without it their kml is gone")
+    args = parser.parse_args(argv)
+    jobs, cache = program.open_inputs(args)
+    tolerance = 0.0 if args.full_resolution else args.simplify
+
+    planner = GPSProject_planner.RoutePlanner(args.input, cache, jobs, top=args.top, tolerance=tolerance,
+                                              kml_cache_size=args.kml_cache, track_cache_size=args.track_cache,
+                                              spill_directory=args.spill)
+    started = time.perf_counter()
+    print(planner.load(), "trips loaded in {0:.2f} s".format(time.perf_counter() - started), flush=True)
+    try:
+        server = make_server(planner, args.port, args.socket)
+    except FileExistsError as error:
+        parser.error(str(error))
+    print("listening on", args.socket or "http://127.0.0.1:{0}".format(args.port), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
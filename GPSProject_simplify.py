@@ -0,0 +1,189 @@
+import argparse
+import os
+
+import numpy as np
+
+"""
+Track simplification of the Fast and Safe Route Planning Project.
+
+A route recorded at 1 Hz has a fix every few meters, far more vertices than Google Earth needs to draw it. The
+Douglas-Peucker algorithm keeps the fewest vertices such that no dropped fix is more than a tolerance (in meters)
+away from the simplified line. The recursion of the textbook version is replaced by passes over all the open
+ranges at once (see douglas_peucker()), so tracks of millions of fixes are simplified without hitting the
+recursion limit or one numpy call per vertex.
+
+Vertices which must survive (e.g. the fixes the detectors report as turns and stops) are passed as a mask and are
+kept at every tolerance. levels() computes several tolerances at once for the level of detail KML output, every
+level is a subset of the finer one.
+
+Usage: python GPSProject_simplify.py [--tolerance M] [--levels N] [--kml DIR] FILE...
+"""
+
+# mean earth radius in meters, the same value as GPSProject_program.EARTH_RADIUS['m']
+EARTH_RADIUS = 6371008.8
+
+
+def project(longitude, latitude):
+    """
+    Projects the coordinates to a flat plane in meters (equirectangular around the mean latitude). The error is
+    well below the tolerances used here for routes of a few hundred kilometers.
+    :param longitude: array of longitudes
+    :param latitude: array of latitudes
+    :return: arrays of the x and y coordinates in meters
+    """
+    longitude = np.radians(np.asarray(longitude, dtype=np.float64))
+    latitude = np.radians(np.asarray(latitude, dtype=np.float64))
+    if len(latitude) == 0:
+        return longitude, latitude
+    scale = np.cos(latitude.mean()) * EARTH_RADIUS
+    return (longitude - longitude[0]) * scale, (latitude - latitude[0]) * EARTH_RADIUS
+
+
+def segment_distances(x, y, points, first, last):
+    """
+    Squared distances in meters of points to segments. The distance to the segment (not to the infinite line) is
+    used, so a route which turns back on itself keeps the point where it turns.
+    :param x: array of x coordinates in meters
+    :param y: array of y coordinates in meters
+    :param points: indices of the points
+    :param first: index of the start of the segment of every point
+    :param last: index of the end of the segment of every point
+    :return: array of squared distances, one for every point
+    """
+    ax, ay = x[first], y[first]
+    dx, dy = x[last] - ax, y[last] - ay
+    px = x[points] - ax
+    py = y[points] - ay
+    length = dx * dx + dy * dy
+    t = np.clip(np.divide(px * dx + py * dy, length, out=np.zeros(len(length)), where=length > 0), 0, 1)
+    px -= t * dx
+    py -= t * dy
+    return px * px + py * py
+
+
+def douglas_peucker(x, y, tolerance, keep=None):
+    """
+    Iterative Douglas-Peucker simplification of projected coordinates.
+
+    Instead of splitting one range at a time, every pass splits all open ranges at once: each undecided point is
+    compared with the segment between the kept points around it, the farthest point of every range is found with
+    np.maximum.reduceat(), and the ranges without a point farther than the tolerance are closed. A pass costs a
+    few array operations over the undecided points, and a route needs about log2(n) passes, so even tracks of
+    millions of fixes are simplified in seconds. The result is the same as that of the recursive algorithm.
+
+    :param x: array of x coordinates in meters
+    :param y: array of y coordinates in meters
+    :param tolerance: largest distance in meters of a dropped point to the simplified line
+    :param keep: boolean mask of the points which are always kept, or None
+    :return: boolean mask of the kept points
+    """
+    count = len(x)
+    kept = np.zeros(count, dtype=bool)
+    if count == 0:
+        return kept
+    if keep is not None:
+        kept |= keep
+    kept[0] = kept[-1] = True
+    tolerance = tolerance * tolerance
+
+    # the undecided points, and the kept points before and after each of them; the forced points split the
+    # line into ranges which are simplified independently
+    active = np.flatnonzero(~kept)
+    anchors = np.flatnonzero(kept)
+    position = np.searchsorted(anchors, active)
+    first = anchors[position - 1]
+    last = anchors[position]
+    while len(active):
+        distances = segment_distances(x, y, active, first, last)
+        # the points of a range are consecutive in active, so every range is a group for reduceat
+        group_start = np.flatnonzero(np.diff(first, prepend=-1) != 0)
+        group = np.repeat(np.arange(len(group_start)), np.diff(np.append(group_start, len(active))))
+        farthest = np.maximum.reduceat(distances, group_start)
+        split = farthest > tolerance
+
+        # the first point at the largest distance of every range which is split
+        candidates = np.flatnonzero((distances == farthest[group]) & split[group])
+        candidates = candidates[np.diff(group[candidates], prepend=-1) != 0]
+        kept[active[candidates]] = True
+
+        split_at = np.zeros(len(group_start), dtype=np.int64)
+        split_at[group[candidates]] = active[candidates]
+        point_split = split_at[group]
+        remaining = split[group] & (active != point_split)
+        before = active < point_split
+        last = np.where(before, point_split, last)[remaining]
+        first = np.where(before, first, point_split)[remaining]
+        active = active[remaining]
+    return kept
+
+
+def simplify(longitude, latitude, tolerance, keep=None):
+    """
+    Simplifies a route.
+    :param longitude: array of longitudes
+    :param latitude: array of latitudes
+    :param tolerance: largest distance in meters of a dropped fix to the simplified route
+    :param keep: boolean mask of the fixes which are always kept, or None
+    :return: array of the indices of the kept fixes
+    """
+    x, y = project(longitude, latitude)
+    return np.flatnonzero(douglas_peucker(x, y, tolerance, keep))
+
+
+def levels(longitude, latitude, tolerances, keep=None):
+    """
+    Simplifies a route at several tolerances. Each level is simplified from the next finer level, which is the
+    same as simplifying the whole route (within the sum of the tolerances) but much faster.
+    :param longitude: array of longitudes
+    :param latitude: array of latitudes
+    :param tolerances: tolerances in meters, in any order
+    :param keep: boolean mask of the fixes which are kept at every level, or None
+    :return: dictionary of tolerance -> array of the indices of the kept fixes
+    """
+    x, y = project(longitude, latitude)
+    indices = np.arange(len(x))
+    if keep is None:
+        keep = np.zeros(len(x), dtype=bool)
+    result = {}
+    for tolerance in sorted(tolerances):
+        indices = indices[douglas_peucker(x[indices], y[indices], tolerance, keep[indices])]
+        result[tolerance] = indices
+    return result
+
+
+def compression_ratio(count, kept):
+    """
+    :param count: number of fixes of the route
+    :param kept: number of kept fixes
+    :return: count / kept
+    """
+    return count / kept if kept else 1.0
+
+
+def main(argv=None):
+    import GPSProject_program as program
+
+    parser = argparse.ArgumentParser(description="Simplifies gps tracks and reports the compression ratio.")
+    parser.add_argument("files", nargs="+", help="text, track or kml files")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="tolerance of the finest level in meters")
+    parser.add_argument("--levels", type=int, default=3, help="number of reported levels, 5 times coarser each")
+    parser.add_argument("--kml", metavar="DIR", help="directory for the level of detail kml files")
+    args = parser.parse_args(argv)
+    tolerances = [args.tolerance * 5 ** level for level in range(args.levels)]
+    if args.kml:
+        os.makedirs(args.kml, exist_ok=True)
+
+    print("file  fixes  " + "  ".join("{0:g} m".format(tolerance) for tolerance in tolerances))
+    for file in args.files:
+        path, filename = os.path.split(file)
+        track = program.load_track(path, filename)
+        simplified = levels(track.longitude, track.latitude, tolerances, program.detection_vertices(track))
+        print(filename, len(track), "  ".join("{0} ({1:.1f}x)".format(
+            len(simplified[tolerance]), compression_ratio(len(track), len(simplified[tolerance])))
+            for tolerance in tolerances))
+        if args.kml:
+            program.write_trip_kml(track, os.path.splitext(filename)[0], args.kml, args.tolerance)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import contextlib
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows, the peak memory is not reported there
+    resource = None
+
+"""
+Run statistics of the Fast and Safe Route Planning Project.
+
+FileStats collects, for one file, the wall and CPU time of every stage and the counts of the parser: lines read,
+$GPRMC sentences seen, sentences dropped as invalid ('V'), malformed (not 13 fields) or corrupted (a field which
+is not a number), and fixes kept. It also records why a file was rejected. The statistics travel with the result
+record of the file (also from the worker processes) and RunStats adds them up into a json report.
+
+Instrumentation is off unless a FileStats is passed, and the stage timers are then skipped with a single test per
+stage, so a normal run pays nothing per fix.
+"""
+
+COUNTS = ('lines', 'gprmc', 'invalid', 'malformed', 'corrupt', 'fixes')
+
+
+def peak_memory():
+    """
+    :return: peak resident memory of this process in bytes, or None where it is not available
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, kilobytes elsewhere
+
+
+class FileStats:
+    """
+    Statistics of one file.
+    """
+
+    def __init__(self, file_name):
+        """
+        :param file_name: name of the file
+        """
+        self.file_name = file_name
+        self.stages = {}  # stage -> [wall seconds, cpu seconds]
+        self.counts = dict.fromkeys(COUNTS, 0)
+        self.cached = False
+        self.rejection = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Measures the wall and CPU time of the code in the with block. A stage can be measured more than once,
+        the times are added up.
+        :param name: name of the stage
+        """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            times = self.stages.setdefault(name, [0.0, 0.0])
+            times[0] += time.perf_counter() - wall
+            times[1] += time.process_time() - cpu
+
+    def as_dict(self):
+        """
+        :return: the statistics as a json compatible dictionary
+        """
+        return {'file_name': self.file_name, 'cached': self.cached, 'rejection': self.rejection,
+                'stages': {name: {'wall': wall, 'cpu': cpu} for name, (wall, cpu) in self.stages.items()},
+                'counts': dict(self.counts), 'peak_memory': peak_memory()}
+
+
+def stage(stats, name):
+    """
+    :param stats: FileStats or None
+    :param name: name of the stage
+    :return: context manager measuring the stage, or doing nothing if stats is None
+    """
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.stage(name)
+
+
+class RunStats:
+    """
+    Statistics of a whole run, added up from the FileStats of every file.
+    """
+
+    def __init__(self):
+        self.files = []
+        self.run = FileStats(None)  # stages of the run which do not belong to one file
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def add(self, file_stats):
+        """
+        :param file_stats: dictionary from FileStats.as_dict()
+        :return:
+        """
+        self.files.append(file_stats)
+
+    def report(self):
+        """
+        :return: json compatible dictionary with the totals and the statistics of every file
+        """
+        stages = {}
+        counts = dict.fromkeys(COUNTS, 0)
+        rejections = {}
+        peaks = [peak_memory()]
+        for file_stats in self.files:
+            for name, times in file_stats['stages'].items():
+                total = stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+                total['wall'] += times['wall']
+                total['cpu'] += times['cpu']
+            for name, count in file_stats['counts'].items():
+                counts[name] += count
+            if file_stats['rejection'] is not None:
+                reason = file_stats['rejection']['reason']
+                rejections[reason] = rejections.get(reason, 0) + 1
+            peaks.append(file_stats['peak_memory'])
+        if resource is not None:
+            children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            peaks.append(children if sys.platform == 'darwin' else children * 1024)
+        peaks = [peak for peak in peaks if peak is not None]
+
+        return {'files': len(self.files),
+                'cached': sum(file_stats['cached'] for file_stats in self.files),
+                'rejected': sum(file_stats['rejection'] is not None for file_stats in self.files),
+                'wall': time.perf_counter() - self.wall,
+                'cpu': time.process_time() - self.cpu,
+                'peak_memory': max(peaks) if peaks else None,
+                'stages': stages,
+                'run_stages': self.run.as_dict()['stages'],
+                'counts': counts,
+                'rejections': rejections,
+                'per_file': self.files}
+
+    def save(self, file):
+        """
+        Writes the report to a json file.
+        :param file: path of the json file
+        :return:
+        """
+        with open(file, "w") as handle:
+            json.dump(self.report(), handle, indent=2)
@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import GPSProject_ingest
+import GPSProject_program as program
+
+"""
+Parameter sweep of the Fast and Safe Route Planning Project.
+
+The detector thresholds and the weights of the cost are constants of GPSProject_program, so trying other values
+used to mean running the whole pipeline again. The sweep splits the work in two:
+
+1) extract_features() reads every valid trip once and keeps only what the cost depends on: the trip time, the
+   top speed, the number of turns for every turn window (skip_size) and the dwell time and displacement of every
+   low speed segment for every low speed threshold.
+2) sweep() evaluates a grid of configurations on these features with array operations over all trips and all
+   configurations at once, and returns the best route of every configuration. A configuration only indexes into
+   the feature arrays, so thousands of them take a fraction of a second.
+
+The cost of a configuration is
+
+    w_time * (trip_time / 30) + w_stop_time * (minutes at stops / 15) + w_turns * (turns / 40)
+    + w_stops * (total stops / 20) + w_velocity * (top speed in mph / 60)
+
+The last two terms are the regularization which cost_function() computes but does not add, so their weights
+are 0 by default, and the default configuration gives exactly the costs of cost_function(). The 7 and 50 second
+limits between stop signs, traffic signals and errands are not parameters: every stationary segment counts as
+one stop and adds its dwell time whatever its class, so they cannot change a cost.
+
+Usage: python GPSProject_sweep.py [--jobs N] [--cache DIR] [--features FILE] [--slow 8,10,12] [--skip 20,30] ...
+"""
+
+# parameters of a configuration, and the values of GPSProject_program
+PARAMETERS = ('slow_threshold', 'displacement', 'skip_size', 'w_time', 'w_stop_time', 'w_turns', 'w_stops',
+              'w_velocity')
+DEFAULTS = {'slow_threshold': 10.0, 'displacement': 0.09, 'skip_size': 30, 'w_time': 0.5, 'w_stop_time': 0.15,
+            'w_turns': 0.15, 'w_stops': 0.0, 'w_velocity': 0.0}
+
+CONFIG_DTYPE = np.dtype([(name, np.int64 if name == 'skip_size' else np.float64) for name in PARAMETERS])
+
+
+def trip_features(path, filename, cache=None, slow_thresholds=(10.0,), skip_sizes=(30,), data=None):
+    """
+    Extracts the features of one trip. This is the unit of work handed to the worker processes.
+    :param path: directory of the text files
+    :param filename: name of the text or track file
+    :param cache: ParseCache or None
+    :param slow_thresholds: low speed thresholds in mph of segment_stops()
+    :param skip_sizes: window sizes of find_turns()
+    :param data: content of the text file if it was read already, e.g. from an archive
+    :return: dictionary with the file_name, trip_time, max_velocity, turns (one count per skip size) and
+             segments (one (dwell, displacement) pair of arrays per threshold), or None for an invalid trip
+    """
+    track = program.load_track(path, filename, cache, data)
+    if len(track) < 2 or program.rejection_reason(track) is not None:
+        return None
+    start = program.first_moving_index(track)
+    segments = []
+    for threshold in slow_thresholds:
+        table = program.segment_stops(track, start, threshold)
+        segments.append((table['dwell'], table['displacement']))
+    return {'file_name': filename,
+            'trip_time': program.trip_duration(track),
+            'max_velocity': float(track.speed.max()) * 1.1508,
+            'turns': [len(program.find_turns(track, start, skip_size)[0]) for skip_size in skip_sizes],
+            'segments': segments}
+
+
+class Features:
+    """
+    Features of all valid trips, as arrays with one row per trip (in file name order).
+    """
+
+    def __init__(self, file_names, trip_time, max_velocity, turns, skip_sizes, slow_thresholds, segment_group,
+                 dwell, displacement):
+        """
+        :param file_names: names of the trips
+        :param trip_time: array of the trip times
+        :param max_velocity: array of the top speeds in mph
+        :param turns: array of shape (trips, skip sizes) with the number of turns
+        :param skip_sizes: array of the skip sizes of the columns of turns
+        :param slow_thresholds: array of the low speed thresholds of the segments
+        :param segment_group: array with the group of every segment, threshold index * trips + trip index,
+                              sorted with the segments of a group in track order
+        :param dwell: array of the dwell times of the segments
+        :param displacement: array of the displacements of the segments in miles
+        """
+        self.file_names = list(file_names)
+        self.trip_time = np.asarray(trip_time, dtype=np.float64)
+        self.max_velocity = np.asarray(max_velocity, dtype=np.float64)
+        self.skip_sizes = np.asarray(skip_sizes, dtype=np.int64)
+        self.turns = np.asarray(turns, dtype=np.int64).reshape(len(self.file_names), len(self.skip_sizes))
+        self.slow_thresholds = np.asarray(slow_thresholds, dtype=np.float64)
+        self.segment_group = np.asarray(segment_group, dtype=np.int64)
+        self.dwell = np.asarray(dwell, dtype=np.float64)
+        self.displacement = np.asarray(displacement, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.file_names)
+
+    @classmethod
+    def from_trips(cls, trips, slow_thresholds, skip_sizes):
+        """
+        :param trips: dictionaries from trip_features() (None for invalid trips is skipped)
+        :param slow_thresholds: thresholds the trips were extracted with
+        :param skip_sizes: skip sizes the trips were extracted with
+        :return: Features
+        """
+        trips = [trip for trip in trips if trip is not None]
+        count = len(trips)
+        groups, dwell, displacement = [], [], []
+        for threshold in range(len(slow_thresholds)):
+            for index, trip in enumerate(trips):
+                segment_dwell, segment_displacement = trip['segments'][threshold]
+                groups.append(np.full(len(segment_dwell), threshold * count + index, dtype=np.int64))
+                dwell.append(segment_dwell)
+                displacement.append(segment_displacement)
+        return cls([trip['file_name'] for trip in trips], [trip['trip_time'] for trip in trips],
+                   [trip['max_velocity'] for trip in trips], [trip['turns'] for trip in trips], skip_sizes,
+                   slow_thresholds, np.concatenate(groups) if groups else [],
+                   np.concatenate(dwell) if dwell else [], np.concatenate(displacement) if displacement else [])
+
+    def covers(self, slow_thresholds, skip_sizes):
+        """
+        :return: True if the features were extracted for all the thresholds and skip sizes
+        """
+        return set(slow_thresholds) <= set(self.slow_thresholds.tolist()) and \
+            set(skip_sizes) <= set(self.skip_sizes.tolist())
+
+    def save(self, file):
+        """
+        Writes the features to a .npz file.
+        :param file: path of the file
+        :return:
+        """
+        with open(file, "wb") as handle:
+            np.savez(handle, file_names=np.array(self.file_names, dtype=str), trip_time=self.trip_time,
+                     max_velocity=self.max_velocity, turns=self.turns, skip_sizes=self.skip_sizes,
+                     slow_thresholds=self.slow_thresholds, segment_group=self.segment_group, dwell=self.dwell,
+                     displacement=self.displacement)
+
+    @classmethod
+    def load(cls, file):
+        """
+        :param file: path of a file written by save()
+        :return: Features
+        """
+        with np.load(file) as arrays:
+            return cls(arrays['file_names'].tolist(), arrays['trip_time'], arrays['max_velocity'], arrays['turns'],
+                       arrays['skip_sizes'], arrays['slow_thresholds'], arrays['segment_group'], arrays['dwell'],
+                       arrays['displacement'])
+
+    def stop_totals(self, displacements):
+        """
+        Time spent at stops and number of stops of every trip, for every threshold and displacement limit.
+        :param displacements: array of displacement limits in miles
+        :return: arrays of shape (trips, thresholds, displacements) with the seconds at stops and the stop counts
+        """
+        shape = (len(self.slow_thresholds) * len(self), len(displacements))
+        seconds = np.zeros(shape)
+        counts = np.zeros(shape, dtype=np.int64)
+        if len(self.dwell):
+            stationary = self.displacement[:, None] < np.asarray(displacements)[None, :]
+            # the segments of a group are consecutive, reduceat adds them up one by one in track order, so the
+            # totals are the same as those of detect_specific_stops()
+            starts = np.flatnonzero(np.diff(self.segment_group, prepend=-1) != 0)
+            groups = self.segment_group[starts]
+            seconds[groups] = np.add.reduceat(np.where(stationary, self.dwell[:, None], 0.0), starts, axis=0)
+            counts[groups] = np.add.reduceat(stationary.astype(np.int64), starts, axis=0)
+        shape = (len(self.slow_thresholds), len(self), len(displacements))
+        return seconds.reshape(shape).transpose(1, 0, 2), counts.reshape(shape).transpose(1, 0, 2)
+
+
+def extract_features(path, filenames=None, jobs=1, cache=None, slow_thresholds=(10.0,), skip_sizes=(30,),
+                     threads=4):
+    """
+    Extracts the features of every valid trip of an input root.
+    :param path: input root, a directory, tar archive or single log (see GPSProject_ingest)
+    :param filenames: names of the files, every file of the directory if None
+    :param jobs: number of worker processes, 1 extracts the trips serially in this process
+    :param cache: ParseCache or None
+    :param slow_thresholds: low speed thresholds in mph
+    :param skip_sizes: window sizes of the turn detector
+    :param threads: number of threads decompressing the compressed files of a directory
+    :return: Features
+    """
+    trips = list(GPSProject_ingest.map_inputs(trip_features, path, filenames, jobs, threads, cache, slow_thresholds,
+                                              skip_sizes))
+    return Features.from_trips(trips, slow_thresholds, skip_sizes)
+
+
+def configurations(grid):
+    """
+    Every combination of the values of a grid.
+    :param grid: dictionary of parameter -> list of values, a missing parameter has its default value
+    :return: structured array of CONFIG_DTYPE with one configuration per row
+    """
+    values = [np.asarray(grid.get(name, [DEFAULTS[name]]), dtype=CONFIG_DTYPE[name]) for name in PARAMETERS]
+    combinations = np.meshgrid(*values, indexing='ij')
+    configs = np.zeros(combinations[0].size, dtype=CONFIG_DTYPE)
+    for name, column in zip(PARAMETERS, combinations):
+        configs[name] = column.ravel()
+    return configs
+
+
+def costs(features, configs, stop_seconds=None, stop_counts=None, displacements=None):
+    """
+    Costs of every trip for every configuration.
+    :param features: Features
+    :param configs: structured array of configurations
+    :param stop_seconds: stop_totals() of the features for the displacements, computed if not given
+    :param stop_counts: stop_totals() of the features for the displacements, computed if not given
+    :param displacements: sorted array of the displacement limits of stop_seconds and stop_counts
+    :return: array of shape (trips, configurations)
+    """
+    if stop_seconds is None:
+        displacements = np.unique(configs['displacement'])
+        stop_seconds, stop_counts = features.stop_totals(displacements)
+    threshold = lookup(features.slow_thresholds, configs['slow_threshold'], 'low speed threshold')
+    skip = lookup(features.skip_sizes, configs['skip_size'], 'skip size')
+    displacement = lookup(displacements, configs['displacement'], 'displacement')
+
+    turns = features.turns[:, skip]
+    seconds = stop_seconds[:, threshold, displacement]
+    total_stops = stop_counts[:, threshold, displacement] + turns
+    # the same operations in the same order as trip_cost() and cost_function()
+    return (configs['w_time'] * (features.trip_time[:, None] / 30)) + \
+        (configs['w_stop_time'] * ((seconds / 60) / 15)) + (configs['w_turns'] * (turns / 40)) + \
+        (configs['w_stops'] * (total_stops / 20)) + (configs['w_velocity'] * (features.max_velocity[:, None] / 60))
+
+
+def lookup(values, wanted, name):
+    """
+    :param values: array of the values the features were extracted for
+    :param wanted: array of values
+    :param name: name of the parameter, for the error message
+    :return: array of the positions of wanted in values
+    """
+    unique, inverse = np.unique(wanted, return_inverse=True)
+    positions = {value: index for index, value in enumerate(np.asarray(values).tolist())}
+    missing = [value for value in unique.tolist() if value not in positions]
+    if missing:
+        raise ValueError("no features for the {0} {1}".format(name, missing))
+    return np.array([positions[value] for value in unique.tolist()], dtype=np.int64)[inverse.reshape(-1)]
+
+
+def sweep(features, configs, chunk_size=1024):
+    """
+    Finds the best route of every configuration. For the same cost the earlier file is better, like in
+    GPSProject_program.TripRanker.
+    :param features: Features
+    :param configs: structured array of configurations
+    :param chunk_size: number of configurations evaluated at once, which bounds the memory to
+                       trips * chunk_size costs
+    :return: array of the index of the best trip and array of its cost, one per configuration
+    """
+    best = np.full(len(configs), -1, dtype=np.int64)
+    best_cost = np.full(len(configs), np.nan)
+    if len(features) == 0:
+        return best, best_cost
+    displacements = np.unique(configs['displacement'])
+    stop_seconds, stop_counts = features.stop_totals(displacements)
+    for start in range(0, len(configs), chunk_size):
+        chunk = configs[start:start + chunk_size]
+        trip_costs = costs(features, chunk, stop_seconds, stop_counts, displacements)
+        best[start:start + len(chunk)] = np.argmin(trip_costs, axis=0)
+        best_cost[start:start + len(chunk)] = trip_costs[best[start:start + len(chunk)], np.arange(len(chunk))]
+    return best, best_cost
+
+
+def parse_values(text, kind=float):
+    """
+    :param text: comma separated values, e.g. '8,10,12'
+    :return: list of values
+    """
+    return [kind(value) for value in text.split(',') if value.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Finds the best route for a grid of thresholds and weights.",
+                                     parents=[program.input_arguments()])
+    parser.add_argument("--features", metavar="FILE", help="npz file of the features, reused if it covers the grid")
+    parser.add_argument("--json", metavar="FILE", help="write the best route of every configuration to a json file")
+    for name in PARAMETERS:
+        option = {'slow_threshold': 'slow', 'skip_size': 'skip'}.get(name, name.replace('_', '-'))
+        parser.add_argument("--" + option, dest=name, default=str(DEFAULTS[name]),
+                            help="comma separated values (default {0})".format(DEFAULTS[name]))
+    args = parser.parse_args(argv)
+    grid = {name: parse_values(getattr(args, name), int if name == 'skip_size' else float) for name in PARAMETERS}
+
+    features = None
+    if args.features and os.path.exists(args.features):
+        features = Features.load(args.features)
+        if not features.covers(grid['slow_threshold'], grid['skip_size']):
+            features = None
+    if features is None:
+        jobs, cache = program.open_inputs(args)
+        started = time.perf_counter()
+        features = extract_features(args.input, jobs=jobs, cache=cache,
+                                    slow_thresholds=tuple(grid['slow_threshold']), skip_sizes=tuple(grid['skip_size']))
+        print("features of", len(features), "trips extracted in {0:.2f} s".format(time.perf_counter() - started))
+        if args.features:
+            features.save(args.features)
+
+    configs = configurations(grid)
+    started = time.perf_counter()
+    best, best_cost = sweep(features, configs)
+    print(len(configs), "configurations swept in {0:.3f} s".format(time.perf_counter() - started))
+    if len(features) == 0:
+        print("no valid trips")
+        return
+
+    trips, wins = np.unique(best, return_counts=True)
+    print("configurations  file")
+    for trip, count in sorted(zip(trips.tolist(), wins.tolist()), key=lambda item: -item[1]):
+        print("{0:<15} {1}".format(count, features.file_names[trip]))
+
+    if args.json:
+        results = [dict({name: config[name].item() for name in PARAMETERS}, file_name=features.file_names[trip],
+                        cost=float(cost)) for config, trip, cost in zip(configs, best.tolist(), best_cost.tolist())]
+        with open(args.json, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
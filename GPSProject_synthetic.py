@@ -0,0 +1,201 @@
+import argparse
+import math
+import os
+
+import numpy as np
+
+import GPSProject_program as program
+
+"""
+Synthetic gps logs for the Fast and Safe Route Planning Project.
+
+The 173 text files of the project are not part of the repository, so benchmarks and tests need generated input.
+synthetic_track() drives a car through a grid of streets: straight legs at cruise speed, each ending with a turn,
+a stop sign, a traffic signal or an errand, with the densities (per km) of each event as parameters. The route
+is then rotated and scaled so that it starts at coord1 and ends at coord2 of within_radius(), which keeps stops
+stationary and turns at 90 degrees (for trips much shorter or longer than the real 20 km trip the distances
+between fixes are scaled, the speeds are not).
+
+write_nmea() writes a track as a log like the ones of the project: 5 header lines, then a $GPGGA and a $GPRMC
+sentence per fix, with a share of the $GPRMC sentences marked invalid ('V') or malformed (a missing field).
+
+Usage: python GPSProject_synthetic.py DIRECTORY [--trips N] [--fixes N] [--seed N] ...
+"""
+
+# the start and end points of the trips, see GPSProject_program.within_radius()
+START = program.COORD1
+END = program.COORD2
+
+MPH_TO_MPS = 0.44704
+KNOTS_TO_MPH = 1.1508
+
+# number of header lines of a log, see GPSProject_program.gprmc_fields()
+HEADER_LINES = 5
+
+
+def ramp(speed_from, speed_to, seconds):
+    """
+    :return: speeds of a linear acceleration from speed_from to speed_to, without the first speed
+    """
+    return np.linspace(speed_from, speed_to, seconds + 1)[1:]
+
+
+def synthetic_track(fixes=3600, turns_per_km=1.0, stop_signs_per_km=0.5, signals_per_km=0.5, errands_per_km=0.05,
+                    noise=0.5, start_time=14 * 3600, seed=0):
+    """
+    Generates the track of a trip with one fix per second.
+    :param fixes: number of fixes of the trip
+    :param turns_per_km: number of left and right turns per km driven
+    :param stop_signs_per_km: number of stop signs per km driven
+    :param signals_per_km: number of stops at traffic signals per km driven
+    :param errands_per_km: number of errands per km driven
+    :param noise: standard deviation of the position error in meters
+    :param start_time: seconds since midnight of the first fix
+    :param seed: seed of the random generator, the same seed gives the same track
+    :return: Track
+    """
+    rng = np.random.default_rng(seed)
+    kinds = ('turn', 'stop_sign', 'signal', 'errand')
+    densities = np.array([turns_per_km, stop_signs_per_km, signals_per_km, errands_per_km], dtype=np.float64)
+    if fixes < 2 or densities.sum() <= 0:
+        raise ValueError("a trip needs at least 2 fixes and some events")
+    probabilities = densities / densities.sum()
+
+    # the car drives on a grid of streets, mostly towards the end: 0 is straight towards it, -1 and 1 are the
+    # streets 90 degrees to the left and right, so it never turns back
+    speeds = []
+    headings = []
+    street = 0
+    count = 0
+    while count < fixes:
+        cruise = rng.uniform(25, 45)  # mph
+        length = max(rng.exponential(1 / densities.sum()), 0.05)  # km
+        seconds = max(int(length * 1000 / (cruise * MPH_TO_MPS)), 3)
+        leg = [cruise + rng.normal(0, 0.5, seconds)]
+        heading = [np.full(seconds, street * 90.0)]
+
+        kind = kinds[rng.choice(len(kinds), p=probabilities)]
+        if kind == 'turn':
+            turn = rng.choice((-1, 1)) if street == 0 else -street
+            leg += [ramp(cruise, 12, 4), np.full(6, 12.0), ramp(12, cruise, 4)]
+            heading += [np.full(4, street * 90.0), street * 90.0 + np.linspace(0, turn * 90.0, 7)[1:],
+                        np.full(4, (street + turn) * 90.0)]
+            street += turn
+        else:
+            dwell = {'stop_sign': (1, 4), 'signal': (12, 44), 'errand': (60, 600)}[kind]
+            dwell = int(rng.integers(*dwell))
+            leg += [ramp(cruise, 0, 5), np.zeros(dwell), ramp(0, cruise, 5)]
+            heading.append(np.full(10 + dwell, street * 90.0))
+        speeds.extend(leg)
+        headings.extend(heading)
+        count += sum(len(part) for part in leg)
+
+    speed = np.maximum(np.concatenate(speeds)[:fixes], 0)  # mph
+    heading = np.concatenate(headings)[:fixes]
+
+    # drive in a local frame in meters (x east, y north) where the end is straight north, heading 0
+    step = speed * MPH_TO_MPS
+    x = np.concatenate(([0.0], np.cumsum(step * np.sin(np.radians(heading)))[:-1]))
+    y = np.concatenate(([0.0], np.cumsum(step * np.cos(np.radians(heading)))[:-1]))
+
+    # rotate and scale the route onto the line from START to END
+    scale = math.cos(math.radians(START[1]))
+    target_x = math.radians(END[0] - START[0]) * program.EARTH_RADIUS['m'] * scale
+    target_y = math.radians(END[1] - START[1]) * program.EARTH_RADIUS['m']
+    route = complex(x[-1], y[-1])
+    if route == 0:
+        route = 1j
+    transform = complex(target_x, target_y) / route
+    points = (x + 1j * y) * transform
+    rotation = -math.degrees(math.atan2(transform.imag, transform.real))  # clockwise, like the headings
+
+    error = rng.normal(0, noise, fixes) + 1j * rng.normal(0, noise, fixes)
+    error[0] = error[-1] = 0  # the trip starts and ends exactly at START and END
+    points += error
+    longitude = START[0] + np.degrees(points.real / (program.EARTH_RADIUS['m'] * scale))
+    latitude = START[1] + np.degrees(points.imag / program.EARTH_RADIUS['m'])
+    angle = (heading + rotation + rng.normal(0, 0.5, fixes)) % 360
+    knots = np.where(speed > 0, speed / KNOTS_TO_MPH, rng.uniform(0, 0.05, fixes))
+    return program.Track(longitude, latitude, knots, program.clock_times(fixes, start_time), angle)
+
+
+def degrees_minutes(value):
+    """
+    :return: absolute values of the coordinates in the ddmm.mmmm form of the sentences
+    """
+    value = np.abs(value)
+    degrees = np.trunc(value)
+    return degrees * 100 + (value - degrees) * 60
+
+
+def checksums(bodies):
+    """
+    NMEA checksums (the xor of all characters between '$' and '*') of many sentences at once.
+    :param bodies: list of sentences without '$' and '*'
+    :return: list of checksums as 2 digit hex strings
+    """
+    table = np.array([body.encode() for body in bodies])
+    characters = table.view(np.uint8).reshape(len(bodies), -1)
+    return ['%02X' % value for value in np.bitwise_xor.reduce(characters, axis=1).tolist()]
+
+
+def write_nmea(file, track, invalid_rate=0.01, malformed_rate=0.0, date="051019", seed=0, chunk_size=100000):
+    """
+    Writes a track as a gps log with a $GPGGA and a $GPRMC sentence per fix.
+    :param file: path of the log
+    :param track: Track
+    :param invalid_rate: share of the $GPRMC sentences marked as invalid ('V')
+    :param malformed_rate: share of the $GPRMC sentences with a missing field
+    :param date: date of the trip in the ddmmyy form
+    :param seed: seed of the random generator
+    :param chunk_size: number of fixes formatted at once
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    with open(file, "w", buffering=1024 * 1024) as handle:
+        handle.writelines("header{0}\n".format(line) for line in range(HEADER_LINES))
+        for start in range(0, len(track), chunk_size):
+            end = min(start + chunk_size, len(track))
+            time = track.time[start:end].tolist()
+            latitude = degrees_minutes(track.latitude[start:end]).tolist()
+            north = np.where(track.latitude[start:end] >= 0, 'N', 'S').tolist()
+            longitude = degrees_minutes(track.longitude[start:end]).tolist()
+            east = np.where(track.longitude[start:end] >= 0, 'E', 'W').tolist()
+            status = np.where(rng.random(end - start) < invalid_rate, 'V', 'A').tolist()
+            malformed = (rng.random(end - start) < malformed_rate).tolist()
+
+            gga = ['GPGGA,%09.2f,%09.4f,%s,%010.4f,%s,1,08,0.9,545.4,M,46.9,M,,' % row
+                   for row in zip(time, latitude, north, longitude, east)]
+            rmc = ['GPRMC,%09.2f,%s,%09.4f,%s,%010.4f,%s,%.2f,%.2f,' % row + date + ',,,A'
+                   for row in zip(time, status, latitude, north, longitude, east, track.speed[start:end].tolist(),
+                                  track.angle[start:end].tolist())]
+            rmc = [sentence.replace(',,,A', ',,A') if broken else sentence for sentence, broken in zip(rmc, malformed)]
+            lines = ['$%s*%s\n$%s*%s\n' % row for row in zip(gga, checksums(gga), rmc, checksums(rmc))]
+            handle.writelines(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes synthetic gps logs.")
+    parser.add_argument("directory", help="directory of the logs, created if needed")
+    parser.add_argument("--trips", type=int, default=10, help="number of logs")
+    parser.add_argument("--fixes", type=int, default=3600, help="number of fixes per trip (one per second)")
+    parser.add_argument("--turns", type=float, default=1.0, help="left and right turns per km")
+    parser.add_argument("--stop-signs", type=float, default=0.5, help="stop signs per km")
+    parser.add_argument("--signals", type=float, default=0.5, help="traffic signals per km")
+    parser.add_argument("--errands", type=float, default=0.05, help="errands per km")
+    parser.add_argument("--invalid", type=float, default=0.01, help="share of invalid $GPRMC sentences")
+    parser.add_argument("--malformed", type=float, default=0.0, help="share of malformed $GPRMC sentences")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first trip, the next trips count up")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.directory, exist_ok=True)
+    for trip in range(args.trips):
+        seed = args.seed + trip
+        track = synthetic_track(args.fixes, args.turns, args.stop_signs, args.signals, args.errands, seed=seed)
+        file = os.path.join(args.directory, "synthetic_{0:06d}_gps_file.txt".format(seed))
+        write_nmea(file, track, args.invalid, args.malformed, seed=seed)
+        print(file, len(track), "fixes")
+
+
+if __name__ == '__main__':
+    main()
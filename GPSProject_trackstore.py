@@ -0,0 +1,103 @@
+import argparse
+import os
+
+import numpy as np
+
+"""
+Binary track files (.trk) of the Fast and Safe Route Planning Project.
+
+A track file is written once when a text file is ingested and can then be read any number of times without
+parsing. It consists of a 16 byte header followed by one fixed size record per fix:
+
+header  - 6 byte magic b"GPSTRK", 1 byte padding, 1 byte format version, 8 byte little endian number of records
+record  - longitude, latitude, speed, time and tracking angle as little endian float64 (40 bytes)
+
+The records are read with a read-only memory map, so the columns are zero-copy views into the page cache and
+any number of processes can share one track file without loading it into their own memory.
+
+Usage: python GPSProject_trackstore.py SOURCE_DIR DESTINATION_DIR  (converts every .txt file)
+"""
+
+MAGIC = b"GPSTRK"
+FORMAT_VERSION = 1
+HEADER = np.dtype([('magic', 'S6'), ('padding', 'u1'), ('version', 'u1'), ('count', '<u8')])
+RECORD = np.dtype([('longitude', '<f8'), ('latitude', '<f8'), ('speed', '<f8'), ('time', '<f8'), ('angle', '<f8')])
+SUFFIX = ".trk"
+
+
+def write_track(file, longitude, latitude, speed, time, angle):
+    """
+    Writes a track file. The file is written next to its final name first and then renamed, so readers never
+    map a partially written file.
+    :param file: path of the track file
+    :param longitude, latitude, speed, time, angle: arrays of the same length
+    :return:
+    """
+    records = np.empty(len(time), dtype=RECORD)
+    records['longitude'] = longitude
+    records['latitude'] = latitude
+    records['speed'] = speed
+    records['time'] = time
+    records['angle'] = angle
+    header = np.array((MAGIC, 0, FORMAT_VERSION, len(records)), dtype=HEADER)
+
+    temporary = file + ".tmp"
+    with open(temporary, "wb") as handle:
+        handle.write(header.tobytes())
+        handle.write(records.tobytes())
+    os.replace(temporary, file)
+
+
+def map_track(file):
+    """
+    Maps the records of a track file into memory without reading them.
+    :param file: path of the track file
+    :return: read-only structured array with the fields of RECORD
+    """
+    header = np.fromfile(file, dtype=HEADER, count=1)
+    if len(header) != 1 or header['magic'][0] != MAGIC:
+        raise ValueError(file + " is not a track file")
+    if header['version'][0] != FORMAT_VERSION:
+        raise ValueError(file + " has track format version " + str(header['version'][0]))
+    count = int(header['count'][0])
+    if os.path.getsize(file) != HEADER.itemsize + count * RECORD.itemsize:
+        raise ValueError(file + " is truncated")
+    if count == 0:
+        return np.empty(0, dtype=RECORD)
+    return np.memmap(file, dtype=RECORD, mode='r', offset=HEADER.itemsize, shape=(count,))
+
+
+def convert_text_files(source, destination):
+    """
+    Converts every .txt file of the source directory to a track file in the destination directory. All valid
+    $GPRMC fixes are kept, the start and end points are checked later by the program as for the text files.
+    :param source: directory of the text files
+    :param destination: directory of the track files, created if needed
+    :return: number of converted files
+    """
+    import GPSProject_program as program
+
+    os.makedirs(destination, exist_ok=True)
+    converted = 0
+    for filename in sorted(os.listdir(source)):
+        if not filename.endswith(".txt"):
+            continue
+        with open(os.path.join(source, filename)) as handle:
+            track = program.read_track(handle)
+        write_track(os.path.join(destination, filename[:len(filename) - 4] + SUFFIX), track.longitude,
+                    track.latitude, track.speed, track.time, track.angle)
+        print(filename, "->", len(track), "fixes")
+        converted += 1
+    return converted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Converts gps text files to binary track files.")
+    parser.add_argument("source", help="directory of the text files")
+    parser.add_argument("destination", help="directory of the track files")
+    args = parser.parse_args(argv)
+    print("Converted", convert_text_files(args.source, args.destination), "files")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import glob
+import os
+
+import numpy as np
+
+import GPSProject_program as program
+
+"""
+Tests of the vectorized detectors against the while-loops of the original detectors.
+"""
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "RouteExamplesKML")
+
+
+def reference_turns(track, start, skip_size):
+    """
+    The original turn detector, one coordinate at a time.
+    :return: list of (index, direction) of the turns
+    """
+    turns = []
+    while start < len(track) - skip_size:
+        current_coord = track.angle[start]
+        next_coord = track.angle[start + skip_size]
+        if current_coord < next_coord and -120 < current_coord - next_coord < -60:
+            turns.append((start, program.RIGHT_TURN))
+            start = start + skip_size
+        elif current_coord <= next_coord and 60 < current_coord - next_coord + 360 < 120:
+            turns.append((start, program.LEFT_TURN))
+            start = start + skip_size
+        elif current_coord > next_coord and 60 < current_coord - next_coord < 120:
+            turns.append((start, program.LEFT_TURN))
+            start = start + skip_size
+        else:
+            start += 1
+    return turns
+
+
+def reference_segments(track, start):
+    """
+    The original stop detector, one coordinate at a time. It compared a low speed fix at the very end of the track
+    with the first fix of the track, such a fix is not a segment here, like in segment_stops().
+    :return: list of (start, end, dwell, displacement) of the low speed segments
+    """
+    segments = []
+    last = len(track) - 1
+    while start < len(track):
+        if track.speed[start] * 1.1508 <= 10:
+            if start == last:
+                break
+            next_point = start + 1
+            new_speed = track.speed[next_point] * 1.1508
+            while 0.0 <= new_speed <= 10 and next_point < last:
+                new_speed = track.speed[next_point] * 1.1508
+                next_point += 1
+            displacement = program.haversine_array((track.longitude[start], track.latitude[start]),
+                                                   (track.longitude[next_point], track.latitude[next_point]),
+                                                   unit='mi')
+            segments.append((start, next_point, abs(track.time[start] - track.time[next_point]),
+                             float(displacement)))
+            start = next_point
+        start += 1
+    return segments
+
+
+def random_track(generator, fixes):
+    """
+    :return: Track with slow and fast runs, invalid (negative) speeds and headings which cross 0 degrees
+    """
+    speed = np.where(generator.random(fixes) < 0.5, generator.uniform(0, 9, fixes), generator.uniform(8, 40, fixes))
+    speed[generator.random(fixes) < 0.05] = -1.0
+    angle = np.cumsum(generator.choice([0.0, 0.0, 0.0, 90.0, -90.0, 75.0], fixes)) % 360
+    return program.Track(generator.uniform(-77.7, -77.6, fixes), generator.uniform(43.0, 43.1, fixes), speed,
+                         np.cumsum(generator.integers(1, 20, fixes)).astype(np.float64) + 170000, angle)
+
+
+def tracks():
+    """
+    :return: the example routes of the repository and random tracks
+    """
+    examples = [program.read_kml_track(file) for file in sorted(glob.glob(os.path.join(EXAMPLES, "*.kml")))]
+    generator = np.random.default_rng(3)
+    return examples + [random_track(generator, int(generator.integers(2, 300))) for _ in range(200)]
+
+
+def test_find_turns_matches_the_original_loop():
+    for track in tracks():
+        for start, skip_size in ((0, 30), (program.first_moving_index(track), 30), (5, 7)):
+            indices, directions = program.find_turns(track, start, skip_size)
+            assert list(zip(indices.tolist(), directions.tolist())) == reference_turns(track, start, skip_size)
+
+
+def test_segment_stops_matches_the_original_loop():
+    for track in tracks():
+        for start in (0, program.first_moving_index(track)):
+            segments = program.segment_stops(track, start)
+            expected = reference_segments(track, start)
+            assert segments['start'].tolist() == [segment[0] for segment in expected]
+            assert segments['end'].tolist() == [segment[1] for segment in expected]
+            assert segments['dwell'].tolist() == [segment[2] for segment in expected]
+            assert np.allclose(segments['displacement'], [segment[3] for segment in expected])
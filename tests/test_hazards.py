@@ -0,0 +1,90 @@
+import numpy as np
+
+import GPSProject_hazards
+
+"""
+Tests of the cross-trip hazard index.
+"""
+
+
+def noisy_detections(points, repeats, noise, limit, seed=0):
+    """
+    :param points: (longitude, latitude) array of the true positions
+    :param repeats: number of detections of every point, after two detections limit meters north and south of it
+    :param noise: standard deviation of the detection error in meters
+    :param limit: largest detection error in meters
+    :return: longitudes and latitudes of the detections, the two first detections of every point first
+    """
+    generator = np.random.default_rng(seed)
+    error = generator.normal(0.0, noise, (len(points) * repeats, 2))
+    error *= np.minimum(1.0, limit / np.maximum(np.hypot(error[:, 0], error[:, 1]), 1e-9))[:, None]
+    point = np.concatenate((np.arange(len(points)), np.arange(len(points)),
+                            generator.permutation(np.repeat(np.arange(len(points)), repeats))))
+    error = np.concatenate(([[0.0, limit]] * len(points), [[0.0, -limit]] * len(points), error))
+    latitudes = points[point, 1] + error[:, 1] / GPSProject_hazards.METERS_PER_DEGREE
+    longitudes = points[point, 0] + error[:, 0] / (GPSProject_hazards.METERS_PER_DEGREE * np.cos(np.radians(latitudes)))
+    return longitudes, latitudes
+
+
+def grid_points(count, spacing, origin=(-81.83, 41.46)):
+    """
+    :return: (longitude, latitude) array of count points on a square grid, spacing meters apart
+    """
+    side = int(np.ceil(np.sqrt(count)))
+    rows, columns = np.divmod(np.arange(count), side)
+    latitudes = origin[1] + rows * spacing / GPSProject_hazards.METERS_PER_DEGREE
+    longitudes = origin[0] + columns * spacing / (GPSProject_hazards.METERS_PER_DEGREE *
+                                                  np.cos(np.radians(latitudes)))
+    return np.column_stack((longitudes, latitudes))
+
+
+def test_noisy_detections_give_one_hazard_per_point():
+    points = grid_points(200, 150.0)
+    # every detection is within the merge radius of its point, but the first two are too far apart to be merged
+    longitudes, latitudes = noisy_detections(points, 50, 5.0, 14.0)
+    index = GPSProject_hazards.HazardIndex(25.0)
+    for trip, chunk in enumerate(np.array_split(np.arange(len(longitudes)), 100)):
+        index.add('stop_sign', longitudes[chunk], latitudes[chunk], np.ones(len(chunk)), trip)
+    assert len(index) > len(points)
+    index.consolidate()
+
+    hazards = index.hazards()
+    assert len(hazards) == len(points)
+    assert hazards['observations'].sum() == len(longitudes)
+    # every hazard is at the mean of the detections of one point
+    for hazard in hazards:
+        distance = GPSProject_hazards.program.haversine_array(
+            (hazard['latitude'], hazard['longitude']), points[:, ::-1], unit='m')
+        assert distance.min() < 5.0
+
+
+def test_consolidate_maps_the_ids_of_merged_hazards():
+    index = GPSProject_hazards.HazardIndex(25.0)
+    index.add('node', [-81.83], [41.46], [0.0], 0)
+    # two hazards 30 m apart, whose means drift together by the later detections
+    offset = 30.0 / GPSProject_hazards.METERS_PER_DEGREE
+    first, = index.add('stop_sign', [-81.80], [41.50], [1.0], 1)
+    second, = index.add('stop_sign', [-81.80], [41.50 + offset], [3.0], 2)
+    index.add('stop_sign', [-81.80] * 4, [41.50 + offset * 0.6] * 2 + [41.50 + offset * 0.4] * 2, [0.0] * 4, 3)
+
+    mapping = index.consolidate()
+    assert mapping[first] == mapping[second] == 1
+    assert mapping[0] == 0
+    assert len(index) == 2
+    assert index.observations == [1, 6]
+    assert index.trips == [1, 3]
+    assert index.total_dwell[1] == 4.0
+    assert index.within(-81.80, 41.50 + offset / 2, 10.0)['observations'].tolist() == [6]
+
+
+def test_hazards_are_found_after_they_moved_to_another_cell():
+    index = GPSProject_hazards.HazardIndex(25.0)
+    step = 20.0 / GPSProject_hazards.METERS_PER_DEGREE
+    # every detection is within the merge radius of the mean, which walks north across several cells
+    latitude = 41.5
+    for _ in range(20):
+        index.add('errand', [-81.8], [latitude], [60.0])
+        latitude = index.latitude[0] + step
+    assert len(index) == 1
+    assert index.cells[0] == index.cell(index.longitude[0], index.latitude[0])
+    assert len(index.within(index.longitude[0], index.latitude[0], 1.0)) == 1
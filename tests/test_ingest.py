@@ -0,0 +1,31 @@
+import io
+import tarfile
+
+import GPSProject_ingest
+
+"""
+Tests of the input roots.
+"""
+
+
+def add_member(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+def test_members_with_the_same_file_name_stay_apart(tmp_path):
+    file = str(tmp_path / "logs.tar.gz")
+    with tarfile.open(file, "w:gz") as archive:
+        add_member(archive, "./monday/trip.txt", b"first")
+        add_member(archive, "tuesday/trip.txt", b"second")
+        add_member(archive, "../outside.txt", b"skipped")
+
+    assert [(name, data) for _, name, data in GPSProject_ingest.iter_inputs(file)] == \
+        [("monday/trip.txt", b"first"), ("tuesday/trip.txt", b"second")]
+    assert GPSProject_ingest.read_input(file, "tuesday/trip.txt") == b"second"
+
+    # an archive in a directory is named like a directory
+    assert [name for _, name, _ in GPSProject_ingest.iter_inputs(str(tmp_path))] == \
+        ["logs.tar.gz/monday/trip.txt", "logs.tar.gz/tuesday/trip.txt"]
+    assert GPSProject_ingest.read_input(str(tmp_path), "logs.tar.gz/monday/trip.txt") == b"first"
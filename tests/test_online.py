@@ -0,0 +1,77 @@
+import glob
+import os
+
+import numpy as np
+
+import GPSProject_online
+import GPSProject_program as program
+import GPSProject_synthetic
+
+"""
+Tests of the online scorer against score_track() of the whole track.
+"""
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "RouteExamplesKML")
+KEYS = ('left_right_coordinates', 'turn_directions', 'stop_signs', 'traffic_signals', 'errands', 'trip_time', 'cost')
+
+
+def assert_same_result(result, expected):
+    for key in KEYS:
+        assert result[key] == expected[key], key
+    assert result['stop_segments'].tolist() == expected['stop_segments'].tolist()
+
+
+def test_online_scorer_matches_score_track_on_the_example_routes():
+    files = sorted(glob.glob(os.path.join(EXAMPLES, "*.kml")))
+    assert files
+    for file in files:
+        track = program.read_kml_track(file)
+        scorer = GPSProject_online.OnlineScorer()
+        events = []
+        for fix in track:
+            events.extend(scorer.update(fix))
+        events.extend(scorer.finish())
+        expected = program.score_track(track)
+        assert_same_result(scorer.result(), expected)
+        # every hazard was reported once, with the final cost after the last one
+        hazards = [event for event in events if event['kind'] != 'stop']
+        assert len(hazards) == sum(len(expected[key]) for key in KEYS[:1] + KEYS[2:5])
+        if hazards:
+            assert hazards[-1]['cost'] <= expected['cost']
+
+
+def test_score_stream_replays_a_gps_log(tmp_path):
+    for seed in range(3):
+        file = str(tmp_path / "trip_{0}.txt".format(seed))
+        GPSProject_synthetic.write_nmea(file, GPSProject_synthetic.synthetic_track(1800, seed=seed), seed=seed)
+        with open(file) as handle:
+            events = GPSProject_online.score_stream(handle)
+            while True:
+                try:
+                    next(events)
+                except StopIteration as stop:
+                    scorer = stop.value
+                    break
+        with open(file) as handle:
+            expected = program.score_track(program.read_track(handle))
+        assert_same_result(scorer.result(), expected)
+        assert scorer.result()['cost'] > 0
+
+
+def test_online_scorer_matches_score_track_on_random_tracks():
+    generator = np.random.default_rng(5)
+    for trial in range(200):
+        fixes = int(generator.integers(2, 200))
+        speed = np.where(generator.random(fixes) < 0.5, generator.uniform(0, 9, fixes),
+                         generator.uniform(8, 40, fixes))
+        speed[generator.random(fixes) < 0.05] = -1.0
+        if trial % 4 == 0:
+            speed[-1] = 0.0  # a stop which is still in progress at the end of the trip
+        track = program.Track(generator.uniform(-77.7, -77.6, fixes), generator.uniform(43.0, 43.1, fixes), speed,
+                              np.cumsum(generator.integers(1, 20, fixes)).astype(np.float64) + 170000,
+                              generator.uniform(0, 360, fixes))
+        scorer = GPSProject_online.OnlineScorer()
+        for fix in track:
+            scorer.update(fix)
+        scorer.finish()
+        assert_same_result(scorer.result(), program.score_track(track))